@@ -0,0 +1,184 @@
+# admission.py
+"""Admission control for release-day traffic spikes.
+
+When results are published, student logins and results pages arrive far
+faster than PBKDF2 verification and the database can serve them. Without a
+limit every request slows down together, admin work included. Here each
+request passes through a small number of gates before its view runs:
+
+* every gated request goes through the 'all' gate, which caps the requests
+  doing work at once;
+* expensive routes also go through their own gate first (logins, results
+  pages, uploads), so one of them cannot take every slot.
+
+A gate lets `limit` requests in at a time and keeps up to `queue_size` more
+waiting. Waiters are served by priority class (ADMIN, then STUDENT, then
+UPLOAD) and in arrival order within a class. A request that finds the queue
+full, or that waits longer than `max_wait` seconds, is rejected at once so the
+caller can answer 503 with a Retry-After estimate instead of timing out. A
+higher-priority arrival pushes out the lowest-priority waiter of a full queue.
+
+Gates are per process; with several workers each has its own.
+"""
+import heapq
+import itertools
+import math
+import threading
+import time
+from collections import Counter
+
+# Priority classes, lower is served first
+ADMIN, STUDENT, UPLOAD = 0, 1, 2
+PRIORITY_NAMES = {ADMIN: 'admin', STUDENT: 'student', UPLOAD: 'upload'}
+
+# name: (concurrency limit, queue size, max wait in seconds)
+DEFAULT_GATES = {
+    'all': (32, 256, 10),
+    # PBKDF2 verification is CPU bound; more at once only makes each slower
+    'login': (4, 64, 10),
+    'results': (12, 128, 10),
+    'uploads': (2, 16, 20),
+}
+
+# endpoint: gates passed before 'all'
+DEFAULT_ROUTES = {
+    'login': ('login',),
+    'student_dashboard': ('results',),
+    'student_results': ('results',),
+    'upload_document': ('uploads',),
+}
+
+# Seconds suggested in Retry-After
+MIN_RETRY_AFTER, MAX_RETRY_AFTER = 1, 60
+
+
+class Rejected(Exception):
+    """A request turned away by a gate"""
+
+    def __init__(self, gate, reason, retry_after):
+        super().__init__(f'{gate} gate: {reason}')
+        self.gate = gate
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ('event', 'state')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.state = 'waiting'
+
+
+class Gate:
+    def __init__(self, name, limit, queue_size, max_wait):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait
+        self.active = 0
+        self.admitted = Counter()
+        self.shed = Counter()
+        # Moving average of the time a request holds a slot
+        self.service_seconds = 0.05
+        self._lock = threading.Lock()
+        self._waiters = []
+        self._order = itertools.count()
+
+    def retry_after(self):
+        """Seconds until the current queue has probably drained"""
+        seconds = self.service_seconds * (len(self._waiters) / max(self.limit, 1) + 1)
+        return min(MAX_RETRY_AFTER, max(MIN_RETRY_AFTER, math.ceil(seconds)))
+
+    def _reject(self, priority, reason):
+        self.shed[(priority, reason)] += 1
+        return Rejected(self.name, reason, self.retry_after())
+
+    def acquire(self, priority):
+        """Wait for a slot. Raises Rejected when the queue is full or the wait is too long."""
+        with self._lock:
+            if self.active < self.limit and not self._waiters:
+                self.active += 1
+                self.admitted[priority] += 1
+                return
+            if len(self._waiters) >= self.queue_size:
+                lowest = max(self._waiters, default=None)
+                if lowest is None or lowest[0] <= priority:
+                    raise self._reject(priority, 'queue full')
+                self._waiters.remove(lowest)
+                heapq.heapify(self._waiters)
+                lowest[2].state = 'displaced'
+                lowest[2].event.set()
+            waiter = _Waiter()
+            entry = (priority, next(self._order), waiter)
+            heapq.heappush(self._waiters, entry)
+
+        waiter.event.wait(self.max_wait)
+        with self._lock:
+            # release() may have handed over the slot just as the wait ran out
+            if waiter.state == 'admitted':
+                self.admitted[priority] += 1
+                return
+            if waiter.state == 'waiting':
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+                raise self._reject(priority, 'timeout')
+            raise self._reject(priority, 'displaced')
+
+    def release(self, held_seconds=None):
+        with self._lock:
+            if held_seconds is not None:
+                self.service_seconds = 0.9 * self.service_seconds + 0.1 * held_seconds
+            if self._waiters:
+                # The slot passes straight to the next waiter, so active stays the same
+                _, _, waiter = heapq.heappop(self._waiters)
+                waiter.state = 'admitted'
+                waiter.event.set()
+            else:
+                self.active -= 1
+
+    def metrics(self):
+        with self._lock:
+            queued = Counter(priority for priority, _, _ in self._waiters)
+            return {
+                'limit': self.limit,
+                'queue_size': self.queue_size,
+                'active': self.active,
+                'queue_depth': len(self._waiters),
+                'queued': {PRIORITY_NAMES[p]: queued[p] for p in PRIORITY_NAMES},
+                'admitted': {PRIORITY_NAMES[p]: self.admitted[p] for p in PRIORITY_NAMES},
+                'shed': {f'{PRIORITY_NAMES[p]}:{reason}': count for (p, reason), count in sorted(self.shed.items())},
+                'shed_total': sum(self.shed.values()),
+                'avg_service_ms': round(self.service_seconds * 1000, 1),
+            }
+
+
+class AdmissionControl:
+    def __init__(self, gates=None, routes=None):
+        gates = DEFAULT_GATES if gates is None else gates
+        self.gates = {name: Gate(name, *settings) for name, settings in gates.items()}
+        self.routes = DEFAULT_ROUTES if routes is None else routes
+
+    def admit(self, endpoint, priority):
+        """Pass the gates of an endpoint. Returns a ticket for release(); raises Rejected."""
+        held = []
+        try:
+            for name in (*self.routes.get(endpoint, ()), 'all'):
+                gate = self.gates.get(name)
+                if gate is not None:
+                    gate.acquire(priority)
+                    held.append(gate)
+        except Rejected:
+            for gate in reversed(held):
+                gate.release()
+            raise
+        return held, time.monotonic()
+
+    def release(self, ticket):
+        held, started = ticket
+        elapsed = time.monotonic() - started
+        for gate in reversed(held):
+            gate.release(elapsed)
+
+    def metrics(self):
+        return {name: gate.metrics() for name, gate in self.gates.items()}
@@ -1,15 +1,76 @@
 # app.py
-import sqlite3
-from flask import Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify
+from flask import (Flask, render_template, request, redirect, url_for, session, flash, send_file, jsonify, Response,
+                   stream_with_context, stream_template, g, has_request_context)
+from flask.sessions import SecureCookieSessionInterface
 from werkzeug.security import generate_password_hash, check_password_hash
 import os
 from datetime import datetime
 import io
+import json
+import atexit
+import hashlib
+import time
+from collections import Counter
+import click
+import database as db
+import media
+import document_index
+from grading import GRADE_TO_POINTS, calculate_gpa, summarize_results
+from projections import CohortCache, hypothetical_results, totals
+from records import columns
+from changelog import changes_since, latest_seq
+from events import bus, parse_last_event_id
+from tenancy import Tenants, PathPrefixMiddleware
+from admission import AdmissionControl, Rejected, ADMIN, STUDENT, UPLOAD
+from profiler import Profiler, tree, collapsed, speedscope
+from replicas import create_replicas
+from duplicates import find_matches, duplicate_report
+from traffic import Recorder, describe
+from notifications import Dispatcher, create_transport, outbox_counts
+from report_cards import generate_report_cards, report_card_context, results_query
+from backup import (BackupError, take_snapshot, prune_snapshots, list_snapshots, read_manifest, verify_snapshot,
+                    restore_snapshot, start_scheduler)
+from lifecycle import LifecycleError, STUDENT_STATUSES, FINAL_GRADE, rollover, set_status, delete_graduates
+from archive import (ArchiveError, archive_year, restore_year, archived_years, is_archived, backfill_frozen,
+                     attach_limit, recent_years, results_source, union_frozen,
+                     archived_result_count, find_archived_result)
 
 app = Flask(__name__)
 app.secret_key = 'your_secret_key_here'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['DATABASE'] = os.environ.get('RESULTS_DB', 'results.db')
+app.config['DATABASE_URL'] = os.environ.get('DATABASE_URL', '')
+# Read replicas for the analytics and listing pages, see replicas.py: READ_REPLICAS local copies of each
+# SQLite database, or the PostgreSQL standbys in DATABASE_REPLICA_URLS (comma-separated)
+app.config['READ_REPLICAS'] = int(os.environ.get('READ_REPLICAS', 0))
+app.config['DATABASE_REPLICA_URLS'] = os.environ.get('DATABASE_REPLICA_URLS', '')
+app.config['REPLICA_MAX_LAG_SECONDS'] = float(os.environ.get('REPLICA_MAX_LAG_SECONDS', 5))
+app.config['REPLICA_INTERVAL_SECONDS'] = float(os.environ.get('REPLICA_INTERVAL_SECONDS', 0.5))
+app.config['ARCHIVE_FOLDER'] = 'archive'
+app.config['REPORTS_FOLDER'] = 'reports'
+app.config['DERIVATIVES_FOLDER'] = os.path.join('uploads', 'derived')
+app.config['BACKUP_FOLDER'] = os.environ.get('BACKUP_FOLDER', 'backups')
+# Snapshots kept: the newest BACKUP_KEEP_LAST, plus one per day and per week for the last few
+app.config['BACKUP_KEEP_LAST'] = int(os.environ.get('BACKUP_KEEP_LAST', 24))
+app.config['BACKUP_KEEP_DAILY'] = int(os.environ.get('BACKUP_KEEP_DAILY', 7))
+app.config['BACKUP_KEEP_WEEKLY'] = int(os.environ.get('BACKUP_KEEP_WEEKLY', 4))
+app.config['ADMISSION_CONTROL'] = os.environ.get('ADMISSION_CONTROL', '1') != '0'
+# Sampling profiler, see profiler.py: endpoints always profiled, plus a fraction of all other requests
+app.config['PROFILE_ROUTES'] = [e for e in os.environ.get('PROFILE_ROUTES', '').split(',') if e]
+app.config['PROFILE_SAMPLE_RATE'] = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+app.config['PROFILE_INTERVAL_MS'] = float(os.environ.get('PROFILE_INTERVAL_MS', 5))
+app.config['PROFILE_MEMORY'] = os.environ.get('PROFILE_MEMORY', '0') == '1'
+# Student notifications, see notifications.py: where digests go, and how often and how persistently to send them
+app.config['NOTIFY_TRANSPORT'] = os.environ.get('NOTIFY_TRANSPORT', 'file:notifications.log')
+app.config['NOTIFY_SENDER'] = os.environ.get('NOTIFY_SENDER', 'results@localhost')
+app.config['NOTIFY_INTERVAL_SECONDS'] = float(os.environ.get('NOTIFY_INTERVAL_SECONDS', 30))
+app.config['NOTIFY_MAX_ATTEMPTS'] = int(os.environ.get('NOTIFY_MAX_ATTEMPTS', 5))
+app.config['NOTIFY_BACKOFF_SECONDS'] = float(os.environ.get('NOTIFY_BACKOFF_SECONDS', 60))
+# Anonymized request capture for benchmarks/replay_traffic.py, see traffic.py: off unless given a file
+app.config['TRAFFIC_CAPTURE'] = os.environ.get('TRAFFIC_CAPTURE', '')
+app.config['TRAFFIC_CAPTURE_RATE'] = float(os.environ.get('TRAFFIC_CAPTURE_RATE', 1))
+app.config['TRAFFIC_CAPTURE_KEY'] = os.environ.get('TRAFFIC_CAPTURE_KEY', '')
 
 # South African subjects with levels
 SUBJECTS = {
@@ -26,80 +87,149 @@ SUBJECTS = {
     'Physical Sciences': ['Level 7', 'Level 6', 'Level 5', 'Level 4', 'Level 3', 'Level 2', 'Level 1']
 }
 
-# Grade to points mapping
-GRADE_TO_POINTS = {
-    'A': 4.0, 'A-': 3.7, 'B+': 3.3, 'B': 3.0, 'B-': 2.7,
-    'C+': 2.3, 'C': 2.0, 'C-': 1.7, 'D+': 1.3, 'D': 1.0, 'F': 0.0
+# Course codes for the SUBJECTS catalog; languages get <language code><HL|FAL>
+SUBJECT_CODES = {
+    'Mathematics': 'MATH', 'Mathematical Literacy': 'MATHLIT', 'Life Orientation': 'LO', 'Accounting': 'ACCT',
+    'Business Studies': 'BUSSTU', 'Geography': 'GEOG', 'History': 'HIST', 'Life Sciences': 'LIFSCI',
+    'Physical Sciences': 'PHYSCI'
 }
+LANGUAGE_CODES = {'English': 'ENG', 'Afrikaans': 'AFR', 'isiZulu': 'ZUL', 'isiXhosa': 'XHO', 'Sesotho': 'SOT',
+                  'Setswana': 'TSN'}
+LANGUAGE_LEVEL_CODES = {'Home Language': 'HL', 'First Additional Language': 'FAL'}
 
-# Ensure upload directory exists
-if not os.path.exists(app.config['UPLOAD_FOLDER']):
-    os.makedirs(app.config['UPLOAD_FOLDER'])
+def course_catalog():
+    """(course_code, course_name, category) of every course in SUBJECTS"""
+    catalog = []
+    for category, options in SUBJECTS.items():
+        if category in LANGUAGE_LEVEL_CODES:
+            catalog.extend((LANGUAGE_CODES[language] + LANGUAGE_LEVEL_CODES[category], f'{language} {category}', category)
+                           for language in options)
+        else:
+            catalog.append((SUBJECT_CODES[category], category, category))
+    return catalog
 
-# Database initialization
-def init_db():
-    conn = sqlite3.connect('results.db')
-    c = conn.cursor()
-    
-    # Create users table
-    c.execute('''CREATE TABLE IF NOT EXISTS users
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 username TEXT UNIQUE NOT NULL,
-                 password TEXT NOT NULL,
-                 role TEXT NOT NULL,
-                 full_name TEXT,
-                 email TEXT,
-                 created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
-    
-    # Create students table
-    c.execute('''CREATE TABLE IF NOT EXISTS students
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 student_id TEXT UNIQUE NOT NULL,
-                 full_name TEXT NOT NULL,
-                 email TEXT NOT NULL,
-                 program TEXT,
-                 year INTEGER,
-                 date_of_birth TEXT,
-                 phone_number TEXT,
-                 address TEXT,
-                 created_at TEXT DEFAULT CURRENT_TIMESTAMP)''')
-    
-    # Create results table with remark field
-    c.execute('''CREATE TABLE IF NOT EXISTS results
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 student_id TEXT NOT NULL,
-                 course_code TEXT NOT NULL,
-                 course_name TEXT NOT NULL,
-                 subject_level TEXT,
-                 grade TEXT NOT NULL,
-                 credits INTEGER,
-                 semester TEXT NOT NULL,
-                 academic_year TEXT NOT NULL,
-                 remark TEXT,
-                 created_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                 updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
-                 FOREIGN KEY (student_id) REFERENCES students (student_id))''')
-    
-    # Create documents table
-    c.execute('''CREATE TABLE IF NOT EXISTS documents
-                 (id INTEGER PRIMARY KEY AUTOINCREMENT,
-                 student_id TEXT NOT NULL,
-                 doc_name TEXT NOT NULL,
-                 doc_type TEXT NOT NULL,
-                 doc_path TEXT NOT NULL,
-                 upload_date TEXT NOT NULL,
-                 status TEXT DEFAULT 'Pending',
-                 feedback TEXT,
-                 reviewed_by TEXT,
-                 reviewed_at TEXT,
-                 FOREIGN KEY (student_id) REFERENCES students (student_id))''')
-    
+# Review states of uploaded documents
+DOCUMENT_STATUSES = ['Pending', 'Approved', 'Rejected']
+
+# Schools sharing this deployment, each with its own database and folders, see tenancy.py.
+# Without TENANTS_FILE there is only the district tenant, which uses app.config.
+tenants = Tenants.load(os.environ.get('TENANTS_FILE'), app.config, os.environ.get('TENANTS_ROOT', 'schools'),
+                       district_bus=bus)
+if os.environ.get('SCHOOL'):
+    tenants.default = tenants.schools[os.environ['SCHOOL']]
+if tenants.enabled:
+    app.wsgi_app = PathPrefixMiddleware(app.wsgi_app, tenants)
+
+def current_tenant():
+    return tenants.current()
+
+def setting(key):
+    """A per-school setting (database, folders) of the current tenant"""
+    return current_tenant().settings[key]
+
+# Database backend of the current tenant: SQLite by default, PostgreSQL when DATABASE_URL is set
+def db_backend():
+    return current_tenant().backend()
+
+# Per-route concurrency limits and priority queues, see admission.py
+admission_control = AdmissionControl()
+
+# Never queued: static files, the long-lived event stream and the metrics themselves
+ADMISSION_EXEMPT = {'static', 'admin_events', 'admission_metrics'}
+
+# Request shapes written to TRAFFIC_CAPTURE for replaying the same mix against a test server
+recorder = None
+if app.config['TRAFFIC_CAPTURE']:
+    recorder = Recorder(app.config['TRAFFIC_CAPTURE'], app.config['TRAFFIC_CAPTURE_KEY'] or app.secret_key,
+                        app.config['TRAFFIC_CAPTURE_RATE'])
+    atexit.register(recorder.flush)
+
+# Static files and the never-ending event stream say nothing about load
+CAPTURE_EXEMPT = {'static', 'admin_events'}
+
+# Cohorts of the what-if projections, reloaded when students or results change
+cohorts = CohortCache()
+
+# Stacks of picked requests, sampled per endpoint; the settings can be changed on /admin/profiler
+profiler = Profiler(app.config['PROFILE_ROUTES'], app.config['PROFILE_SAMPLE_RATE'],
+                    app.config['PROFILE_INTERVAL_MS'] / 1000, app.config['PROFILE_MEMORY'])
+
+# Never profiled: the event stream would hold a sampling slot open for as long as a dashboard is.
+# The native routes of asgi.py are not profiled either: they run on the event loop's thread, shared by all of them.
+PROFILER_EXEMPT = {'static', 'admin_events', 'profiler_page', 'profiler_export'}
+
+# Offline student portal: static/js/service-worker.js caches these and the student pages for patchy connections
+OFFLINE_ASSETS = [
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/css/bootstrap.min.css',
+    'https://cdn.jsdelivr.net/npm/bootstrap@5.1.3/dist/js/bootstrap.bundle.min.js',
+    'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css',
+    'https://cdn.jsdelivr.net/npm/chart.js',
+]
+OFFLINE_STATIC = ['images/Logo.png']
+OFFLINE_PAGES = ['student_dashboard', 'student_results', 'student_results_data']
+
+def asset_version():
+    """Fingerprint of the templates and static files, so cached pages turn over when a deploy changes them"""
+    digest = hashlib.blake2b(digest_size=8)
+    for folder in (app.template_folder, app.static_folder):
+        folder = os.path.join(app.root_path, folder)
+        for root, _, files in sorted(os.walk(folder)):
+            for name in sorted(files):
+                stat = os.stat(os.path.join(root, name))
+                digest.update(f'{os.path.relpath(os.path.join(root, name), folder)}:{stat.st_size}:{stat.st_mtime_ns};'
+                              .encode())
+    return digest.hexdigest()
+
+ASSET_VERSION = asset_version()
+
+def version_of(*parts):
+    """ETag for a response built from parts (rows, filters, the signed-in user)"""
+    data = json.dumps([ASSET_VERSION, current_tenant().slug, *parts], default=str, separators=(',', ':'))
+    return hashlib.blake2b(data.encode(), digest_size=12).hexdigest()
+
+def revalidated(etag, build):
+    """build() with the ETag set, or an empty 304 when the browser already holds this version.
+
+    Pages with a flash message waiting are always rendered, or the message would be lost.
+    """
+    if request.if_none_match.contains(etag) and '_flashes' not in session:
+        response = Response(status=304)
+    else:
+        response = app.make_response(build())
+    response.set_etag(etag)
+    # Private: the pages belong to one student. no-cache: revalidate every time, which costs a 304 at most
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+# Read-only routes served from a replica when one is fresh enough; the rest read and write the primary
+REPLICA_ENDPOINTS = {'analytics', 'duplicate_students', 'manage_students', 'manage_results', 'api_v1_students', 'api_v1_results',
+                     'api_v1_projections'}
+
+# GET routes that write, so the pages after them must read the primary too
+GET_WRITES = {'delete_student', 'delete_result', 'reset_db', 'debug_students'}
+
+# Database connection helper
+def get_db_connection():
+    tenant = current_tenant()
+    conn = None
+    if tenant.replicas is not None and has_request_context() and request.endpoint in REPLICA_ENDPOINTS:
+        conn = tenant.replicas.connect(not_before=session.get('wrote_at', 0))
+    if conn is None:
+        conn = tenant.connect()
+    # Only the request's own connections: the notification dispatcher's claims would make the counts flaky
+    trace = getattr(tenant.backend(), 'trace', None)
+    if trace is not None and has_request_context():
+        conn.set_trace_callback(trace)
+    return conn
+
+# Demo admin (admin/admin123), students and results, for development and the district of a single school
+def seed_sample_data(conn):
     # Insert default admin user if not exists
-    admin_exists = c.execute("SELECT * FROM users WHERE username='admin'").fetchone()
+    admin_exists = conn.execute("SELECT * FROM users WHERE username='admin'").fetchone()
     if not admin_exists:
         hashed_password = generate_password_hash('admin123')
-        c.execute("INSERT INTO users (username, password, role, full_name, email) VALUES (?, ?, ?, ?, ?)",
-                  ('admin', hashed_password, 'admin', 'System Administrator', 'admin@izra.edu'))
+        conn.execute("INSERT INTO users (username, password, role, full_name, email) VALUES (?, ?, ?, ?, ?)",
+                     ('admin', hashed_password, 'admin', 'System Administrator', 'admin@izra.edu'))
         print("Admin user created successfully")
     else:
         print("Admin user already exists")
@@ -112,19 +242,19 @@ def init_db():
     ]
     
     for student in sample_students:
-        student_exists = c.execute("SELECT * FROM students WHERE student_id=?", (student[0],)).fetchone()
+        student_exists = conn.execute("SELECT * FROM students WHERE student_id=?", (student[0],)).fetchone()
         if not student_exists:
-            c.execute("INSERT INTO students (student_id, full_name, email, program, year, date_of_birth, phone_number, address) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", student)
+            conn.execute("INSERT INTO students (student_id, full_name, email, program, year, date_of_birth, phone_number, address) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", student)
             print(f"Student {student[0]} created successfully")
         else:
             print(f"Student {student[0]} already exists")
         
         # Also create a user account for the student if it doesn't exist
-        user_exists = c.execute("SELECT * FROM users WHERE username=?", (student[0],)).fetchone()
+        user_exists = conn.execute("SELECT * FROM users WHERE username=?", (student[0],)).fetchone()
         if not user_exists:
             hashed_password = generate_password_hash('password123')
-            c.execute("INSERT INTO users (username, password, role, full_name, email) VALUES (?, ?, ?, ?, ?)",
-                      (student[0], hashed_password, 'student', student[1], student[2]))
+            conn.execute("INSERT INTO users (username, password, role, full_name, email) VALUES (?, ?, ?, ?, ?)",
+                         (student[0], hashed_password, 'student', student[1], student[2]))
             print(f"User for student {student[0]} created successfully")
         else:
             print(f"User for student {student[0]} already exists")
@@ -146,44 +276,193 @@ def init_db():
     ]
     
     for result in sample_results:
-        result_exists = c.execute("SELECT * FROM results WHERE student_id=? AND course_code=? AND semester=? AND academic_year=?", 
-                                 (result[0], result[1], result[5], result[6])).fetchone()
+        if is_archived(conn, result[7]):
+            continue
+        result_exists = conn.execute("SELECT * FROM results WHERE student_id=? AND course_code=? AND semester=? AND academic_year=?", 
+                                    (result[0], result[1], result[6], result[7])).fetchone()
         if not result_exists:
-            c.execute("INSERT INTO results (student_id, course_code, course_name, subject_level, grade, credits, semester, academic_year, remark) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", result)
+            conn.execute("INSERT INTO results (student_id, course_code, course_name, subject_level, grade, credits, semester, academic_year, remark) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", result)
             print(f"Result for {result[0]} in {result[1]} created successfully")
         else:
             print(f"Result for {result[0]} in {result[1]} already exists")
+
+# Database initialization
+def init_db(sample_data=True):
+    conn = get_db_connection()
+    
+    # Create users, students, results, documents and archived_years tables
+    db_backend().create_tables(conn)
+    
+    # Course catalog the results point at through course_id
+    db.sync_courses(conn, course_catalog())
+    
+    if sample_data:
+        seed_sample_data(conn)
+    
+    # Fill course_id and grade_points on results written before those columns existed
+    db.backfill_results(conn)
+    
+    # Fill the duplicate-matching keys of students added before they existed
+    db.backfill_match_keys(conn)
+    
+    # Copy the frozen aggregates of years archived before the archived_* tables existed
+    backfill_frozen(conn)
+    
+    # Rebuild the per-status document counters in case they drifted
+    db.refresh_document_counts(conn)
     
     conn.commit()
     conn.close()
     print("Database initialized successfully")
 
-init_db()
+def setup_tenant(tenant):
+    """Create a tenant's folders and tables the first time its database is used"""
+    os.makedirs(tenant.settings['UPLOAD_FOLDER'], exist_ok=True)
+    with tenants.using(tenant):
+        # A school's shard starts empty; its admin is created with flask create-admin
+        init_db(sample_data=tenant.slug is None)
+    tenant.replicas = create_replicas(tenant.backend(), app.config['READ_REPLICAS'],
+                                      [url for url in tenant.settings['DATABASE_REPLICA_URLS'].split(',') if url],
+                                      app.config['REPLICA_MAX_LAG_SECONDS'], app.config['REPLICA_INTERVAL_SECONDS'])
+    if tenant.replicas is not None:
+        atexit.register(tenant.replicas.close)
+    tenant.notifications = Dispatcher(tenant.connect, notify_transport, app.config['NOTIFY_INTERVAL_SECONDS'],
+                                      max_attempts=app.config['NOTIFY_MAX_ATTEMPTS'],
+                                      backoff=app.config['NOTIFY_BACKOFF_SECONDS']).start()
 
-# Database connection helper
-def get_db_connection():
-    conn = sqlite3.connect('results.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+# One transport for every school: each digest carries its student's own address
+notify_transport = create_transport(app.config['NOTIFY_TRANSPORT'], app.config['NOTIFY_SENDER'])
 
-# Helper function to calculate GPA
-def calculate_gpa(results):
-    if not results:
-        return 0.0
-    
-    grade_points = 0
-    total_credits = 0
-    
-    for result in results:
-        credit = result['credits'] or 0
-        grade = result['grade']
-        
-        if grade in GRADE_TO_POINTS:
-            points = GRADE_TO_POINTS[grade]
-            grade_points += points * credit
-            total_credits += credit
+for tenant in tenants.all():
+    tenant.setup = setup_tenant
+# The default tenant is set up now; the other schools on their first request
+tenants.default.backend()
+
+# Backups of results.db and the file stores, see backup.py
+def backup_trees():
+    return {'uploads': setting('UPLOAD_FOLDER'), 'archive': setting('ARCHIVE_FOLDER')}
+
+def snapshot_and_prune():
+    """Take a snapshot, then apply the retention policy. Returns (manifest, deleted snapshot names)."""
+    # Previews are rebuilt from the uploads by flask build-previews, so they are not backed up
+    manifest = take_snapshot(setting('DATABASE'), setting('BACKUP_FOLDER'), backup_trees(),
+                             exclude=[setting('DERIVATIVES_FOLDER')])
+    deleted = prune_snapshots(setting('BACKUP_FOLDER'), app.config['BACKUP_KEEP_LAST'],
+                              app.config['BACKUP_KEEP_DAILY'], app.config['BACKUP_KEEP_WEEKLY'])
+    return manifest, deleted
+
+def snapshot_all_schools():
+    for tenant in tenants.all():
+        with tenants.using(tenant):
+            if db_backend().name == 'sqlite':
+                snapshot_and_prune()
+
+# Scheduled snapshots in this process; with several workers, run flask backup from cron instead
+if os.environ.get('BACKUP_INTERVAL_MINUTES'):
+    start_scheduler(float(os.environ['BACKUP_INTERVAL_MINUTES']) * 60, snapshot_all_schools)
+
+# Live dashboard events, published once a change is committed
+def dashboard_counts(conn):
+    doc_counts = db.document_counts(conn)
+    return {
+        'student_count': conn.execute('SELECT COUNT(*) FROM students').fetchone()[0],
+        'result_count': conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] + archived_result_count(conn),
+        'document_count': sum(doc_counts.values()),
+        'pending_docs': doc_counts.get('Pending', 0),
+    }
+
+def publish_event(conn, event, **data):
+    """Publish to the live dashboards, with the current counters attached"""
+    tenant_bus = current_tenant().bus
+    if tenant_bus.subscriber_count():
+        tenant_bus.publish(event, dict(data, counts=dashboard_counts(conn)))
+
+def publish_result(conn, action, result_id, previous_grade=None):
+    result = db.get_result_with_student(conn, result_id)
+    publish_event(conn, 'results', action=action, result=dict(result) if result else {'id': result_id},
+                  previous_grade=previous_grade)
+
+def publish_documents_uploaded(conn, doc_ids):
+    documents = conn.execute(f'''
+        SELECT d.id, d.student_id, s.full_name, d.doc_name, d.doc_type, d.upload_date, d.status
+        FROM documents d
+        JOIN students s ON d.student_id = s.student_id
+        WHERE d.id IN ({", ".join("?" * len(doc_ids))})
+    ''', doc_ids).fetchall()
+    publish_event(conn, 'documents', action='uploaded', documents=[dict(doc) for doc in documents])
+
+def publish_documents_reviewed(conn, doc_ids, status):
+    publish_event(conn, 'documents', action='reviewed', status=status, doc_ids=doc_ids)
+
+def redirect_target(endpoint, **values):
+    """The form's 'next' URL when it points back into this site, else url_for(endpoint)"""
+    target = request.form.get('next') or request.args.get('next')
+    if target and target.startswith('/') and not target.startswith('//'):
+        return target
+    return url_for(endpoint, **values)
+
+# Streamed list pages: rows go from the cursor to the client while the template renders them,
+# so a page of 100k results never sits in the worker as a list of rows or one big string
+STREAM_BUFFER_BYTES = 16 * 1024
+
+class LazyRows:
+    """Query rows read from the cursor as the template loops over them. Iterable once.
+
+    The first row is fetched up front, so the query has started before the page
+    does and `{% if rows %}` needs no second query.
+    """
+
+    def __init__(self, rows):
+        self._rows = iter(rows)
+        self._first = next(self._rows, None)
+        self.started = False
+
+    def __bool__(self):
+        self.started = True
+        return self._first is not None
+
+    def __iter__(self):
+        self.started = True
+        if self._first is not None:
+            yield self._first
+            yield from self._rows
+
+    def close(self):
+        # Ends a server-side cursor while its connection is still ours
+        if hasattr(self._rows, 'close'):
+            self._rows.close()
+
+def stream_page(conn, template_name, **context):
+    """Render a list page with stream_template, closing conn once the last row is sent.
+
+    Everything before the first row (the page head, filters, table header) is
+    sent as soon as it is rendered; the rows follow in STREAM_BUFFER_BYTES pieces.
+    """
+    lazy_rows = [value for value in context.values() if isinstance(value, LazyRows)]
+    
+    def generate():
+        buffer, size, head_sent = [], 0, False
+        chunks = stream_template(template_name, **context)
+        try:
+            for chunk in chunks:
+                if not head_sent and any(rows.started for rows in lazy_rows):
+                    head_sent = True
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+                buffer.append(chunk)
+                size += len(chunk)
+                if size >= STREAM_BUFFER_BYTES:
+                    yield ''.join(buffer)
+                    buffer, size = [], 0
+            yield ''.join(buffer)
+        finally:
+            # Closed here rather than when garbage collected, which could pop another request's context
+            chunks.close()
+            for rows in lazy_rows:
+                rows.close()
+            conn.close()
     
-    return round(grade_points / total_credits, 2) if total_credits > 0 else 0.0
+    return Response(stream_with_context(generate()), mimetype='text/html')
 
 # Authentication decorators
 def login_required(f):
@@ -213,12 +492,111 @@ def student_required(f):
     decorated_function.__name__ = f.__name__
     return decorated_function
 
+# Traffic capture, timed from the first hook so queueing in admission control is included.
+# asgi.py captures its native routes the same way.
+@app.before_request
+def start_capture():
+    if recorder is not None and request.endpoint not in CAPTURE_EXEMPT and recorder.wants():
+        g.capture_start = time.perf_counter()
+
+@app.after_request
+def capture_request(response):
+    start = g.pop('capture_start', None)
+    if start is not None:
+        entry = describe(request, session, recorder.key, current_tenant().slug)
+        status = response.status_code
+        # Recorded once the last byte is sent, so streamed pages are timed in full
+        response.call_on_close(lambda: recorder.record(entry, status, time.perf_counter() - start))
+    return response
+
+# Tenant of each request, chosen before admission so every later step uses the school's database
+class SchoolSessionInterface(SecureCookieSessionInterface):
+    """A separate session cookie per school, so logging in to one school keeps the others' sessions"""
+
+    def get_cookie_name(self, app):
+        # The session is opened before select_tenant runs
+        slug = tenants.resolve(request.environ).slug if has_request_context() else None
+        return app.config['SESSION_COOKIE_NAME'] + (f'_{slug}' if slug else '')
+
+app.session_interface = SchoolSessionInterface()
+
+@app.before_request
+def select_tenant():
+    tenant = tenants.resolve(request.environ)
+    g.tenant_token = tenants.activate(tenant)
+    # A session signed in at another school is no use here
+    if 'user_id' in session and session.get('school') != tenant.slug:
+        session.clear()
+
+@app.teardown_request
+def reset_tenant(error=None):
+    token = g.pop('tenant_token', None)
+    if token is not None:
+        tenants.deactivate(token)
+
+# Admission control, also applied by the native routes of asgi.py
+BUSY_MESSAGE = 'The server is busy. Please try again in a moment.'
+
+def priority_of(role, endpoint, method):
+    if role == 'admin':
+        return ADMIN
+    if endpoint == 'upload_document' and method == 'POST':
+        return UPLOAD
+    return STUDENT
+
+def request_priority():
+    # Only the signed session counts: a login form's role field is whatever the client sent,
+    # so logins queue as students in the login gate until the account is verified
+    return priority_of(session.get('role'), request.endpoint, request.method)
+
+@app.before_request
+def admit_request():
+    if not app.config['ADMISSION_CONTROL'] or request.endpoint is None or request.endpoint in ADMISSION_EXEMPT:
+        return None
+    try:
+        g.admission_ticket = admission_control.admit(request.endpoint, request_priority())
+    except Rejected as e:
+        if request.path.startswith('/api/'):
+            response = jsonify({'success': False, 'message': BUSY_MESSAGE})
+        else:
+            response = Response(BUSY_MESSAGE, mimetype='text/plain')
+        response.status_code = 503
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
+    return None
+
+@app.teardown_request
+def release_request(error=None):
+    ticket = g.pop('admission_ticket', None)
+    if ticket is not None:
+        admission_control.release(ticket)
+
+# Sampling profiler, after admission so queueing time is not sampled
+@app.before_request
+def start_profile():
+    if profiler.enabled and request.endpoint not in PROFILER_EXEMPT and profiler.wants(request.endpoint):
+        g.profile_token = profiler.start(request.endpoint)
+
+@app.teardown_request
+def finish_profile(error=None):
+    token = g.pop('profile_token', None)
+    if token is not None:
+        profiler.finish(token)
+
+# Read-your-writes: after a write, this session reads the primary until a replica has caught up past it
+@app.after_request
+def remember_write(response):
+    if request.endpoint not in REPLICA_ENDPOINTS and (request.method not in ('GET', 'HEAD')
+                                                      or request.endpoint in GET_WRITES):
+        session['wrote_at'] = time.time()
+    return response
+
 # Context processor for template functions
 @app.context_processor
 def utility_processor():
     def now(format='%Y-%m-%d %H:%M'):
         return datetime.now().strftime(format)
-    return dict(now=now)
+    return dict(now=now, school=current_tenant(), multi_school=tenants.enabled)
 
 # Routes
 @app.route('/')
@@ -233,17 +611,18 @@ def login():
         role = request.form['role']
         
         conn = get_db_connection()
-        user = conn.execute('SELECT * FROM users WHERE username = ? AND role = ?', (username, role)).fetchone()
+        user = db.get_user(conn, username, role)
         
         if user:
-            print(f"User found: {user['username']}")
-            print(f"Password check: {check_password_hash(user['password'], password)}")
-            
-            if check_password_hash(user['password'], password):
+            student = db.get_student(conn, username) if user['role'] == 'student' else None
+            if student is not None and student['status'] == 'Inactive':
+                flash('This account has been deactivated.', 'danger')
+            elif check_password_hash(user['password'], password):
                 session['user_id'] = user['id']
                 session['username'] = user['username']
                 session['role'] = user['role']
                 session['full_name'] = user['full_name']
+                session['school'] = current_tenant().slug
                 
                 flash(f'Welcome back, {user["full_name"]}!', 'success')
                 
@@ -252,7 +631,6 @@ def login():
                     return redirect(url_for('admin_dashboard'))
                 else:
                     # For students, also get student info
-                    student = conn.execute('SELECT * FROM students WHERE student_id = ?', (username,)).fetchone()
                     if student:
                         session['student_id'] = student['student_id']
                         session['program'] = student['program']
@@ -272,7 +650,10 @@ def login():
 def logout():
     session.clear()
     flash('You have been logged out successfully.', 'info')
-    return redirect(url_for('index'))
+    response = redirect(url_for('index'))
+    # Drop the offline copies of the student's pages along with the service worker holding them
+    response.headers['Clear-Site-Data'] = '"cache", "storage"'
+    return response
 
 @app.route('/admin/dashboard')
 @admin_required
@@ -280,10 +661,7 @@ def admin_dashboard():
     conn = get_db_connection()
     
     # Get counts for dashboard
-    student_count = conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
-    result_count = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
-    document_count = conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
-    pending_docs = conn.execute('SELECT COUNT(*) FROM documents WHERE status = "Pending"').fetchone()[0]
+    counts = dashboard_counts(conn)
     
     # Get recent documents
     recent_docs = conn.execute('''
@@ -294,19 +672,28 @@ def admin_dashboard():
         LIMIT 5
     ''').fetchall()
     
-    # Get recent results
-    recent_results = conn.execute('''
+    # Get recent results, opening only the archived years that hold ids above the hot table's fifth newest
+    archives = archived_years(conn)
+    recent_archives = []
+    if archives:
+        fifth = conn.execute('SELECT id FROM results ORDER BY id DESC LIMIT 1 OFFSET 4').fetchone()
+        recent_archives = recent_years(conn, fifth[0] if fifth else 0, 5)
+    recent = results_source(conn, years=recent_archives)
+    recent_results = conn.execute(f'''
         SELECT r.*, s.full_name 
-        FROM results r 
+        FROM {recent} r 
         JOIN students s ON r.student_id = s.student_id 
         ORDER BY r.id DESC 
         LIMIT 5
     ''').fetchall()
     
-    # Get grade distribution
-    grade_distribution = conn.execute('''
-        SELECT grade, COUNT(*) as count 
-        FROM results 
+    # Get grade distribution, using the frozen counts of archived years
+    grade_counts = union_frozen(archives,
+                                'SELECT grade, COUNT(*) as count FROM results GROUP BY grade',
+                                'SELECT grade, count FROM archived_grade_counts')
+    grade_distribution = conn.execute(f'''
+        SELECT grade, SUM(count) as count 
+        FROM ({grade_counts}) AS g
         GROUP BY grade 
         ORDER BY grade
     ''').fetchall()
@@ -314,10 +701,10 @@ def admin_dashboard():
     conn.close()
     
     return render_template('admin_dashboard.html', 
-                          student_count=student_count, 
-                          result_count=result_count,
-                          document_count=document_count,
-                          pending_docs=pending_docs,
+                          student_count=counts['student_count'], 
+                          result_count=counts['result_count'],
+                          document_count=counts['document_count'],
+                          pending_docs=counts['pending_docs'],
                           recent_docs=recent_docs,
                           recent_results=recent_results,
                           grade_distribution=grade_distribution,
@@ -351,15 +738,14 @@ def manage_students():
     
     query += ' ORDER BY student_id'
     
-    students = conn.execute(query, params).fetchall()
-    
     # Get filter options
     programs = conn.execute('SELECT DISTINCT program FROM students ORDER BY program').fetchall()
     years = conn.execute('SELECT DISTINCT year FROM students ORDER BY year DESC').fetchall()
     
-    conn.close()
+    # Read last, while the page is sent
+    students = LazyRows(db.iterate(conn, query, params))
     
-    return render_template('manage_students.html', 
+    return stream_page(conn, 'manage_students.html', 
                           students=students,
                           programs=programs,
                           years=years,
@@ -375,7 +761,7 @@ def view_student(student_id):
     conn = get_db_connection()
     
     # Get student details
-    student = conn.execute('SELECT * FROM students WHERE student_id = ?', (student_id,)).fetchone()
+    student = db.get_student(conn, student_id)
     
     if not student:
         flash('Student not found.', 'danger')
@@ -383,39 +769,29 @@ def view_student(student_id):
         return redirect(url_for('manage_students'))
     
     # Get student results with better sorting
-    results = conn.execute('''
-        SELECT * FROM results 
+    results = conn.execute(f'''
+        SELECT * FROM {results_source(conn, student_ids=[student_id])} 
         WHERE student_id = ? 
         ORDER BY academic_year DESC, semester DESC, course_code
     ''', (student_id,)).fetchall()
     
     # Get student documents
     documents = conn.execute('''
-        SELECT * FROM documents 
-        WHERE student_id = ? 
-        ORDER BY upload_date DESC
+        SELECT d.*, dd.content_hash FROM documents d 
+        LEFT JOIN document_derivatives dd ON dd.doc_id = d.id 
+        WHERE d.student_id = ? 
+        ORDER BY d.upload_date DESC
     ''', (student_id,)).fetchall()
     
-    # Calculate GPA and other statistics
-    gpa = calculate_gpa(results)
-    total_credits = sum(r['credits'] or 0 for r in results)
-    
-    # Grade distribution
-    grade_distribution = {}
-    for result in results:
-        grade = result['grade']
-        grade_distribution[grade] = grade_distribution.get(grade, 0) + 1
-    
-    # Calculate additional statistics
-    total_subjects = len(results)
-    passed_subjects = sum(1 for r in results if r['grade'] not in ['F', 'D'])
-    highest_grade = max([r['grade'] for r in results], key=lambda x: GRADE_TO_POINTS.get(x, 0)) if results else 'N/A'
-    lowest_grade = min([r['grade'] for r in results], key=lambda x: GRADE_TO_POINTS.get(x, 0)) if results else 'N/A'
+    # Calculate GPA, grade distribution and other statistics
+    summary = summarize_results(results)
     
     # Document statistics
-    pending_docs = sum(1 for d in documents if d['status'] == 'Pending')
-    approved_docs = sum(1 for d in documents if d['status'] == 'Approved')
-    rejected_docs = sum(1 for d in documents if d['status'] == 'Rejected')
+    statuses, = columns(documents, 'status')
+    status_counts = Counter(statuses)
+    pending_docs = status_counts['Pending']
+    approved_docs = status_counts['Approved']
+    rejected_docs = status_counts['Rejected']
     
     conn.close()
     
@@ -423,28 +799,48 @@ def view_student(student_id):
                           student=student, 
                           results=results, 
                           documents=documents,
-                          gpa=gpa,
-                          total_credits=total_credits,
-                          total_subjects=total_subjects,
-                          passed_subjects=passed_subjects,
-                          highest_grade=highest_grade,
-                          lowest_grade=lowest_grade,
-                          grade_distribution=grade_distribution,
+                          gpa=summary['gpa'],
+                          total_credits=summary['total_credits'],
+                          total_subjects=summary['total_subjects'],
+                          passed_subjects=summary['passed_subjects'],
+                          highest_grade=summary['highest_grade'],
+                          lowest_grade=summary['lowest_grade'],
+                          grade_distribution=summary['grade_distribution'],
                           pending_docs=pending_docs,
                           approved_docs=approved_docs,
                           rejected_docs=rejected_docs,
                           subjects=SUBJECTS)
 
+@app.route('/admin/student/<student_id>/report_card')
+@admin_required
+def report_card(student_id):
+    academic_year = request.args.get('academic_year', '')
+    semester = request.args.get('semester', '')
+    conn = get_db_connection()
+    
+    student = db.get_student(conn, student_id)
+    if not student:
+        flash('Student not found.', 'danger')
+        conn.close()
+        return redirect(url_for('manage_students'))
+    
+    query, params = results_query(conn, [student_id], academic_year, semester)
+    results = conn.execute(query, params).fetchall()
+    conn.close()
+    
+    return render_template('report_card.html', **report_card_context(student, results, academic_year, semester))
+
 @app.route('/admin/view_result/<int:result_id>')
 @admin_required
 def view_result(result_id):
     """View individual result details"""
     conn = get_db_connection()
     
-    # Get result with student information
-    result = conn.execute('''
+    # Get result with student information, from the year file when it is archived
+    _, archived_year = find_archived_result(conn, result_id)
+    result = conn.execute(f'''
         SELECT r.*, s.full_name, s.email, s.program, s.year
-        FROM results r 
+        FROM {results_source(conn, archived_year) if archived_year else 'results'} r 
         JOIN students s ON r.student_id = s.student_id 
         WHERE r.id = ?
     ''', (result_id,)).fetchone()
@@ -455,8 +851,8 @@ def view_result(result_id):
         return redirect(url_for('manage_results'))
     
     # Get all results for this student to show context
-    student_results = conn.execute('''
-        SELECT * FROM results 
+    student_results = conn.execute(f'''
+        SELECT * FROM {results_source(conn, student_ids=[result['student_id']])} 
         WHERE student_id = ? 
         ORDER BY academic_year DESC, semester DESC
     ''', (result['student_id'],)).fetchall()
@@ -486,28 +882,19 @@ def edit_student(student_id):
         phone_number = request.form['phone_number']
         address = request.form['address']
         
-        # Update student
-        conn.execute('''
-            UPDATE students 
-            SET full_name = ?, email = ?, program = ?, year = ?, date_of_birth = ?, phone_number = ?, address = ?
-            WHERE student_id = ?
-        ''', (full_name, email, program, year, date_of_birth, phone_number, address, student_id))
-        
-        # Also update user info
-        conn.execute('''
-            UPDATE users 
-            SET full_name = ?, email = ?
-            WHERE username = ?
-        ''', (full_name, email, student_id))
+        # Update student and their user info
+        db.update_student(conn, student_id, full_name, email, program, year, date_of_birth, phone_number, address,
+                          changed_by=session['username'])
         
         conn.commit()
+        publish_event(conn, 'students', action='updated', student_id=student_id)
         conn.close()
         
         flash('Student information updated successfully!', 'success')
         return redirect(url_for('view_student', student_id=student_id))
     
     # GET request - load student data
-    student = conn.execute('SELECT * FROM students WHERE student_id = ?', (student_id,)).fetchone()
+    student = db.get_student(conn, student_id)
     conn.close()
     
     if not student:
@@ -522,24 +909,80 @@ def delete_student(student_id):
     conn = get_db_connection()
     
     # Check if student exists
-    student = conn.execute('SELECT * FROM students WHERE student_id = ?', (student_id,)).fetchone()
+    student = db.get_student(conn, student_id)
     if not student:
         flash('Student not found.', 'danger')
         conn.close()
         return redirect(url_for('manage_students'))
     
-    # Delete related records first
-    conn.execute('DELETE FROM results WHERE student_id = ?', (student_id,))
-    conn.execute('DELETE FROM documents WHERE student_id = ?', (student_id,))
-    conn.execute('DELETE FROM students WHERE student_id = ?', (student_id,))
-    conn.execute('DELETE FROM users WHERE username = ?', (student_id,))
+    # Delete the student with related records
+    db.delete_student(conn, student_id, changed_by=session['username'])
     
     conn.commit()
+    publish_event(conn, 'students', action='deleted', student_id=student_id)
     conn.close()
     
     flash('Student and all related records deleted successfully!', 'success')
     return redirect(url_for('manage_students'))
 
+@app.route('/admin/students/lifecycle', methods=['GET', 'POST'])
+@admin_required
+def student_lifecycle():
+    """Year-end rollover, bulk deactivation and deletion of graduates, previewed before they run"""
+    operation = request.form.get('operation', 'rollover')
+    program = request.form.get('program', '')
+    year = request.form.get('year', type=int)
+    status = request.form.get('status', 'Inactive')
+    apply = request.form.get('apply') == '1'
+    
+    conn = get_db_connection()
+    programs = conn.execute('SELECT DISTINCT program FROM students ORDER BY program').fetchall()
+    years = conn.execute('SELECT DISTINCT year FROM students ORDER BY year DESC').fetchall()
+    status_counts = dict(conn.execute('SELECT status, COUNT(*) FROM students GROUP BY status').fetchall())
+    
+    summary = None
+    if request.method == 'POST':
+        try:
+            if operation == 'rollover':
+                if year is None:
+                    raise LifecycleError('Choose the academic year to close.')
+                summary = rollover(conn, year, session['username'], dry_run=not apply)
+            elif operation == 'set_status':
+                # Deactivating only touches active students; reactivating, only inactive ones
+                current = 'Active' if status == 'Inactive' else 'Inactive'
+                summary = set_status(conn, status, program, year, current, session['username'], dry_run=not apply)
+            elif operation == 'delete_graduates':
+                summary = delete_graduates(conn, program, year, session['username'], dry_run=not apply)
+            else:
+                raise LifecycleError(f'Unknown operation: {operation}')
+        except LifecycleError as e:
+            conn.rollback()
+            flash(str(e), 'warning')
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
+        
+        if summary is not None and apply:
+            conn.commit()
+            publish_event(conn, 'students', action='bulk', operation=operation)
+            conn.close()
+            if operation == 'rollover':
+                flash(f"Rolled {year} over: {summary['promoted']} students promoted, "
+                      f"{summary['graduated']} graduated.", 'success')
+            elif operation == 'set_status':
+                flash(f"{summary['students']} students marked {status}.", 'success')
+            else:
+                flash(f"Deleted {summary['students']} graduated students with {summary['results']} results and "
+                      f"{summary['documents']} documents.", 'success')
+            return redirect(url_for('student_lifecycle'))
+    
+    conn.close()
+    
+    return render_template('student_lifecycle.html', summary=summary, operation=operation, programs=programs, years=years, status_counts=status_counts,
+                           statuses=STUDENT_STATUSES, final_grade=FINAL_GRADE,
+                           current_filters={'program': program, 'year': year, 'status': status})
+
 @app.route('/admin/results')
 @admin_required
 def manage_results():
@@ -553,10 +996,17 @@ def manage_results():
     
     conn = get_db_connection()
     
-    # Build query with filters
-    query = '''
+    # Build query with filters. A year filter reads only the database holding that year.
+    try:
+        source = results_source(conn, year_filter)
+    except ArchiveError as e:
+        # More archived years than one query can read: the hot table and the newest archives
+        newest = [row['academic_year'] for row in archived_years(conn)][:attach_limit(conn)]
+        source = results_source(conn, years=newest)
+        flash(f'{e} Showing the {len(newest)} most recent archived years.', 'warning')
+    query = f'''
         SELECT r.*, s.full_name 
-        FROM results r 
+        FROM {source} r 
         JOIN students s ON r.student_id = s.student_id 
         WHERE 1=1
     '''
@@ -588,17 +1038,38 @@ def manage_results():
     
     query += ' ORDER BY r.academic_year DESC, r.semester, r.student_id'
     
-    results = conn.execute(query, params).fetchall()
-    
-    # Get unique values for filter dropdowns
-    courses = conn.execute('SELECT DISTINCT course_code, course_name FROM results ORDER BY course_code').fetchall()
-    grades = conn.execute('SELECT DISTINCT grade FROM results ORDER BY grade').fetchall()
-    semesters = conn.execute('SELECT DISTINCT semester FROM results ORDER BY semester').fetchall()
-    years = conn.execute('SELECT DISTINCT academic_year FROM results ORDER BY academic_year DESC').fetchall()
+    # Get unique values for filter dropdowns, from the frozen aggregates of archived years
+    archives = archived_years(conn)
+    courses = conn.execute(f'''
+        SELECT course_code, course_name FROM (
+            {union_frozen(archives, 'SELECT DISTINCT course_code, course_name FROM results',
+                          'SELECT course_code, course_name FROM archived_courses')}
+        ) AS c GROUP BY course_code, course_name ORDER BY course_code
+    ''').fetchall()
+    grades = conn.execute(f'''
+        SELECT DISTINCT grade FROM (
+            {union_frozen(archives, 'SELECT DISTINCT grade FROM results',
+                          'SELECT grade FROM archived_grade_counts')}
+        ) AS g ORDER BY grade
+    ''').fetchall()
+    semesters = conn.execute(f'''
+        SELECT DISTINCT semester FROM (
+            {union_frozen(archives, 'SELECT DISTINCT semester FROM results',
+                          'SELECT semester FROM archived_semester_stats')}
+        ) AS t ORDER BY semester
+    ''').fetchall()
+    years = conn.execute('''
+        SELECT DISTINCT academic_year FROM (
+            SELECT DISTINCT academic_year FROM results
+            UNION ALL
+            SELECT academic_year FROM archived_years
+        ) AS y ORDER BY academic_year DESC
+    ''').fetchall()
     
-    conn.close()
+    # Read last, while the page is sent
+    results = LazyRows(db.iterate(conn, query, params))
     
-    return render_template('manage_results.html', 
+    return stream_page(conn, 'manage_results.html', 
                           results=results, 
                           courses=courses,
                           grades=grades,
@@ -619,6 +1090,13 @@ def manage_results():
 def edit_result(result_id):
     conn = get_db_connection()
     
+    # Archived years are read-only
+    archived_result, archived_year = find_archived_result(conn, result_id)
+    if archived_result:
+        conn.close()
+        flash(f'Results for {archived_year} are archived and cannot be edited.', 'warning')
+        return redirect(url_for('view_result', result_id=result_id))
+    
     if request.method == 'POST':
         course_code = request.form['course_code']
         course_name = request.form['course_name']
@@ -629,27 +1107,25 @@ def edit_result(result_id):
         academic_year = request.form['academic_year']
         remark = request.form['remark']
         
+        if is_archived(conn, academic_year):
+            conn.close()
+            flash(f'Results for {academic_year} are archived and cannot be changed.', 'warning')
+            return redirect(url_for('edit_result', result_id=result_id))
+        
         # Update result
-        conn.execute('''
-            UPDATE results 
-            SET course_code = ?, course_name = ?, subject_level = ?, grade = ?, credits = ?, 
-                semester = ?, academic_year = ?, remark = ?, updated_at = CURRENT_TIMESTAMP
-            WHERE id = ?
-        ''', (course_code, course_name, subject_level, grade, credits, semester, academic_year, remark, result_id))
+        previous = db.get_result_with_student(conn, result_id)
+        db.update_result(conn, result_id, course_code, course_name, subject_level, grade, credits,
+                         semester, academic_year, remark, changed_by=session['username'])
         
         conn.commit()
+        publish_result(conn, 'updated', result_id, previous['grade'] if previous else None)
         conn.close()
         
         flash('Result updated successfully!', 'success')
         return redirect(url_for('view_result', result_id=result_id))
     
     # GET request - load result data
-    result = conn.execute('''
-        SELECT r.*, s.full_name 
-        FROM results r 
-        JOIN students s ON r.student_id = s.student_id 
-        WHERE r.id = ?
-    ''', (result_id,)).fetchone()
+    result = db.get_result_with_student(conn, result_id)
     
     conn.close()
     
@@ -665,23 +1141,23 @@ def delete_result(result_id):
     conn = get_db_connection()
     
     # Check if result exists and get student info for redirect
-    result = conn.execute('''
-        SELECT r.*, s.full_name 
-        FROM results r 
-        JOIN students s ON r.student_id = s.student_id 
-        WHERE r.id = ?
-    ''', (result_id,)).fetchone()
+    result = db.get_result_with_student(conn, result_id)
     
     if not result:
-        flash('Result not found.', 'danger')
+        archived_result, archived_year = find_archived_result(conn, result_id)
         conn.close()
+        if archived_result:
+            flash(f'Results for {archived_year} are archived and cannot be deleted.', 'warning')
+            return redirect(url_for('view_result', result_id=result_id))
+        flash('Result not found.', 'danger')
         return redirect(url_for('manage_results'))
     
     student_id = result['student_id']
     
     # Delete result
-    conn.execute('DELETE FROM results WHERE id = ?', (result_id,))
+    db.delete_result(conn, result_id, changed_by=session['username'])
     conn.commit()
+    publish_event(conn, 'results', action='deleted', result={'id': result_id}, previous_grade=result['grade'])
     conn.close()
     
     flash(f'Result for {result["course_name"]} deleted successfully!', 'success')
@@ -698,36 +1174,50 @@ def manage_documents():
     status_filter = request.args.get('status', '')
     doc_type_filter = request.args.get('doc_type', '')
     student_filter = request.args.get('student', '')
+    text_filter = request.args.get('q', '').strip()
     
     conn = get_db_connection()
     
     # Build query with filters
-    query = '''
-        SELECT d.*, s.full_name 
-        FROM documents d 
-        JOIN students s ON d.student_id = s.student_id 
-        WHERE 1=1
-    '''
+    filters = ''
     params = []
     
     if status_filter:
-        query += ' AND d.status = ?'
+        filters += ' AND d.status = ?'
         params.append(status_filter)
     
     if doc_type_filter:
-        query += ' AND d.doc_type = ?'
+        filters += ' AND d.doc_type = ?'
         params.append(doc_type_filter)
     
     if student_filter:
-        query += ' AND (d.student_id LIKE ? OR s.full_name LIKE ?)'
+        filters += ' AND (d.student_id LIKE ? OR s.full_name LIKE ?)'
         params.extend([f'%{student_filter}%', f'%{student_filter}%'])
     
-    query += ' ORDER BY d.upload_date DESC'
+    # Full-text search over the name and extracted text of each document. The
+    # filters above run inside the search, before its limit on matches
+    snippets = {}
+    if text_filter:
+        matches = document_index.search_documents(
+            conn, text_filter,
+            filters=filters, filter_params=params)
+        snippets = {doc_id: document_index.highlight(snippet) for doc_id, snippet in matches.items()}
+        filters += f" AND d.id IN ({', '.join('?' * len(snippets)) or 'NULL'})"
+        params = params + list(snippets)
+    
+    query = f'''
+        SELECT d.*, s.full_name, dd.content_hash 
+        FROM documents d 
+        JOIN students s ON d.student_id = s.student_id 
+        LEFT JOIN document_derivatives dd ON dd.doc_id = d.id 
+        WHERE 1=1{filters}
+        ORDER BY d.upload_date DESC
+    '''
     
     documents = conn.execute(query, params).fetchall()
     
     # Get filter options
-    status_options = ['Pending', 'Approved', 'Rejected']
+    status_options = DOCUMENT_STATUSES
     doc_types = conn.execute('SELECT DISTINCT doc_type FROM documents ORDER BY doc_type').fetchall()
     
     conn.close()
@@ -736,10 +1226,12 @@ def manage_documents():
                           documents=documents,
                           status_options=status_options,
                           doc_types=doc_types,
+                          snippets=snippets,
                           current_filters={
                               'status': status_filter,
                               'doc_type': doc_type_filter,
-                              'student': student_filter
+                              'student': student_filter,
+                              'q': text_filter
                           })
 
 @app.route('/admin/update_document_status/<int:doc_id>', methods=['POST'])
@@ -748,26 +1240,96 @@ def update_document_status(doc_id):
     new_status = request.form['status']
     feedback = request.form.get('feedback', '')
     
+    if new_status not in DOCUMENT_STATUSES:
+        flash('Invalid document status.', 'danger')
+        return redirect(redirect_target('manage_documents'))
+    
     conn = get_db_connection()
-    conn.execute('''
-        UPDATE documents 
-        SET status = ?, feedback = ?, reviewed_by = ?, reviewed_at = CURRENT_TIMESTAMP 
-        WHERE id = ?
-    ''', (new_status, feedback, session['username'], doc_id))
+    db.update_document_status(conn, doc_id, new_status, feedback, session['username'])
     conn.commit()
+    publish_documents_reviewed(conn, [doc_id], new_status)
     conn.close()
     
     flash(f'Document status updated to {new_status}!', 'success')
+    return redirect(redirect_target('manage_documents'))
+
+@app.route('/admin/documents/review', methods=['POST'])
+@admin_required
+def review_documents():
+    doc_ids = request.form.getlist('doc_ids', type=int)
+    new_status = request.form['status']
+    feedback = request.form.get('feedback', '')
     
-    # Check if we came from student view
-    if request.referrer and 'student' in request.referrer:
-        # Extract student ID from referrer URL
-        import re
-        student_match = re.search(r'/student/([^/]+)', request.referrer)
-        if student_match:
-            return redirect(url_for('view_student', student_id=student_match.group(1)))
+    if new_status not in DOCUMENT_STATUSES:
+        flash('Invalid document status.', 'danger')
+    elif not doc_ids:
+        flash('No documents selected.', 'warning')
+    else:
+        conn = get_db_connection()
+        updated = db.review_documents(conn, doc_ids, new_status, feedback, session['username'])
+        conn.commit()
+        publish_documents_reviewed(conn, doc_ids, new_status)
+        conn.close()
+        flash(f'{updated} documents marked {new_status}!', 'success')
     
-    return redirect(url_for('manage_documents'))
+    return redirect(redirect_target('manage_documents'))
+
+# Student queries inbox, newest first, paged with ?before=<id> so a page is one index range
+QUERY_TYPES = ['Result Inquiry', 'Document Issue', 'Technical Problem', 'Other']
+QUERY_STATUSES = ['Open', 'Answered', 'Closed']
+QUERY_PAGE_SIZE = 50
+
+@app.route('/admin/queries')
+@admin_required
+def admin_queries():
+    status = request.args.get('status', 'Open')
+    before = request.args.get('before', type=int)
+    
+    conn = get_db_connection()
+    query = 'SELECT * FROM queries WHERE 1=1'
+    params = []
+    if status in QUERY_STATUSES:
+        query += ' AND status = ?'
+        params.append(status)
+    if before:
+        query += ' AND id < ?'
+        params.append(before)
+    queries = conn.execute(f'{query} ORDER BY id DESC LIMIT ?', params + [QUERY_PAGE_SIZE + 1]).fetchall()
+    names = {}
+    if queries:
+        student_ids = list({row['student_id'] for row in queries})
+        names = dict(conn.execute(f'''
+            SELECT student_id, full_name FROM students WHERE student_id IN ({", ".join("?" * len(student_ids))})
+        ''', student_ids).fetchall())
+    open_count = conn.execute("SELECT COUNT(*) FROM queries WHERE status = 'Open'").fetchone()[0]
+    outbox = outbox_counts(conn)
+    conn.close()
+    
+    return render_template('admin_queries.html', queries=queries[:QUERY_PAGE_SIZE], names=names,
+                           next_before=queries[QUERY_PAGE_SIZE - 1]['id'] if len(queries) > QUERY_PAGE_SIZE else None,
+                           status=status, statuses=QUERY_STATUSES, open_count=open_count, outbox=outbox)
+
+@app.route('/admin/queries/<int:query_id>', methods=['POST'])
+@admin_required
+def respond_to_query(query_id):
+    """Answer or close a query; the student is emailed by the notification dispatcher"""
+    response = request.form.get('response', '').strip()
+    status = request.form.get('status', 'Answered')
+    
+    if status not in QUERY_STATUSES or not response:
+        flash('Write a response and choose a status.', 'danger')
+        return redirect(redirect_target('admin_queries'))
+    
+    conn = get_db_connection()
+    answered = db.answer_query(conn, query_id, response, status, session['username'])
+    conn.commit()
+    conn.close()
+    
+    if answered is None:
+        flash('Query not found.', 'danger')
+    else:
+        flash(f"Response to {answered['student_id']} saved; they will be notified by email.", 'success')
+    return redirect(redirect_target('admin_queries'))
 
 @app.route('/admin/analytics')
 @admin_required
@@ -776,13 +1338,19 @@ def analytics():
     
     # Overall statistics
     total_students = conn.execute('SELECT COUNT(*) FROM students').fetchone()[0]
-    total_results = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+    total_results = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] + archived_result_count(conn)
     total_documents = conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
     
+    # Archived years contribute their frozen aggregates instead of being rescanned
+    archives = archived_years(conn)
+    
     # Grade distribution
-    grade_distribution = conn.execute('''
-        SELECT grade, COUNT(*) as count 
-        FROM results 
+    grade_counts = union_frozen(archives,
+                                'SELECT grade, COUNT(*) as count FROM results GROUP BY grade',
+                                'SELECT grade, count FROM archived_grade_counts')
+    grade_distribution = conn.execute(f'''
+        SELECT grade, SUM(count) as count 
+        FROM ({grade_counts}) AS g 
         GROUP BY grade 
         ORDER BY 
             CASE grade 
@@ -810,76 +1378,63 @@ def analytics():
     ''').fetchall()
     
     # Semester performance
-    semester_stats = conn.execute('''
-        SELECT semester, academic_year, 
-               AVG(CASE 
-                   WHEN grade = 'A' THEN 4.0
-                   WHEN grade = 'A-' THEN 3.7
-                   WHEN grade = 'B+' THEN 3.3
-                   WHEN grade = 'B' THEN 3.0
-                   WHEN grade = 'B-' THEN 2.7
-                   WHEN grade = 'C+' THEN 2.3
-                   WHEN grade = 'C' THEN 2.0
-                   WHEN grade = 'C-' THEN 1.7
-                   WHEN grade = 'D+' THEN 1.3
-                   WHEN grade = 'D' THEN 1.0
-                   ELSE 0.0
-               END) as avg_gpa,
-               COUNT(*) as total_results
+    semester_totals = union_frozen(archives, '''
+        SELECT semester, academic_year, COALESCE(SUM(grade_points), 0) as points_sum, COUNT(*) as total_results
         FROM results 
+        GROUP BY semester, academic_year
+    ''', 'SELECT semester, academic_year, points_sum, total_results FROM archived_semester_stats')
+    semester_stats = conn.execute(f'''
+        SELECT semester, academic_year, 
+               SUM(points_sum) / SUM(total_results) as avg_gpa,
+               SUM(total_results) as total_results
+        FROM ({semester_totals}) AS t 
         GROUP BY semester, academic_year 
         ORDER BY academic_year DESC, semester
     ''').fetchall()
     
     # Subject performance
-    subject_performance = conn.execute('''
+    subject_totals = union_frozen(archives, '''
+        SELECT c.course_name, c.course_code, r.total_students, r.struggling_students, r.points_sum
+        FROM (
+            SELECT course_id, COUNT(*) as total_students,
+                   SUM(CASE WHEN grade IN ('F', 'D', 'D+') THEN 1 ELSE 0 END) as struggling_students,
+                   COALESCE(SUM(grade_points), 0) as points_sum
+            FROM results
+            GROUP BY course_id
+        ) r
+        JOIN courses c ON c.id = r.course_id
+    ''', '''
+        SELECT course_name, course_code, total_students, struggling_students, points_sum
+        FROM archived_subject_stats
+    ''')
+    subject_performance = conn.execute(f'''
         SELECT course_name, course_code,
-               COUNT(*) as total_students,
-               SUM(CASE WHEN grade IN ('F', 'D', 'D+') THEN 1 ELSE 0 END) as struggling_students,
-               AVG(CASE 
-                   WHEN grade = 'A' THEN 4.0
-                   WHEN grade = 'A-' THEN 3.7
-                   WHEN grade = 'B+' THEN 3.3
-                   WHEN grade = 'B' THEN 3.0
-                   WHEN grade = 'B-' THEN 2.7
-                   WHEN grade = 'C+' THEN 2.3
-                   WHEN grade = 'C' THEN 2.0
-                   WHEN grade = 'C-' THEN 1.7
-                   WHEN grade = 'D+' THEN 1.3
-                   WHEN grade = 'D' THEN 1.0
-                   ELSE 0.0
-               END) as avg_gpa
-        FROM results
+               SUM(total_students) as total_students,
+               SUM(struggling_students) as struggling_students,
+               SUM(points_sum) / SUM(total_students) as avg_gpa
+        FROM ({subject_totals}) AS t
         GROUP BY course_name, course_code
         ORDER BY avg_gpa DESC
     ''').fetchall()
     
     # Student performance overview
-    student_performance = conn.execute('''
+    student_totals = union_frozen(archives, '''
+        SELECT student_id, COUNT(*) as total_subjects, COALESCE(SUM(grade_points), 0) as points_sum
+        FROM results
+        GROUP BY student_id
+    ''', 'SELECT student_id, total_subjects, points_sum FROM archived_student_stats')
+    # One row per student: read last, while the page is sent
+    student_performance = LazyRows(db.iterate(conn, f'''
         SELECT s.student_id, s.full_name, s.program,
-               COUNT(r.id) as total_subjects,
-               AVG(CASE 
-                   WHEN r.grade = 'A' THEN 4.0
-                   WHEN r.grade = 'A-' THEN 3.7
-                   WHEN r.grade = 'B+' THEN 3.3
-                   WHEN r.grade = 'B' THEN 3.0
-                   WHEN r.grade = 'B-' THEN 2.7
-                   WHEN r.grade = 'C+' THEN 2.3
-                   WHEN r.grade = 'C' THEN 2.0
-                   WHEN r.grade = 'C-' THEN 1.7
-                   WHEN r.grade = 'D+' THEN 1.3
-                   WHEN r.grade = 'D' THEN 1.0
-                   ELSE 0.0
-               END) as gpa
+               COALESCE(SUM(t.total_subjects), 0) as total_subjects,
+               COALESCE(SUM(t.points_sum) / SUM(t.total_subjects), 0.0) as gpa
         FROM students s
-        LEFT JOIN results r ON s.student_id = r.student_id
+        LEFT JOIN ({student_totals}) t ON s.student_id = t.student_id
         GROUP BY s.student_id, s.full_name, s.program
         ORDER BY gpa DESC
-    ''').fetchall()
-    
-    conn.close()
+    '''))
     
-    return render_template('analytics.html',
+    return stream_page(conn, 'analytics.html',
                          total_students=total_students,
                          total_results=total_results,
                          total_documents=total_documents,
@@ -890,6 +1445,50 @@ def analytics():
                          student_performance=student_performance,
                          subjects=SUBJECTS)
 
+def school_summary(tenant, conn):
+    """Headline figures of one school for the district report"""
+    archives = archived_years(conn)
+    grade_counts = union_frozen(archives,
+                                'SELECT grade, COUNT(*) as count FROM results GROUP BY grade',
+                                'SELECT grade, count FROM archived_grade_counts')
+    totals = union_frozen(archives,
+                          'SELECT COALESCE(SUM(grade_points), 0) as points_sum, COUNT(*) as total_results FROM results',
+                          'SELECT points_sum, total_results FROM archived_semester_stats')
+    points_sum = conn.execute(f'SELECT COALESCE(SUM(points_sum), 0) FROM ({totals}) AS t').fetchone()[0]
+    summary = dashboard_counts(conn)
+    summary['points_sum'] = points_sum
+    summary['grades'] = {row['grade']: row['count'] for row in conn.execute(f'''
+        SELECT grade, SUM(count) as count FROM ({grade_counts}) AS g GROUP BY grade
+    ''').fetchall()}
+    return summary
+
+@app.route('/district/analytics')
+@admin_required
+def district_analytics():
+    """Figures of every school side by side, read from the school databases in parallel"""
+    if current_tenant() is not tenants.district:
+        flash('District analytics are only available on the district site.', 'warning')
+        return redirect(url_for('analytics'))
+    
+    schools = []
+    totals = {'student_count': 0, 'result_count': 0, 'pending_docs': 0, 'points_sum': 0}
+    grades = dict.fromkeys(GRADE_TO_POINTS, 0)
+    for tenant, summary, error in tenants.fan_out(school_summary):
+        if error is not None:
+            app.logger.warning('District analytics: %s is unavailable: %s', tenant.slug, error)
+            schools.append({'slug': tenant.slug, 'name': tenant.name, 'error': str(error)})
+            continue
+        for key in totals:
+            totals[key] += summary[key]
+        for grade, count in summary['grades'].items():
+            grades[grade] = grades.get(grade, 0) + count
+        avg_gpa = summary['points_sum'] / summary['result_count'] if summary['result_count'] else None
+        schools.append(dict(summary, slug=tenant.slug, name=tenant.name, avg_gpa=avg_gpa, error=None))
+    totals['avg_gpa'] = totals['points_sum'] / totals['result_count'] if totals['result_count'] else None
+    
+    return render_template('district_analytics.html', schools=schools, totals=totals,
+                           grade_distribution=[(grade, count) for grade, count in grades.items() if count])
+
 @app.route('/admin/add_result', methods=['GET', 'POST'])
 @admin_required
 def add_result():
@@ -907,17 +1506,19 @@ def add_result():
         conn = get_db_connection()
         
         # Check if student exists
-        student = conn.execute('SELECT * FROM students WHERE student_id = ?', (student_id,)).fetchone()
+        student = db.get_student(conn, student_id)
         if not student:
             flash('Student ID does not exist.', 'danger')
             conn.close()
             return render_template('add_result.html', subjects=SUBJECTS)
         
+        if is_archived(conn, academic_year):
+            flash(f'Results for {academic_year} are archived and cannot be changed.', 'warning')
+            conn.close()
+            return render_template('add_result.html', subjects=SUBJECTS)
+        
         # Check if result already exists for this student, course, semester, and year
-        existing = conn.execute('''
-            SELECT * FROM results 
-            WHERE student_id = ? AND course_code = ? AND semester = ? AND academic_year = ?
-        ''', (student_id, course_code, semester, academic_year)).fetchone()
+        existing = db.find_result(conn, student_id, course_code, semester, academic_year)
         
         if existing:
             flash('Result for this course already exists for this student in the specified semester and year.', 'warning')
@@ -925,12 +1526,11 @@ def add_result():
             return render_template('add_result.html', subjects=SUBJECTS)
         
         # Insert new result
-        conn.execute('''
-            INSERT INTO results (student_id, course_code, course_name, subject_level, grade, credits, semester, academic_year, remark)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (student_id, course_code, course_name, subject_level, grade, credits, semester, academic_year, remark))
+        new_result_id = db.insert_result(conn, student_id, course_code, course_name, subject_level, grade, credits,
+                                         semester, academic_year, remark, changed_by=session['username'])
         
         conn.commit()
+        publish_result(conn, 'added', new_result_id)
         conn.close()
         
         flash(f'Result added successfully for {student["full_name"]}!', 'success')
@@ -963,39 +1563,52 @@ def add_student():
         conn = get_db_connection()
         
         # Check if student already exists
-        existing = conn.execute('SELECT * FROM students WHERE student_id = ?', (student_id,)).fetchone()
+        existing = db.get_student(conn, student_id)
         if existing:
             flash('Student ID already exists.', 'danger')
             conn.close()
-            return render_template('add_student.html')
+            return render_template('add_student.html', form=request.form)
         
         # Check if email already exists
-        existing_email = conn.execute('SELECT * FROM students WHERE email = ?', (email,)).fetchone()
+        existing_email = db.get_student_by_email(conn, email)
         if existing_email:
             flash('Email already exists.', 'danger')
             conn.close()
-            return render_template('add_student.html')
+            return render_template('add_student.html', form=request.form)
+        
+        # The same learner enrolled before under another id, spelling or address
+        if not request.form.get('confirm_duplicate'):
+            matches = find_matches(conn, full_name, email, phone_number, date_of_birth)
+            if matches:
+                conn.close()
+                flash('This student may already be enrolled. Check the matches below before adding them.', 'warning')
+                return render_template('add_student.html', form=request.form, matches=matches)
         
         # Insert new student
-        conn.execute('''
-            INSERT INTO students (student_id, full_name, email, program, year, date_of_birth, phone_number, address)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-        ''', (student_id, full_name, email, program, year, date_of_birth, phone_number, address))
+        db.insert_student(conn, student_id, full_name, email, program, year, date_of_birth, phone_number, address,
+                          changed_by=session['username'])
         
         # Also create a user account for the student
         default_password = 'password123'
-        conn.execute('''
-            INSERT INTO users (username, password, role, full_name, email)
-            VALUES (?, ?, ?, ?, ?)
-        ''', (student_id, generate_password_hash(default_password), 'student', full_name, email))
+        db.insert_user(conn, student_id, generate_password_hash(default_password), 'student', full_name, email)
         
         conn.commit()
+        publish_event(conn, 'students', action='added', student_id=student_id)
         conn.close()
         
         flash(f'Student {full_name} added successfully! Default password is "{default_password}"', 'success')
         return redirect(url_for('manage_students'))
     
-    return render_template('add_student.html')
+    return render_template('add_student.html', form={})
+
+@app.route('/admin/students/duplicates')
+@admin_required
+def duplicate_students():
+    """Groups of students that are likely the same learner enrolled more than once"""
+    conn = get_db_connection()
+    report = duplicate_report(conn)
+    conn.close()
+    return render_template('duplicate_students.html', report=report)
 
 # Student Routes
 @app.route('/student/dashboard')
@@ -1004,8 +1617,8 @@ def student_dashboard():
     conn = get_db_connection()
     
     # Get student results
-    results = conn.execute('''
-        SELECT * FROM results 
+    results = conn.execute(f'''
+        SELECT * FROM {results_source(conn, student_ids=[session['student_id']])} 
         WHERE student_id = ? 
         ORDER BY academic_year DESC, semester DESC, course_code
     ''', (session['student_id'],)).fetchall()
@@ -1021,13 +1634,28 @@ def student_dashboard():
         ORDER BY upload_date DESC
     ''', (session['student_id'],)).fetchall()
     
+    # What if: ?course_code=&grade=&credits= projects one more grade
+    projection = what_if_error = None
+    if request.args.get('grade'):
+        try:
+            projection = what_if(conn, session['student_id'], requested_hypothetical()[0])
+        except APIError as e:
+            what_if_error = e.message
+    
     conn.close()
     
-    return render_template('student_dashboard.html', 
-                          results=results, 
-                          documents=documents,
-                          gpa=gpa,
-                          total_credits=total_credits)
+    # A reload with nothing new costs the queries and a 304, not a render
+    etag = version_of('student_dashboard', session['username'], session.get('full_name'), results, documents,
+                      projection, what_if_error)
+    return revalidated(etag, lambda: render_template('student_dashboard.html', 
+                                                     results=results, 
+                                                     documents=documents,
+                                                     gpa=gpa,
+                                                     total_credits=total_credits,
+                                                     catalog=course_catalog(),
+                                                     grade_points=GRADE_TO_POINTS,
+                                                     projection=projection,
+                                                     what_if_error=what_if_error))
 
 @app.route('/student/upload', methods=['GET', 'POST'])
 @student_required
@@ -1056,18 +1684,23 @@ def upload_document():
             # Secure filename and create path
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             filename = f"{session['student_id']}_{timestamp}_{file.filename}"
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            filepath = os.path.join(setting('UPLOAD_FOLDER'), filename)
             file.save(filepath)
             
             # Save to database
             conn = get_db_connection()
-            conn.execute('''
-                INSERT INTO documents (student_id, doc_name, doc_type, doc_path, upload_date)
-                VALUES (?, ?, ?, ?, ?)
-            ''', (session['student_id'], file.filename, doc_type, filepath, datetime.now().strftime('%Y-%m-%d %H:%M:%S')))
+            doc_id = db.insert_document(conn, session['student_id'], file.filename, doc_type, filepath,
+                                        datetime.now().strftime('%Y-%m-%d %H:%M:%S'), changed_by=session['username'])
             conn.commit()
+            publish_documents_uploaded(conn, [doc_id])
             conn.close()
             
+            # Thumbnails, previews and photo clean-up happen after the response, on a worker
+            # thread that does not see the request's tenant, so it gets the school's own connect
+            tenant = current_tenant()
+            media.process_in_background(tenant.connect, doc_id, filepath, setting('DERIVATIVES_FOLDER'))
+            document_index.index_in_background(tenant.connect, doc_id, filepath, file.filename)
+            
             flash('Document uploaded successfully!', 'success')
             return redirect(url_for('student_dashboard'))
     
@@ -1078,14 +1711,24 @@ def upload_document():
 def submit_query():
     if request.method == 'POST':
         query_type = request.form['query_type']
-        message = request.form['message']
+        message = request.form['message'].strip()
+        
+        if query_type not in QUERY_TYPES or not message:
+            flash('Choose a query type and write a message.', 'danger')
+            return redirect(url_for('submit_query'))
         
-        # In a real application, you would save this to a database
-        # For now, we'll just flash a message
+        conn = get_db_connection()
+        db.insert_query(conn, session['student_id'], query_type, message)
+        conn.commit()
+        conn.close()
         flash('Your query has been submitted successfully. We will get back to you soon.', 'success')
-        return redirect(url_for('student_dashboard'))
+        return redirect(url_for('submit_query'))
     
-    return render_template('submit_query.html')
+    conn = get_db_connection()
+    queries = conn.execute('SELECT * FROM queries WHERE student_id = ? ORDER BY id DESC LIMIT ?',
+                           (session['student_id'], QUERY_PAGE_SIZE)).fetchall()
+    conn.close()
+    return render_template('submit_query.html', queries=queries, query_types=QUERY_TYPES)
 
 @app.route('/student/results')
 @student_required
@@ -1097,7 +1740,7 @@ def student_results():
     year_filter = request.args.get('year', '')
     semester_filter = request.args.get('semester', '')
     
-    query = 'SELECT * FROM results WHERE student_id = ?'
+    query = f'SELECT * FROM {results_source(conn, year_filter, [session["student_id"]])} WHERE student_id = ?'
     params = [session['student_id']]
     
     if year_filter:
@@ -1113,16 +1756,17 @@ def student_results():
     results = conn.execute(query, params).fetchall()
     
     # Get filter options
-    years = conn.execute('''
+    all_results = results_source(conn, student_ids=[session['student_id']])
+    years = conn.execute(f'''
         SELECT DISTINCT academic_year 
-        FROM results 
+        FROM {all_results} 
         WHERE student_id = ? 
         ORDER BY academic_year DESC
     ''', (session['student_id'],)).fetchall()
     
-    semesters = conn.execute('''
+    semesters = conn.execute(f'''
         SELECT DISTINCT semester 
-        FROM results 
+        FROM {all_results} 
         WHERE student_id = ? 
         ORDER BY semester
     ''', (session['student_id'],)).fetchall()
@@ -1133,23 +1777,122 @@ def student_results():
     
     conn.close()
     
-    return render_template('student_results.html',
-                          results=results,
-                          years=years,
-                          semesters=semesters,
-                          gpa=gpa,
-                          total_credits=total_credits,
-                          current_filters={
-                              'year': year_filter,
-                              'semester': semester_filter
-                          })
+    etag = version_of('student_results', session['username'], session.get('full_name'), year_filter,
+                      semester_filter, results, years, semesters)
+    return revalidated(etag, lambda: render_template('student_results.html',
+                                                     results=results,
+                                                     years=years,
+                                                     semesters=semesters,
+                                                     gpa=gpa,
+                                                     total_credits=total_credits,
+                                                     current_filters={
+                                                         'year': year_filter,
+                                                         'semester': semester_filter
+                                                     }))
+
+STUDENT_RESULT_FIELDS = ('course_code', 'course_name', 'subject_level', 'grade', 'credits', 'semester',
+                         'academic_year', 'remark')
+
+@app.route('/student/results.json')
+@student_required
+def student_results_data():
+    """The student's results as compact JSON: field names once, then one array per result.
+
+    The ETag is also returned as "version"; send it back in If-None-Match to get a 304 when
+    nothing changed.
+    """
+    conn = get_db_connection()
+    rows = conn.execute(f'''
+        SELECT {", ".join(STUDENT_RESULT_FIELDS)} FROM {results_source(conn, student_ids=[session['student_id']])}
+        WHERE student_id = ?
+        ORDER BY academic_year DESC, semester DESC, course_code
+    ''', (session['student_id'],)).fetchall()
+    conn.close()
+    
+    etag = version_of('student_results_data', session['student_id'], rows)
+    return revalidated(etag, lambda: jsonify({
+        'student_id': session['student_id'],
+        'version': etag,
+        'gpa': calculate_gpa(rows),
+        'total_credits': sum(row['credits'] or 0 for row in rows),
+        'fields': STUDENT_RESULT_FIELDS,
+        'rows': [list(row) for row in rows]
+    }))
+
+def what_if(conn, student_id, grades):
+    """A student's GPA and rank in their program and year with hypothetical grades, and the first one at every grade"""
+    student = db.get_student(conn, student_id)
+    if student is None:
+        raise APIError('Student not found', 404)
+    source = results_source(conn, cohort=(student['program'], student['year']))
+    cohort = cohorts.get(conn, source, student['program'], student['year'], current_tenant().slug)
+    if student_id not in cohort:
+        raise APIError('Student not found', 404)
+    return {
+        'cohort': {'program': cohort.program, 'year': cohort.year, 'size': len(cohort)},
+        'projection': cohort.project_student(student_id, totals(grades)),
+        'table': cohort.grade_table(student_id, grades) if grades else [],
+    }
+
+@app.route('/student/what-if', methods=['GET', 'POST'])
+@student_required
+def student_what_if():
+    """What-if GPA: POST {"grades": [{"course_code": "MATH", "grade": "B+", "credits": 4}, ...]}
+    or GET ?course_code=MATH&grade=B%2B&credits=4.
+
+    Returns the projected GPA and rank among the student's program and year, and in table
+    the projection for every grade of the first hypothetical subject.
+    """
+    start = time.perf_counter()
+    grades, _ = requested_hypothetical()
+    conn = get_db_connection()
+    projection = what_if(conn, session['student_id'], grades)
+    conn.close()
+    
+    return jsonify({
+        'success': True,
+        **projection,
+        'seconds': round(time.perf_counter() - start, 4)
+    })
+
+@app.route('/student/service-worker.js')
+def student_service_worker():
+    """static/js/service-worker.js, served under /student/ so its scope is the student pages"""
+    config = {
+        'version': ASSET_VERSION,
+        'assets': OFFLINE_ASSETS + [url_for('static', filename=name) for name in OFFLINE_STATIC],
+        'pages': [url_for(endpoint) for endpoint in OFFLINE_PAGES],
+        'static': url_for('static', filename=''),
+    }
+    with open(os.path.join(app.static_folder, 'js', 'service-worker.js')) as f:
+        script = f'self.OFFLINE = {json.dumps(config)};\n' + f.read()
+    response = Response(script, mimetype='text/javascript')
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+@app.route('/student/manifest.webmanifest')
+def student_manifest():
+    """Web app manifest so students can add the portal to their home screen"""
+    school = current_tenant()
+    response = jsonify({
+        'name': f'{school.name} Results' if school.slug else 'Student Results System',
+        'short_name': 'Results',
+        'start_url': url_for('student_dashboard'),
+        'scope': url_for('student_dashboard').rsplit('/', 1)[0] + '/',
+        'display': 'standalone',
+        'theme_color': '#0d6efd',
+        'background_color': '#ffffff',
+        'icons': [{'src': url_for('static', filename='images/Logo.png'), 'sizes': 'any', 'type': 'image/png'}],
+    })
+    response.mimetype = 'application/manifest+json'
+    return response
 
 # Utility Routes
 @app.route('/download/<int:doc_id>')
 @login_required
 def download_document(doc_id):
     conn = get_db_connection()
-    document = conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,)).fetchone()
+    document = db.get_document(conn, doc_id)
     conn.close()
     
     if document:
@@ -1166,13 +1909,102 @@ def download_document(doc_id):
     
     return redirect(url_for('student_dashboard' if session['role'] == 'student' else 'admin_dashboard'))
 
+@app.route('/document/<int:doc_id>/<any(thumbnail, preview):kind>')
+@login_required
+def document_preview(doc_id, kind):
+    """Thumbnail or first-page preview of a document. Named by content hash, so cacheable for good."""
+    conn = get_db_connection()
+    derivative = conn.execute('''
+        SELECT d.student_id, dd.thumbnail_path, dd.preview_path
+        FROM documents d
+        JOIN document_derivatives dd ON dd.doc_id = d.id
+        WHERE d.id = ?
+    ''', (doc_id,)).fetchone()
+    conn.close()
+    
+    # Bare status codes: these are image requests, not pages
+    if not derivative:
+        return '', 404
+    if not (session['role'] == 'admin' or (session['role'] == 'student' and derivative['student_id'] == session['student_id'])):
+        return '', 403
+    
+    path = derivative['thumbnail_path'] if kind == 'thumbnail' else derivative['preview_path']
+    try:
+        return send_file(os.path.abspath(path), max_age=365 * 24 * 3600)
+    except FileNotFoundError:
+        return '', 404
+
+@app.route('/admin/events')
+@admin_required
+def admin_events():
+    """Server-Sent Events stream feeding the live dashboards"""
+    last_event_id = parse_last_event_id(request.headers.get('Last-Event-ID'))
+    return Response(current_tenant().bus.stream(last_event_id), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/admin/metrics/admission')
+@admin_required
+def admission_metrics():
+    """Active requests, queue depth, admissions and shed counts of every admission gate"""
+    return jsonify({'enabled': app.config['ADMISSION_CONTROL'], 'gates': admission_control.metrics()})
+
+@app.route('/admin/metrics/replicas')
+@admin_required
+def replica_metrics():
+    """Position and lag of each read replica, and how many reads went to replicas or the primary"""
+    replicas = current_tenant().replicas
+    return jsonify({'enabled': replicas is not None, **(replicas.status() if replicas is not None else {})})
+
+@app.route('/admin/profiler', methods=['GET', 'POST'])
+@admin_required
+def profiler_page():
+    """Profiler settings, the profiled endpoints and the flame graph of one of them"""
+    if request.method == 'POST':
+        if request.form.get('action') == 'reset':
+            profiler.reset(request.form.get('view') or None)
+            flash('Profiles cleared.', 'success')
+        else:
+            routes = [e.strip() for e in request.form.get('routes', '').split(',') if e.strip()]
+            unknown = [e for e in routes if e not in app.view_functions]
+            if unknown:
+                flash(f"Unknown endpoints: {', '.join(unknown)}", 'danger')
+            else:
+                profiler.configure(routes=routes,
+                                   sample_rate=request.form.get('sample_percent', 0, type=float) / 100,
+                                   interval=request.form.get('interval_ms', 5, type=float) / 1000,
+                                   trace_memory=request.form.get('trace_memory') == '1')
+                flash('Profiler settings saved.', 'success')
+        return redirect(url_for('profiler_page', view=request.form.get('view') or None))
+    
+    endpoint = request.args.get('view', '')
+    stacks = profiler.stacks(endpoint) if endpoint else None
+    return render_template('profiler.html', profiler=profiler, summaries=profiler.summaries(), endpoint=endpoint,
+                           flame=tree(stacks) if stacks else None, snapshot=profiler.snapshot(endpoint),
+                           endpoints=sorted(e for e in app.view_functions if e not in PROFILER_EXEMPT))
+
+@app.route('/admin/profiler/<view>.<any(txt, speedscope):fmt>')
+@admin_required
+def profiler_export(view, fmt):
+    """An endpoint's stacks as collapsed-stack text or a speedscope.app file"""
+    stacks = profiler.stacks(view)
+    if not stacks:
+        return '', 404
+    if fmt == 'txt':
+        response = Response(collapsed(stacks), mimetype='text/plain')
+        filename = f'{view}.collapsed.txt'
+    else:
+        response = jsonify(speedscope(stacks, view, profiler.interval))
+        filename = f'{view}.speedscope.json'
+    response.headers['Content-Disposition'] = f'attachment; filename={filename}'
+    return response
+
 # API Routes for AJAX calls
 @app.route('/api/student/<student_id>')
 @admin_required
 def get_student_info(student_id):
     """API endpoint to get student information"""
     conn = get_db_connection()
-    student = conn.execute('SELECT * FROM students WHERE student_id = ?', (student_id,)).fetchone()
+    student = db.get_student(conn, student_id)
     conn.close()
     
     if student:
@@ -1201,13 +2033,272 @@ def get_subject_levels(subject_category):
             'message': 'Subject category not found'
         })
 
+@app.route('/api/documents/review', methods=['POST'])
+@admin_required
+def api_review_documents():
+    """API endpoint to set one status and feedback on many documents in one transaction"""
+    data = request.get_json(silent=True) or {}
+    status = data.get('status')
+    doc_ids = data.get('doc_ids') or []
+    
+    if status not in DOCUMENT_STATUSES:
+        return jsonify({
+            'success': False,
+            'message': f"status must be one of {', '.join(DOCUMENT_STATUSES)}"
+        }), 400
+    try:
+        doc_ids = [int(doc_id) for doc_id in doc_ids]
+    except (TypeError, ValueError):
+        return jsonify({
+            'success': False,
+            'message': 'doc_ids must be a list of document ids'
+        }), 400
+    
+    conn = get_db_connection()
+    updated = db.review_documents(conn, doc_ids, status, data.get('feedback', ''), session['username'])
+    conn.commit()
+    publish_documents_reviewed(conn, doc_ids, status)
+    pending = db.document_counts(conn).get('Pending', 0)
+    conn.close()
+    
+    return jsonify({
+        'success': True,
+        'updated': updated,
+        'pending': pending
+    })
+
+@app.route('/api/changes')
+@admin_required
+def get_changes():
+    """API endpoint to tail the change log: changes after ?after=<seq>, oldest first
+
+    Besides students, results and documents, archived_years entries mark an
+    academic year archived (insert) or restored (delete); the year's results
+    are logged as deleted or inserted just before.
+    """
+    after = request.args.get('after', 0, type=int)
+    limit = min(request.args.get('limit', 500, type=int), 5000)
+    conn = get_db_connection()
+    changes = changes_since(conn, after, limit, request.args.get('table') or None, request.args.get('row_id'))
+    last_seq = latest_seq(conn)
+    conn.close()
+    
+    return jsonify({
+        'success': True,
+        'changes': changes,
+        'next_after': changes[-1]['seq'] if changes else after,
+        'last_seq': last_seq
+    })
+
+# Versioned JSON API (v1): batch lookups, sparse fieldsets and cursor pagination
+API_MAX_BATCH = 1000
+API_PAGE_SIZE = 500
+API_STUDENT_FIELDS = ('student_id', 'full_name', 'email', 'program', 'year', 'date_of_birth', 'phone_number',
+                      'address', 'created_at')
+API_RESULT_FIELDS = ('id', 'student_id', 'course_code', 'course_name', 'subject_level', 'grade', 'credits',
+                     'semester', 'academic_year', 'remark', 'grade_points', 'created_at', 'updated_at')
+
+class APIError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.message = message
+        self.status = status
+
+@app.errorhandler(APIError)
+def api_error(error):
+    return jsonify({'success': False, 'message': error.message}), error.status
+
+def api_list(name):
+    """A list parameter from the JSON body or the query string (comma separated or repeated)"""
+    data = request.get_json(silent=True) if request.is_json else None
+    if data and name in data:
+        values = data[name]
+        if not isinstance(values, list):
+            raise APIError(f'{name} must be a list')
+        return [str(value) for value in values]
+    values = []
+    for value in request.args.getlist(name):
+        values.extend(v.strip() for v in value.split(',') if v.strip())
+    return values
+
+def api_fields(allowed, always=()):
+    """Columns requested with ?fields=, validated against the resource's allowed fields"""
+    fields = api_list('fields')
+    if not fields:
+        return list(allowed)
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise APIError(f"Unknown fields: {', '.join(unknown)}")
+    return list(always) + [field for field in dict.fromkeys(fields) if field not in always]
+
+def api_batch(name):
+    values = list(dict.fromkeys(api_list(name)))
+    if len(values) > API_MAX_BATCH:
+        raise APIError(f'At most {API_MAX_BATCH} {name} per request')
+    return values
+
+def ndjson_response(conn, query, params, fields):
+    """Stream every row of a query as newline-delimited JSON"""
+    def generate():
+        try:
+            for row in db.iterate(conn, query, params):
+                yield json.dumps(dict(zip(fields, row)), default=str) + '\n'
+        finally:
+            conn.close()
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+@app.route('/api/v1/students', methods=['GET', 'POST'])
+@admin_required
+def api_v1_students():
+    """Many students in one query: ?ids=S1001,S1002&fields=full_name,program"""
+    ids = api_batch('ids')
+    fields = api_fields(API_STUDENT_FIELDS, always=('student_id',))
+    if not ids:
+        raise APIError('ids is required')
+    
+    conn = get_db_connection()
+    students = conn.execute(f'''
+        SELECT {", ".join(fields)} FROM students
+        WHERE student_id IN ({", ".join("?" * len(ids))})
+    ''', ids).fetchall()
+    conn.close()
+    
+    data = [dict(zip(fields, student)) for student in students]
+    found = {student['student_id'] for student in data}
+    return jsonify({
+        'success': True,
+        'data': data,
+        'missing': [student_id for student_id in ids if student_id not in found]
+    })
+
+@app.route('/api/v1/results', methods=['GET', 'POST'])
+@admin_required
+def api_v1_results():
+    """Results filtered by student_ids/academic_year/semester, paged by id.
+
+    Pass the returned next_cursor as ?cursor= for the next page, or use
+    ?format=ndjson to stream every matching row in one response.
+    """
+    student_ids = api_batch('student_ids')
+    fields = api_fields(API_RESULT_FIELDS, always=('id',))
+    academic_year = request.args.get('academic_year', '')
+    semester = request.args.get('semester', '')
+    cursor = request.args.get('cursor', 0, type=int)
+    limit = max(1, min(request.args.get('limit', API_PAGE_SIZE, type=int), API_PAGE_SIZE * 10))
+    
+    conn = get_db_connection()
+    try:
+        source = results_source(conn, academic_year, student_ids or None)
+    except ArchiveError as e:
+        conn.close()
+        raise APIError(str(e))
+    query = f'SELECT {", ".join(fields)} FROM {source} AS r WHERE id > ?'
+    params = [cursor]
+    if student_ids:
+        query += f' AND student_id IN ({", ".join("?" * len(student_ids))})'
+        params.extend(student_ids)
+    if academic_year:
+        query += ' AND academic_year = ?'
+        params.append(academic_year)
+    if semester:
+        query += ' AND semester = ?'
+        params.append(semester)
+    query += ' ORDER BY id'
+    
+    if request.args.get('format') == 'ndjson':
+        return ndjson_response(conn, query, params, fields)
+    
+    rows = conn.execute(query + ' LIMIT ?', params + [limit + 1]).fetchall()
+    conn.close()
+    
+    data = [dict(zip(fields, row)) for row in rows[:limit]]
+    return jsonify({
+        'success': True,
+        'data': data,
+        'next_cursor': data[-1]['id'] if len(rows) > limit else None
+    })
+
+@app.route('/api/v1/subjects')
+@admin_required
+def api_v1_subjects():
+    """Levels of several subject categories at once; every category without ?categories="""
+    categories = api_list('categories') or list(SUBJECTS)
+    return jsonify({
+        'success': True,
+        'data': {category: SUBJECTS[category] for category in categories if category in SUBJECTS},
+        'missing': [category for category in categories if category not in SUBJECTS]
+    })
+
+def api_hypothetical(items):
+    """Validated hypothetical results (projections.py), as an APIError when they are not"""
+    try:
+        return hypothetical_results(items)
+    except ValueError as e:
+        raise APIError(str(e))
+
+def requested_hypothetical():
+    """Hypothetical results of a what-if request: a JSON body's grades, or one from ?course_code=&grade=&credits="""
+    data = request.get_json(silent=True) if request.is_json else None
+    if data is not None:
+        return api_hypothetical(data.get('grades') or []), data
+    if not request.args.get('grade'):
+        return [], {}
+    return api_hypothetical([{'course_code': request.args.get('course_code', ''), 'grade': request.args['grade'],
+                              'credits': request.args.get('credits')}]), {}
+
+@app.route('/api/v1/projections', methods=['GET', 'POST'])
+@admin_required
+def api_v1_projections():
+    """What-if GPAs and rank shifts for a whole cohort.
+
+    POST {"program": "Grade 12", "year": 2024, "grades": [{"course_code": "MATH", "grade": "B+", "credits": 4}],
+    "students": {"S1001": [...]}}: grades are added for every student of the program and year, and students
+    gives some students their own instead. GET takes ?program=&year= and one grade as ?course_code=&grade=&credits=.
+    """
+    start = time.perf_counter()
+    grades, data = requested_hypothetical()
+    program = data.get('program', request.args.get('program', ''))
+    try:
+        year = int(data.get('year', request.args.get('year', '')))
+    except (TypeError, ValueError):
+        raise APIError('year is required')
+    if not program:
+        raise APIError('program is required')
+    scenarios = data.get('students') or {}
+    if not isinstance(scenarios, dict) or len(scenarios) > API_MAX_BATCH:
+        raise APIError(f'students must map at most {API_MAX_BATCH} student ids to their grades')
+    extras = {student_id: totals(api_hypothetical(items)) for student_id, items in scenarios.items()}
+    
+    conn = get_db_connection()
+    source = results_source(conn, cohort=(program, year))
+    cohort = cohorts.get(conn, source, program, year, current_tenant().slug)
+    conn.close()
+    
+    return jsonify({
+        'success': True,
+        'cohort': {'program': program, 'year': year, 'size': len(cohort)},
+        'data': cohort.project(extras, totals(grades)),
+        'missing': [student_id for student_id in scenarios if student_id not in cohort],
+        'seconds': round(time.perf_counter() - start, 4)
+    })
+
 # Debug and Utility Routes
 @app.route('/reset-db')
 def reset_db():
     """Reset database - USE WITH CAUTION"""
     import os
-    if os.path.exists('results.db'):
-        os.remove('results.db')
+    # Keep a way back: snapshot the old database before deleting it
+    if db_backend().name == 'sqlite' and os.path.exists(setting('DATABASE')):
+        manifest, _ = snapshot_and_prune()
+        app.logger.info('Snapshot %s taken before reset', manifest['name'])
+    db_backend().reset()
+    
+    # Archived year files belong to the old database
+    if os.path.exists(setting('ARCHIVE_FOLDER')):
+        for name in os.listdir(setting('ARCHIVE_FOLDER')):
+            path = os.path.join(setting('ARCHIVE_FOLDER'), name)
+            os.chmod(path, 0o644)
+            os.remove(path)
     
     init_db()
     
@@ -1241,6 +2332,265 @@ def debug_students():
     
     return result
 
+# CLI commands
+@app.cli.command('create-admin')
+@click.argument('username')
+@click.option('--full-name', default='School Administrator', show_default=True)
+@click.option('--email', default=None)
+@click.password_option()
+def create_admin_command(username, full_name, email, password):
+    """Create an admin account, e.g. the first one of a new school: SCHOOL=<slug> flask create-admin <username>"""
+    conn = get_db_connection()
+    try:
+        if conn.execute('SELECT 1 FROM users WHERE username = ?', (username,)).fetchone():
+            raise click.ClickException(f'User {username} already exists.')
+        db.insert_user(conn, username, generate_password_hash(password), 'admin', full_name, email)
+        conn.commit()
+    finally:
+        conn.close()
+    click.echo(f'Admin {username} created for {current_tenant().name}')
+
+@app.cli.command('archive-year')
+@click.argument('academic_year')
+def archive_year_command(academic_year):
+    """Move a finalized academic year into a read-only archive file"""
+    if db_backend().name != 'sqlite':
+        raise click.ClickException('Archiving academic years needs the SQLite backend.')
+    conn = get_db_connection()
+    try:
+        summary = archive_year(conn, academic_year, setting('ARCHIVE_FOLDER'), changed_by='cli')
+    except ArchiveError as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    click.echo(f"Archived {summary['result_count']} results for {academic_year} to {summary['db_path']}")
+
+@app.cli.command('restore-year')
+@click.argument('academic_year')
+def restore_year_command(academic_year):
+    """Move an archived academic year back into results.db"""
+    if db_backend().name != 'sqlite':
+        raise click.ClickException('Archiving academic years needs the SQLite backend.')
+    conn = get_db_connection()
+    try:
+        summary = restore_year(conn, academic_year, changed_by='cli')
+    except ArchiveError as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    click.echo(f"Restored {summary['result_count']} results for {academic_year}")
+
+@app.cli.command('list-archives')
+def list_archives_command():
+    """Show archived academic years"""
+    conn = get_db_connection()
+    for row in archived_years(conn):
+        click.echo(f"{row['academic_year']}  {row['result_count']:>8} results  {row['db_path']}  (archived {row['archived_at']})")
+    conn.close()
+
+def lifecycle_command(operation, dry_run, **kwargs):
+    """Run a lifecycle operation as one transaction, or only report what it would do"""
+    conn = get_db_connection()
+    try:
+        summary = operation(conn, changed_by='cli', dry_run=dry_run, **kwargs)
+        if not dry_run:
+            conn.commit()
+    except LifecycleError as e:
+        raise click.ClickException(str(e))
+    finally:
+        conn.close()
+    if dry_run:
+        click.echo('Dry run, nothing was changed.')
+    return summary
+
+@app.cli.command('rollover')
+@click.argument('academic_year', type=int)
+@click.option('--final-grade', type=int, default=FINAL_GRADE, show_default=True,
+              help='Students in this grade graduate instead of moving up')
+@click.option('--dry-run', is_flag=True, help='Only show what would change')
+def rollover_command(academic_year, final_grade, dry_run):
+    """Close an academic year: promote every active student one grade, graduate the final grade"""
+    summary = lifecycle_command(rollover, dry_run, academic_year=academic_year, final_grade=final_grade)
+    for step in summary['steps']:
+        target = step['to_program'] if step['action'] == 'promote' else ''
+        click.echo(f"{step['program'] or '-':20} {step['students']:>7}  {step['action']:9} {target}")
+    click.echo(f"{summary['promoted']} promoted to {summary['next_year']}, {summary['graduated']} graduated, "
+               f"{summary['skipped']} skipped")
+
+@app.cli.command('set-student-status')
+@click.argument('status', type=click.Choice(STUDENT_STATUSES))
+@click.option('--program', help='Only students of this program')
+@click.option('--year', type=int, help='Only students of this year')
+@click.option('--from', 'current_status', type=click.Choice(STUDENT_STATUSES), help='Only students with this status')
+@click.option('--dry-run', is_flag=True, help='Only show what would change')
+def set_student_status_command(status, program, year, current_status, dry_run):
+    """Change the status of many students at once, e.g. deactivate a class"""
+    summary = lifecycle_command(set_status, dry_run, status=status, program=program, year=year,
+                                current_status=current_status)
+    click.echo(f"{summary['students']} students marked {status}")
+
+@app.cli.command('delete-graduates')
+@click.option('--program', help='Only graduates of this program')
+@click.option('--year', type=int, help='Only graduates of this year')
+@click.option('--dry-run', is_flag=True, help='Only show what would change')
+def delete_graduates_command(program, year, dry_run):
+    """Delete graduated students with their results, documents and user accounts"""
+    summary = lifecycle_command(delete_graduates, dry_run, program=program, year=year)
+    click.echo(f"{summary['students']} graduated students deleted with {summary['results']} results, "
+               f"{summary['documents']} documents and {summary['users']} user accounts")
+
+@app.cli.command('send-notifications')
+def send_notifications_command():
+    """Send the notifications that are due now, e.g. from cron instead of the dispatcher threads"""
+    dispatcher = Dispatcher(current_tenant().connect, notify_transport, max_attempts=app.config['NOTIFY_MAX_ATTEMPTS'],
+                            backoff=app.config['NOTIFY_BACKOFF_SECONDS'])
+    totals = dispatcher.dispatch()
+    click.echo(f"{totals['sent']} sent, {totals['retry']} to retry, {totals['failed']} failed")
+
+@app.cli.command('duplicate-report')
+def duplicate_report_command():
+    """List groups of students that are likely the same learner"""
+    conn = get_db_connection()
+    report = duplicate_report(conn)
+    conn.close()
+    for group in report['groups']:
+        click.echo(', '.join(f"{student['student_id']} {student['full_name']}" for student in group['students']))
+        for a, b, score, reasons in group['pairs']:
+            click.echo(f"    {a} ~ {b}  {score:.2f}  {', '.join(reasons)}")
+    click.echo(f"{len(report['groups'])} groups of likely duplicates among {report['students']} students "
+               f"({report['pairs_compared']} pairs compared in {report['seconds']}s)")
+
+@app.cli.command('report-cards')
+@click.option('--program', help='Only students of this program (default: every student)')
+@click.option('--year', 'academic_year', help='Academic year to report on (default: full transcript)')
+@click.option('--semester', help='Term to report on, e.g. "Term 1"')
+@click.option('--format', 'fmt', type=click.Choice(['html', 'pdf']), default='html', show_default=True)
+@click.option('--workers', type=int, help='Worker processes (default: one per CPU)')
+@click.option('--chunk-size', type=int, default=200, show_default=True, help='Students fetched per worker task')
+@click.option('--output', default=None, help='Output folder (default: reports/)')
+def report_cards_command(program, academic_year, semester, fmt, workers, chunk_size, output):
+    """Render report cards for a whole program on a process pool"""
+    try:
+        summary = generate_report_cards(setting('DATABASE_URL'), setting('DATABASE'),
+                                        os.path.join(app.root_path, app.template_folder),
+                                        output or setting('REPORTS_FOLDER'),
+                                        program=program, academic_year=academic_year, semester=semester,
+                                        fmt=fmt, workers=workers, chunk_size=chunk_size, progress=click.echo)
+    except (RuntimeError, ValueError, ArchiveError) as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Wrote {summary['written']} report cards to {summary['output_dir']} in {summary['seconds']}s "
+               f"({summary['skipped']} already present, {len(summary['failed'])} failed)")
+    if summary['failed']:
+        click.echo(f"Failures are listed in {os.path.join(summary['output_dir'], 'failures.log')}")
+
+@app.cli.command('build-previews')
+@click.option('--all', 'rebuild', is_flag=True, help='Also redo documents that already have previews')
+def build_previews_command(rebuild):
+    """Create thumbnails and previews for documents uploaded before the pipeline existed"""
+    conn = get_db_connection()
+    query = 'SELECT d.id, d.doc_path FROM documents d'
+    if not rebuild:
+        query += ' LEFT JOIN document_derivatives dd ON dd.doc_id = d.id WHERE dd.doc_id IS NULL'
+    documents = conn.execute(query + ' ORDER BY d.id').fetchall()
+    conn.close()
+    
+    built = skipped = failed = 0
+    for document in documents:
+        if not os.path.exists(document['doc_path']) or not media.supports(document['doc_path']):
+            skipped += 1
+            continue
+        try:
+            media.process_document(get_db_connection, document['id'], document['doc_path'],
+                                   setting('DERIVATIVES_FOLDER'))
+            built += 1
+        except Exception as e:
+            failed += 1
+            click.echo(f"Document {document['id']} ({document['doc_path']}): {e}", err=True)
+    click.echo(f'Built previews for {built} documents ({skipped} skipped, {failed} failed)')
+
+@app.cli.command('index-documents')
+@click.option('--all', 'reindex', is_flag=True, help='Also redo documents that are already indexed')
+def index_documents_command(reindex):
+    """Extract searchable text from documents uploaded before indexing existed"""
+    conn = get_db_connection()
+    query = 'SELECT d.id, d.doc_name, d.doc_path FROM documents d'
+    if not reindex:
+        query += ' LEFT JOIN document_text dt ON dt.doc_id = d.id WHERE dt.doc_id IS NULL'
+    documents = conn.execute(query + ' ORDER BY d.id').fetchall()
+    conn.close()
+    
+    indexed = skipped = failed = 0
+    for document in documents:
+        if not os.path.exists(document['doc_path']):
+            skipped += 1
+            continue
+        try:
+            if document_index.index_document(get_db_connection, document['id'], document['doc_path'],
+                                             document['doc_name']):
+                indexed += 1
+            else:
+                skipped += 1
+        except Exception as e:
+            failed += 1
+            click.echo(f"Document {document['id']} ({document['doc_path']}): {e}", err=True)
+    click.echo(f'Indexed {indexed} documents ({skipped} skipped, {failed} failed)')
+
+@app.cli.command('backup')
+def backup_command():
+    """Snapshot results.db, uploads and archived years, then prune old snapshots"""
+    if db_backend().name != 'sqlite':
+        raise click.ClickException('Snapshots need the SQLite backend; back PostgreSQL up with pg_dump.')
+    try:
+        manifest, deleted = snapshot_and_prune()
+    except BackupError as e:
+        raise click.ClickException(str(e))
+    database = manifest['database']
+    click.echo(f"Snapshot {manifest['name']}: {database['bytes']} byte database copied in {database['seconds']}s "
+               f"({database['steps']} steps, {database['restarts']} restarts), integrity {database['integrity']}")
+    for name, tree_manifest in manifest['trees'].items():
+        click.echo(f"  {name}: {tree_manifest['copied']} files copied, {tree_manifest['linked']} unchanged")
+    if deleted:
+        click.echo(f"Pruned {len(deleted)} old snapshots: {', '.join(deleted)}")
+
+@app.cli.command('list-backups')
+def list_backups_command():
+    """List snapshots, newest first"""
+    for name in list_snapshots(setting('BACKUP_FOLDER')):
+        manifest = read_manifest(setting('BACKUP_FOLDER'), name)
+        files = sum(len(tree['files']) for tree in manifest['trees'].values())
+        click.echo(f"{name}  {manifest['database']['bytes']:>12} bytes  {files:>6} files  "
+                   f"integrity {manifest['database']['integrity']}")
+
+@app.cli.command('verify-backup')
+@click.argument('name')
+def verify_backup_command(name):
+    """Re-check a snapshot's database and files against its manifest"""
+    try:
+        problems = verify_snapshot(setting('BACKUP_FOLDER'), name)
+    except BackupError as e:
+        raise click.ClickException(str(e))
+    for problem in problems:
+        click.echo(problem, err=True)
+    if problems:
+        raise click.ClickException(f'{name} failed verification ({len(problems)} problems).')
+    click.echo(f'{name} is intact')
+
+@app.cli.command('restore-backup')
+@click.argument('name')
+@click.confirmation_option(prompt='This replaces the current database. Continue?')
+def restore_backup_command(name):
+    """Verify a snapshot and restore results.db, uploads and archived years from it"""
+    if db_backend().name != 'sqlite':
+        raise click.ClickException('Snapshots need the SQLite backend.')
+    try:
+        summary = restore_snapshot(setting('BACKUP_FOLDER'), name, setting('DATABASE'), backup_trees(),
+                                   exclude=[setting('DERIVATIVES_FOLDER')])
+    except BackupError as e:
+        raise click.ClickException(str(e))
+    click.echo(f"Restored {name} in {summary['seconds']}s ({summary['files_restored']} files put back)")
+    if summary['files_displaced']:
+        click.echo(f"{summary['files_displaced']} files newer than the snapshot were moved to {summary['displaced_folder']}")
+
 # Error Handlers
 @app.errorhandler(404)
 def not_found_error(error):
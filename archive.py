@@ -0,0 +1,390 @@
+# archive.py
+"""Archival partitioning of closed academic years.
+
+Finalized years are moved out of results.db into one read-only SQLite file per
+year (archive/results_<year>.db). Each file holds the year's results plus
+aggregates frozen at archive time. The aggregates are also copied into the
+archived_* tables of the main database, so analytics never rescans closed
+years and never opens their files.
+
+Routes ask results_source() for the table to read from, naming the students or
+year they need, and only the year files holding those rows are ATTACHed. A
+query filtered to the current year only touches the hot database. Schemas a
+query no longer needs are DETACHed before the next one attaches its own.
+
+SQLite attaches at most 10 databases per connection by default
+(SQLITE_MAX_ATTACHED). The results of a few students spread over more archived
+years than that are copied into a temp table a batch of year files at a time;
+any other query that needs more years raises ArchiveError rather than failing
+halfway through attaching them.
+"""
+import os
+import re
+import sqlite3
+from datetime import datetime
+
+from changelog import record_change, record_changes
+from database import backfill_results
+
+# Columns of the frozen aggregate tables written into every archive file
+FROZEN_TABLES = {
+    'grade_counts': 'grade TEXT, count INTEGER',
+    'semester_stats': 'semester TEXT, academic_year TEXT, points_sum REAL, total_results INTEGER',
+    'subject_stats': 'course_name TEXT, course_code TEXT, total_students INTEGER, '
+                     'struggling_students INTEGER, points_sum REAL',
+    'student_stats': 'student_id TEXT, total_subjects INTEGER, points_sum REAL',
+    'courses': 'course_code TEXT, course_name TEXT',
+}
+
+
+class ArchiveError(Exception):
+    pass
+
+
+def schema_name(academic_year):
+    return 'archive_' + re.sub(r'\W', '_', str(academic_year))
+
+
+def archive_path(folder, academic_year):
+    return os.path.join(folder, f"results_{re.sub(r'[^0-9A-Za-z_-]', '_', str(academic_year))}.db")
+
+
+def archived_years(conn):
+    """Rows of the archived_years catalog, newest year first"""
+    return conn.execute('SELECT * FROM archived_years ORDER BY academic_year DESC').fetchall()
+
+
+def is_archived(conn, academic_year):
+    return conn.execute('SELECT 1 FROM archived_years WHERE academic_year = ?', (academic_year,)).fetchone() is not None
+
+
+def attach_limit(conn):
+    """Databases this connection can have ATTACHed at once"""
+    try:
+        return conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    except AttributeError:
+        # Python before 3.11; SQLite's default SQLITE_MAX_ATTACHED
+        return 10
+
+
+def _attached(conn):
+    """Names of the archive schemas ATTACHed to conn"""
+    return [row[1] for row in conn.execute('PRAGMA database_list') if row[1].startswith('archive_')]
+
+
+def detach(conn, schemas):
+    """DETACH archive schemas, leaving any that a still-open cursor reads"""
+    for schema in schemas:
+        try:
+            conn.execute(f'DETACH DATABASE {schema}')
+        except sqlite3.OperationalError:
+            pass
+
+
+def attach_year(conn, academic_year):
+    """ATTACH an archived year read-only. Returns its schema name, or None if the year is not archived."""
+    row = conn.execute('SELECT db_path FROM archived_years WHERE academic_year = ?', (academic_year,)).fetchone()
+    if row is None:
+        return None
+    schema = schema_name(academic_year)
+    if schema not in _attached(conn):
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (f'file:{os.path.abspath(row[0])}?mode=ro',))
+    return schema
+
+
+def attach_years(conn, years):
+    """ATTACH the given archived years, DETACHing the ones attached for earlier queries. Returns the schema names.
+
+    Raises ArchiveError when they are more than the connection can attach at once.
+    """
+    wanted = {schema_name(year) for year in years}
+    detach(conn, [schema for schema in _attached(conn) if schema not in wanted])
+    other = len([row for row in conn.execute('PRAGMA database_list') if row[1] not in ('main', 'temp')])
+    missing = len(wanted - set(_attached(conn)))
+    if other + missing > attach_limit(conn):
+        raise ArchiveError(f'Reading {len(wanted)} archived years would exceed the {attach_limit(conn)} databases '
+                           f'SQLite can attach at once. Filter by academic year.')
+    return [attach_year(conn, year) for year in years]
+
+
+def student_years(conn, student_ids):
+    """Archived years holding results of any of the students, newest first"""
+    student_ids = list(student_ids)
+    if not student_ids:
+        return []
+    return [row[0] for row in conn.execute(f'''
+        SELECT DISTINCT academic_year FROM archived_student_stats
+        WHERE student_id IN ({', '.join('?' * len(student_ids))})
+        ORDER BY academic_year DESC
+    ''', student_ids).fetchall()]
+
+
+def cohort_years(conn, program, year):
+    """Archived years holding results of the students in a program and year, newest first"""
+    return [row[0] for row in conn.execute('''
+        SELECT DISTINCT a.academic_year
+        FROM archived_student_stats a
+        JOIN students s ON s.student_id = a.student_id
+        WHERE s.program = ? AND s.year = ?
+        ORDER BY a.academic_year DESC
+    ''', (program, year)).fetchall()]
+
+
+def _columns(conn, schema):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info(results)')]
+
+
+def _select_results(conn, schema, columns):
+    """SELECT from one year file, padding columns added to results since it was archived"""
+    present = set(_columns(conn, schema))
+    select = ', '.join(col if col in present else f'NULL AS {col}' for col in columns)
+    return f'SELECT {select} FROM {schema}.results'
+
+
+def _stage(conn, years, where, params):
+    """Copy the archived results matching where into temp.archived_results, as many year files at a time as fit"""
+    columns = _columns(conn, 'main')
+    detach(conn, _attached(conn))
+    free = attach_limit(conn) - len([row for row in conn.execute('PRAGMA database_list')
+                                     if row[1] not in ('main', 'temp')])
+    if free < 1:
+        raise ArchiveError('No archived year can be attached next to the databases already attached.')
+    # Read everything before writing the temp table: inside a transaction a year file stays locked until commit
+    rows = []
+    for start in range(0, len(years), free):
+        schemas = attach_years(conn, years[start:start + free])
+        for schema in schemas:
+            rows += conn.execute(f'{_select_results(conn, schema, columns)} WHERE {where}', params).fetchall()
+        detach(conn, schemas)
+    started = not conn.in_transaction
+    conn.execute('DROP TABLE IF EXISTS temp.archived_results')
+    conn.execute('CREATE TEMP TABLE archived_results AS SELECT * FROM main.results WHERE 0')
+    conn.executemany(f"INSERT INTO temp.archived_results VALUES ({', '.join('?' * len(columns))})", rows)
+    if started:
+        # Only the temp table was written
+        conn.commit()
+    return '(SELECT * FROM results UNION ALL SELECT * FROM temp.archived_results)'
+
+
+def results_source(conn, academic_year='', student_ids=None, cohort=None, years=None):
+    """Table expression to read results from.
+
+    With an academic_year filter this is the single table holding that year.
+    Without one it is the hot table UNION ALL the archived years holding
+    results of student_ids or of the students of cohort (a program and year),
+    or the given years, or else every archived year. Year files archived
+    before a column was added to results read NULL for it.
+
+    When the results of student_ids or of a cohort span more archived years
+    than SQLite attaches at once, they are copied into a temp table instead.
+    Other reads raise ArchiveError then.
+    """
+    where, params = None, []
+    if academic_year:
+        years = [academic_year] if is_archived(conn, academic_year) else []
+    elif years is None and student_ids is not None:
+        student_ids = list(student_ids)
+        years = student_years(conn, student_ids)
+        where, params = f"student_id IN ({', '.join('?' * len(student_ids))})", student_ids
+    elif years is None and cohort is not None:
+        years = cohort_years(conn, *cohort)
+        where, params = 'student_id IN (SELECT student_id FROM main.students WHERE program = ? AND year = ?)', cohort
+    elif years is None:
+        years = [row['academic_year'] for row in archived_years(conn)]
+    # Nothing archived to read (always the case on PostgreSQL): the hot table alone
+    if not years:
+        return 'results'
+    if where is not None and len(years) > attach_limit(conn):
+        return _stage(conn, years, where, params)
+    schemas = attach_years(conn, years)
+    columns = _columns(conn, 'main')
+    if academic_year:
+        return '(' + _select_results(conn, schemas[0], columns) + ')'
+    parts = ['SELECT * FROM results'] + [_select_results(conn, schema, columns) for schema in schemas]
+    return '(' + ' UNION ALL '.join(parts) + ')'
+
+
+def union_frozen(archives, live_sql, frozen_sql):
+    """Combine a live aggregate over the hot table with the frozen rows of archived years (archived_* tables).
+
+    archives is the archived_years catalog; without archived years the archived_* tables are not read.
+    """
+    return f'{live_sql} UNION ALL {frozen_sql}' if archives else live_sql
+
+
+def _freeze(conn, schema, academic_year):
+    """Copy a year file's frozen aggregates into the archived_* tables of the main database"""
+    for table, definition in FROZEN_TABLES.items():
+        columns = ', '.join(name for name in re.findall(r'(\w+) [A-Z]+', definition) if name != 'academic_year')
+        conn.execute(f'''
+            INSERT INTO main.archived_{table} (academic_year, {columns})
+            SELECT ?, {columns} FROM {schema}.{table}
+        ''', (academic_year,))
+
+
+def backfill_frozen(conn):
+    """Copy the frozen aggregates and highest result id of years archived before the archived_* tables existed"""
+    for row in conn.execute('SELECT academic_year FROM archived_years WHERE max_result_id IS NULL').fetchall():
+        # One year file at a time, however many there are
+        schema = attach_years(conn, [row['academic_year']])[0]
+        _freeze(conn, schema, row['academic_year'])
+        conn.execute(f'''
+            UPDATE archived_years SET max_result_id = (SELECT MAX(id) FROM {schema}.results) WHERE academic_year = ?
+        ''', (row['academic_year'],))
+        # The year file stays locked by the transaction that read it
+        conn.commit()
+        detach(conn, [schema])
+
+
+def recent_years(conn, after_id, count):
+    """Archived years that can hold any of the count newest results with an id above after_id"""
+    return [row[0] for row in conn.execute('''
+        SELECT academic_year FROM archived_years WHERE max_result_id > ? ORDER BY max_result_id DESC LIMIT ?
+    ''', (after_id, count)).fetchall()]
+
+
+def archived_result_count(conn):
+    return conn.execute('SELECT COALESCE(SUM(result_count), 0) FROM archived_years').fetchone()[0]
+
+
+def find_archived_result(conn, result_id):
+    """Look a result id up in the archives. Returns (row, academic_year) or (None, None)."""
+    # Ids stay unique across the hot table and the archives
+    if conn.execute('SELECT 1 FROM results WHERE id = ?', (result_id,)).fetchone():
+        return None, None
+    for row in archived_years(conn):
+        # One year file at a time, however many there are
+        schema = attach_years(conn, [row['academic_year']])[0]
+        result = conn.execute(f'SELECT * FROM {schema}.results WHERE id = ?', (result_id,)).fetchone()
+        detach(conn, [schema])
+        if result:
+            return result, row['academic_year']
+    return None, None
+
+
+def _log_moved(conn, action, select, params, changed_by):
+    """Log each result moved by archive_year (action delete) or restore_year (insert), a batch at a time"""
+    rows = conn.execute(select, params)
+    while True:
+        batch = rows.fetchmany(1000)
+        if not batch:
+            return
+        record_changes(conn, [('results', row['id'], action, row if action == 'delete' else None,
+                               row if action == 'insert' else None) for row in batch], changed_by)
+
+
+def archive_year(conn, academic_year, folder, changed_by=None):
+    """Move one finalized academic year out of the hot database.
+
+    Copies the year's results into a new per-year file, freezes its aggregates,
+    deletes the rows from results.db and records the file in archived_years.
+    change_log gets a delete for every moved result and an insert into
+    archived_years, in the same transaction.
+    """
+    academic_year = str(academic_year)
+    if academic_year == str(datetime.now().year):
+        raise ArchiveError(f'{academic_year} is the current academic year and cannot be archived.')
+    if is_archived(conn, academic_year):
+        raise ArchiveError(f'{academic_year} is already archived.')
+    result_count = conn.execute('SELECT COUNT(*) FROM results WHERE academic_year = ?', (academic_year,)).fetchone()[0]
+    if result_count == 0:
+        raise ArchiveError(f'No results found for {academic_year}.')
+
+    os.makedirs(folder, exist_ok=True)
+    path = archive_path(folder, academic_year)
+    if os.path.exists(path):
+        raise ArchiveError(f'{path} already exists.')
+
+    points_sum = 'COALESCE(SUM(grade_points), 0)'
+    detach(conn, _attached(conn))
+    conn.execute('ATTACH DATABASE ? AS new_archive', (path,))
+    try:
+        conn.execute('BEGIN')
+        conn.execute('CREATE TABLE new_archive.results AS SELECT * FROM main.results WHERE 0')
+        conn.execute('INSERT INTO new_archive.results SELECT * FROM main.results WHERE academic_year = ? ORDER BY id',
+                     (academic_year,))
+        conn.execute('CREATE UNIQUE INDEX new_archive.idx_results_id ON results (id)')
+        conn.execute('CREATE INDEX new_archive.idx_results_student ON results (student_id)')
+
+        for table, columns in FROZEN_TABLES.items():
+            conn.execute(f'CREATE TABLE new_archive.{table} ({columns})')
+        conn.execute('''
+            INSERT INTO new_archive.grade_counts
+            SELECT grade, COUNT(*) FROM new_archive.results GROUP BY grade
+        ''')
+        conn.execute(f'''
+            INSERT INTO new_archive.semester_stats
+            SELECT semester, academic_year, {points_sum}, COUNT(*)
+            FROM new_archive.results GROUP BY semester, academic_year
+        ''')
+        conn.execute(f'''
+            INSERT INTO new_archive.subject_stats
+            SELECT course_name, course_code, COUNT(*),
+                   SUM(CASE WHEN grade IN ('F', 'D', 'D+') THEN 1 ELSE 0 END), {points_sum}
+            FROM new_archive.results GROUP BY course_name, course_code
+        ''')
+        conn.execute(f'''
+            INSERT INTO new_archive.student_stats
+            SELECT student_id, COUNT(*), {points_sum} FROM new_archive.results GROUP BY student_id
+        ''')
+        conn.execute('''
+            INSERT INTO new_archive.courses
+            SELECT DISTINCT course_code, course_name FROM new_archive.results
+        ''')
+        _freeze(conn, 'new_archive', academic_year)
+
+        _log_moved(conn, 'delete', 'SELECT * FROM main.results WHERE academic_year = ?', (academic_year,), changed_by)
+        conn.execute('DELETE FROM main.results WHERE academic_year = ?', (academic_year,))
+        catalog = conn.execute('''
+            INSERT INTO main.archived_years (academic_year, db_path, result_count, archived_at, max_result_id)
+            VALUES (?, ?, ?, ?, (SELECT MAX(id) FROM new_archive.results))
+            RETURNING *
+        ''', (academic_year, path, result_count, datetime.now().strftime('%Y-%m-%d %H:%M:%S'))).fetchone()
+        record_change(conn, 'archived_years', academic_year, 'insert', new=catalog, changed_by=changed_by)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        conn.execute('DETACH DATABASE new_archive')
+        os.remove(path)
+        raise
+    conn.execute('DETACH DATABASE new_archive')
+    os.chmod(path, 0o444)
+
+    return {'academic_year': academic_year, 'db_path': path, 'result_count': result_count}
+
+
+def restore_year(conn, academic_year, changed_by=None):
+    """Move an archived year back into the hot database, e.g. to correct a mark.
+
+    change_log gets an insert for every restored result and a delete from
+    archived_years, in the same transaction.
+    """
+    academic_year = str(academic_year)
+    if not is_archived(conn, academic_year):
+        raise ArchiveError(f'{academic_year} is not archived.')
+    schema = attach_years(conn, [academic_year])[0]
+    path = conn.execute('SELECT db_path FROM archived_years WHERE academic_year = ?', (academic_year,)).fetchone()[0]
+
+    columns = _columns(conn, 'main')
+    try:
+        conn.execute('BEGIN')
+        conn.execute(f'INSERT INTO main.results ({", ".join(columns)}) {_select_results(conn, schema, columns)}')
+        restored = conn.execute('SELECT changes()').fetchone()[0]
+        # Years archived before course_id and grade_points existed come back without them
+        backfill_results(conn)
+        _log_moved(conn, 'insert', f'SELECT * FROM main.results WHERE id IN (SELECT id FROM {schema}.results)', (),
+                   changed_by)
+        catalog = conn.execute('DELETE FROM main.archived_years WHERE academic_year = ? RETURNING *',
+                               (academic_year,)).fetchone()
+        record_change(conn, 'archived_years', academic_year, 'delete', old=catalog, changed_by=changed_by)
+        for table in FROZEN_TABLES:
+            conn.execute(f'DELETE FROM main.archived_{table} WHERE academic_year = ?', (academic_year,))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    conn.execute(f'DETACH DATABASE {schema}')
+    os.chmod(path, 0o644)
+    os.remove(path)
+
+    return {'academic_year': academic_year, 'result_count': restored}
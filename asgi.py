@@ -0,0 +1,482 @@
+# asgi.py
+"""Optional async execution mode.
+
+Runs the same Flask app under an ASGI server (e.g. ``uvicorn asgi:application``).
+Document downloads and uploads are served natively on the event loop through
+AsyncDatabase, so a slow client never pins a worker thread, and so is the
+live dashboard event stream, however many admins keep it open. Every other
+route is handed to the Flask app on a bounded thread pool.
+
+The native routes skip Flask's before_request hooks, so run_native() applies
+the same gates itself. Traffic capture records them (app.recorder), and
+admission control queues them (app.admission_control). The admission slot is
+given back once a route's own work is done, before a slow client reads the
+body, as for Flask's streamed responses. The event stream is exempt from
+both, as it is in Flask. The sampling profiler is not applied: it samples
+a request's thread, and native routes share the event loop's. A native
+route that falls back to Flask passes Flask's gates instead, the profiler
+included.
+"""
+import asyncio
+import mimetypes
+import os
+import sys
+import time
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from tempfile import SpooledTemporaryFile
+from urllib.parse import parse_qsl, quote
+
+from itsdangerous import BadSignature
+from werkzeug.datastructures import Headers, MultiDict
+from werkzeug.exceptions import HTTPException
+from werkzeug.formparser import parse_form_data
+from werkzeug.http import dump_cookie, parse_cookie
+
+import database as db
+import media
+import document_index
+from admission import Rejected
+from app import (app, db_backend, get_db_connection, publish_documents_uploaded, tenants, admission_control,
+                 priority_of, recorder, ADMISSION_EXEMPT, BUSY_MESSAGE, CAPTURE_EXEMPT)
+from async_db import AsyncDatabase, stream_file, save_file
+from events import bus, parse_last_event_id, HEARTBEAT_SECONDS, SUBSCRIBER_QUEUE_SIZE
+from traffic import add_form, request_shape
+
+ALLOWED_EXTENSIONS = {'pdf', 'doc', 'docx', 'jpg', 'jpeg', 'png', 'txt'}
+
+
+async def read_body(receive, max_size=1024 * 1024):
+    """Receive the whole request body into a spooled temp file"""
+    body = SpooledTemporaryFile(max_size=max_size)
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            break
+        body.write(message.get('body', b''))
+        if not message.get('more_body'):
+            break
+    body.seek(0)
+    return body
+
+
+def build_environ(scope, body):
+    """Translate an ASGI http scope into a WSGI environ"""
+    script_name = scope.get('root_path', '')
+    path_info = scope['path']
+    if path_info.startswith(script_name):
+        path_info = path_info[len(script_name):]
+    server = scope.get('server') or ('localhost', 80)
+    environ = {
+        'REQUEST_METHOD': scope['method'],
+        'SCRIPT_NAME': script_name.encode('utf8').decode('latin1'),
+        'PATH_INFO': path_info.encode('utf8').decode('latin1'),
+        'QUERY_STRING': scope['query_string'].decode('ascii'),
+        'SERVER_NAME': server[0],
+        'SERVER_PORT': str(server[1]),
+        'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+        'wsgi.version': (1, 0),
+        'wsgi.url_scheme': scope.get('scheme', 'http'),
+        'wsgi.input': body,
+        'wsgi.errors': sys.stderr,
+        'wsgi.multithread': True,
+        'wsgi.multiprocess': True,
+        'wsgi.run_once': False,
+    }
+    if scope.get('client'):
+        environ['REMOTE_ADDR'] = scope['client'][0]
+    for name, value in scope.get('headers', []):
+        name = name.decode('latin1')
+        if name == 'content-length':
+            key = 'CONTENT_LENGTH'
+        elif name == 'content-type':
+            key = 'CONTENT_TYPE'
+        else:
+            key = 'HTTP_' + name.upper().replace('-', '_')
+        value = value.decode('latin1')
+        environ[key] = f'{environ[key]},{value}' if key in environ else value
+    return environ
+
+
+def get_header(scope, name):
+    for key, value in scope.get('headers', []):
+        if key == name:
+            return value.decode('latin1')
+    return None
+
+
+class AsyncApplication:
+    """ASGI application wrapping the Flask app"""
+
+    def __init__(self, flask_app, readers=4, threads=16):
+        self.flask_app = flask_app
+        self.threads = threads
+        self._wsgi_pool = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='wsgi')
+        self.db = None
+        self.native_routes = {'admin_events': self.admin_events}
+        # AsyncDatabase wraps results.db; on other backends the document routes go through Flask.
+        # With several schools every route goes through Flask, which picks the school's database.
+        if tenants.enabled:
+            self.native_routes = {}
+        elif db_backend().name == 'sqlite':
+            self.db = AsyncDatabase(flask_app.config['DATABASE'], readers=readers)
+            self.native_routes.update({
+                'download_document': self.download_document,
+                'upload_document': self.upload_document,
+            })
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self.lifespan(receive, send)
+            return
+        if scope['type'] != 'http':
+            return
+
+        adapter = self.flask_app.url_map.bind(
+            get_header(scope, b'host') or 'localhost', script_name=scope.get('root_path') or None)
+        try:
+            rule, args = adapter.match(scope['path'], method=scope['method'], return_rule=True)
+        except HTTPException:
+            rule, args = None, {}
+
+        handled = None
+        handler = self.native_routes.get(rule.endpoint if rule is not None else None)
+        if handler is not None:
+            handled = await self.run_native(handler, rule, scope, receive, send, adapter, args)
+            if handled:
+                return
+        await self.call_wsgi(scope, receive, send, body=getattr(handled, 'body', None))
+
+    async def lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                if self.db is not None:
+                    self.db.close()
+                self._wsgi_pool.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    async def call_wsgi(self, scope, receive, send, body=None):
+        """Run the Flask app on the thread pool, streaming its response back"""
+        if body is None:
+            body = await read_body(receive)
+        environ = build_environ(scope, body)
+        loop = asyncio.get_running_loop()
+
+        def push(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def run():
+            response = {}
+
+            def start_response(status, headers, exc_info=None):
+                response['status'] = int(status.split(' ', 1)[0])
+                response['headers'] = [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in headers]
+                return lambda data: None
+
+            result = self.flask_app.wsgi_app(environ, start_response)
+            started = False
+            try:
+                for chunk in result:
+                    if not chunk:
+                        continue
+                    if not started:
+                        push({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+                        started = True
+                    push({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+                if not started:
+                    push({'type': 'http.response.start', 'status': response['status'], 'headers': response['headers']})
+                push({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            finally:
+                if hasattr(result, 'close'):
+                    result.close()
+
+        with body:
+            await loop.run_in_executor(self._wsgi_pool, run)
+
+    async def run_native(self, handler, rule, scope, receive, send, adapter, args):
+        """Run a native route through traffic capture and admission control, like Flask's hooks do"""
+        started = time.perf_counter()
+        session = self.load_session(scope)
+        capture = None
+        if recorder is not None and rule.endpoint not in CAPTURE_EXEMPT and recorder.wants():
+            query = MultiDict(parse_qsl(scope['query_string'].decode('latin1'), keep_blank_values=True))
+            capture = scope['capture'] = request_shape(scope['method'], rule.rule, rule.endpoint, args, query,
+                                                       session, recorder.key)
+        status = {}
+
+        async def send_and_note(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+            await send(message)
+
+        try:
+            if await self.admit(scope, rule.endpoint, session, send_and_note):
+                handled = await handler(scope, receive, send_and_note, adapter, **args)
+            else:
+                handled = True
+        finally:
+            self.release(scope)
+        # A route falling back to Flask is captured there
+        if handled and capture is not None:
+            recorder.record(capture, status.get('code', 200), time.perf_counter() - started)
+        return handled
+
+    async def admit(self, scope, endpoint, session, send):
+        """Pass the endpoint's admission gates as admit_request() does. Returns False after answering 503."""
+        if not self.flask_app.config['ADMISSION_CONTROL'] or endpoint in ADMISSION_EXEMPT:
+            return True
+        priority = priority_of(session.get('role'), endpoint, scope['method'])
+        loop = asyncio.get_running_loop()
+        try:
+            # A queued request waits in Gate.acquire(), on a pool thread as a Flask request would
+            scope['admission_ticket'] = await loop.run_in_executor(self._wsgi_pool, admission_control.admit,
+                                                                   endpoint, priority)
+        except Rejected as e:
+            body = BUSY_MESSAGE.encode()
+            await send({
+                'type': 'http.response.start',
+                'status': 503,
+                'headers': [
+                    (b'content-type', b'text/plain; charset=utf-8'),
+                    (b'content-length', str(len(body)).encode('latin1')),
+                    (b'retry-after', str(e.retry_after).encode('latin1')),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': body, 'more_body': False})
+            return False
+        return True
+
+    def release(self, scope):
+        """Give the admission slot back; called again at the end, it does nothing"""
+        ticket = scope.pop('admission_ticket', None)
+        if ticket is not None:
+            admission_control.release(ticket)
+
+    # Session helpers - the native routes share Flask's signed session cookie
+    def load_session(self, scope):
+        session_interface = self.flask_app.session_interface
+        cookie = get_header(scope, b'cookie')
+        if not cookie:
+            return {}
+        value = parse_cookie(cookie).get(session_interface.get_cookie_name(self.flask_app))
+        if not value:
+            return {}
+        serializer = session_interface.get_signing_serializer(self.flask_app)
+        try:
+            max_age = int(self.flask_app.permanent_session_lifetime.total_seconds())
+            return serializer.loads(value, max_age=max_age)
+        except BadSignature:
+            return {}
+
+    def session_cookie(self, session):
+        app_ = self.flask_app
+        session_interface = app_.session_interface
+        value = session_interface.get_signing_serializer(app_).dumps(dict(session))
+        return dump_cookie(
+            session_interface.get_cookie_name(app_),
+            value,
+            domain=session_interface.get_cookie_domain(app_),
+            path=session_interface.get_cookie_path(app_),
+            secure=session_interface.get_cookie_secure(app_),
+            httponly=session_interface.get_cookie_httponly(app_),
+            samesite=session_interface.get_cookie_samesite(app_),
+        )
+
+    # Native routes. Each returns a falsy value to fall back to the Flask route,
+    # which then produces the usual flash message and redirect.
+    async def download_document(self, scope, receive, send, adapter, doc_id):
+        if scope['method'] != 'GET':
+            return None
+        session = self.load_session(scope)
+        if 'user_id' not in session:
+            return None
+
+        document = await self.db.fetchone('SELECT * FROM documents WHERE id = ?', (doc_id,))
+        if not document:
+            return None
+        if not (session.get('role') == 'admin' or
+                (session.get('role') == 'student' and document['student_id'] == session.get('student_id'))):
+            return None
+
+        loop = asyncio.get_running_loop()
+        try:
+            size = await loop.run_in_executor(None, os.path.getsize, document['doc_path'])
+        except OSError:
+            return None
+
+        headers = Headers()
+        headers['Content-Type'] = mimetypes.guess_type(document['doc_name'])[0] or 'application/octet-stream'
+        headers['Content-Length'] = str(size)
+        doc_name = document['doc_name']
+        try:
+            doc_name.encode('ascii')
+            headers.set('Content-Disposition', 'attachment', filename=doc_name)
+        except UnicodeEncodeError:
+            simple = unicodedata.normalize('NFKD', doc_name).encode('ascii', 'ignore').decode('ascii')
+            headers.set('Content-Disposition', 'attachment', filename=simple,
+                        **{'filename*': "UTF-8''" + quote(doc_name, safe="!#$&+-.^_`|~")})
+
+        # Only the client is left to wait for
+        self.release(scope)
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [(k.lower().encode('latin1'), v.encode('latin1')) for k, v in headers.items()],
+        })
+        async for chunk in stream_file(document['doc_path']):
+            await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        return True
+
+    async def upload_document(self, scope, receive, send, adapter):
+        if scope['method'] != 'POST':
+            return None
+        session = self.load_session(scope)
+        if session.get('role') != 'student' or 'student_id' not in session:
+            return None
+
+        content_length = get_header(scope, b'content-length')
+        if content_length and int(content_length) > self.flask_app.config['MAX_CONTENT_LENGTH']:
+            return None
+
+        body = await read_body(receive)
+        fallback = Fallback(body)
+        loop = asyncio.get_running_loop()
+        environ = build_environ(scope, body)
+        try:
+            _, form, files = await loop.run_in_executor(
+                None, lambda: parse_form_data(environ, max_content_length=self.flask_app.config['MAX_CONTENT_LENGTH']))
+        except HTTPException:
+            body.seek(0)
+            return fallback
+
+        file = files.get('document')
+        doc_type = form.get('doc_type')
+        if file is None or not file.filename or doc_type is None:
+            body.seek(0)
+            return fallback
+        file_extension = file.filename.rsplit('.', 1)[1].lower() if '.' in file.filename else ''
+        if file_extension not in ALLOWED_EXTENSIONS:
+            body.seek(0)
+            return fallback
+        if 'capture' in scope:
+            add_form(scope['capture'], form, files, recorder.key)
+
+        try:
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            filename = f"{session['student_id']}_{timestamp}_{file.filename}"
+            filepath = os.path.join(self.flask_app.config['UPLOAD_FOLDER'], filename)
+            await save_file(file.stream, filepath)
+
+            doc_id = await self.db.transaction(db.insert_document, session['student_id'], file.filename, doc_type,
+                                               filepath, datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                                               session.get('username'))
+        finally:
+            body.close()
+        if bus.subscriber_count():
+            await asyncio.get_running_loop().run_in_executor(self._wsgi_pool, self.publish_upload, doc_id)
+        media.process_in_background(get_db_connection, doc_id, filepath, self.flask_app.config['DERIVATIVES_FOLDER'])
+        document_index.index_in_background(get_db_connection, doc_id, filepath, file.filename)
+
+        session.setdefault('_flashes', []).append(('success', 'Document uploaded successfully!'))
+        await send({
+            'type': 'http.response.start',
+            'status': 302,
+            'headers': [
+                (b'location', adapter.build('student_dashboard').encode('latin1')),
+                (b'content-length', b'0'),
+                (b'set-cookie', self.session_cookie(session).encode('latin1')),
+            ],
+        })
+        await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        return True
+
+
+    def publish_upload(self, doc_id):
+        conn = get_db_connection()
+        try:
+            publish_documents_uploaded(conn, [doc_id])
+        finally:
+            conn.close()
+
+    async def admin_events(self, scope, receive, send, adapter):
+        """The live dashboard stream, held open on the event loop rather than a thread"""
+        if scope['method'] != 'GET':
+            return None
+        session = self.load_session(scope)
+        if session.get('role') != 'admin':
+            return None
+
+        loop = asyncio.get_running_loop()
+        frames = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+
+        def offer(frame):
+            try:
+                frames.put_nowait(frame)
+            except asyncio.QueueFull:
+                pass
+
+        async def wait_for_disconnect():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        unsubscribe = bus.subscribe(lambda frame: loop.call_soon_threadsafe(offer, frame),
+                                    parse_last_event_id(get_header(scope, b'last-event-id')))
+        disconnected = asyncio.ensure_future(wait_for_disconnect())
+        try:
+            await send({
+                'type': 'http.response.start',
+                'status': 200,
+                'headers': [
+                    (b'content-type', b'text/event-stream; charset=utf-8'),
+                    (b'cache-control', b'no-cache'),
+                    (b'x-accel-buffering', b'no'),
+                ],
+            })
+            await send({'type': 'http.response.body', 'body': b'retry: 5000\n\n', 'more_body': True})
+            while not disconnected.done():
+                next_frame = asyncio.ensure_future(frames.get())
+                done, _ = await asyncio.wait({next_frame, disconnected}, timeout=HEARTBEAT_SECONDS,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                if next_frame in done:
+                    chunk = next_frame.result()
+                else:
+                    next_frame.cancel()
+                    if disconnected.done():
+                        break
+                    chunk = ': heartbeat\n\n'
+                await send({'type': 'http.response.body', 'body': chunk.encode('utf-8'), 'more_body': True})
+        finally:
+            unsubscribe()
+            disconnected.cancel()
+        return True
+
+
+class Fallback:
+    """Falsy marker carrying an already received body back to the Flask route"""
+
+    def __init__(self, body):
+        self.body = body
+
+    def __bool__(self):
+        return False
+
+
+application = AsyncApplication(
+    app,
+    readers=int(os.environ.get('ASGI_DB_READERS', 4)),
+    threads=int(os.environ.get('ASGI_THREADS', 16)),
+)
+
+if __name__ == '__main__':
+    try:
+        import uvicorn
+    except ImportError:
+        print('Async mode needs an ASGI server: pip install uvicorn')
+        sys.exit(1)
+    uvicorn.run(application, host='0.0.0.0', port=int(os.environ.get('PORT', 5000)))
@@ -0,0 +1,133 @@
+# async_db.py
+import asyncio
+import os
+import shutil
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from records import sqlite_row_factory
+
+# Size of the chunks used when streaming files to and from disk
+CHUNK_SIZE = 64 * 1024
+
+
+class AsyncDatabase:
+    """Async access to results.db for the ASGI entry point.
+
+    Reads run on a bounded pool of threads, each holding its own read-only
+    connection. All writes go through a single connection on a single thread,
+    so they are serialized instead of fighting over SQLite's write lock.
+    """
+
+    def __init__(self, path, readers=4):
+        self.path = path
+        self.readers = readers
+        self._local = threading.local()
+        self._reader_pool = ThreadPoolExecutor(max_workers=readers, thread_name_prefix='db-reader')
+        self._writer_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='db-writer')
+        self._connections = []
+        self._lock = threading.Lock()
+
+        # WAL lets the readers keep going while the writer commits
+        conn = sqlite3.connect(path)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.close()
+
+    def _connect(self, readonly):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # Each connection stays on the thread that opened it; close() runs
+            # after the pools have shut down
+            if readonly:
+                conn = sqlite3.connect(f'file:{os.path.abspath(self.path)}?mode=ro', uri=True,
+                                       check_same_thread=False)
+            else:
+                conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.row_factory = sqlite_row_factory
+            self._local.conn = conn
+            with self._lock:
+                self._connections.append(conn)
+        return conn
+
+    def _read(self, sql, params, one):
+        cursor = self._connect(readonly=True).execute(sql, params)
+        return cursor.fetchone() if one else cursor.fetchall()
+
+    def _write(self, sql, params, many):
+        conn = self._connect(readonly=False)
+        try:
+            if many:
+                cursor = conn.executemany(sql, params)
+            else:
+                cursor = conn.execute(sql, params)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return cursor.lastrowid
+
+    def _transaction(self, fn, args):
+        conn = self._connect(readonly=False)
+        try:
+            result = fn(conn, *args)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        return result
+
+    async def fetchone(self, sql, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader_pool, self._read, sql, params, True)
+
+    async def fetchall(self, sql, params=()):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._reader_pool, self._read, sql, params, False)
+
+    async def execute(self, sql, params=()):
+        """Run a write statement on the writer thread and commit it. Returns lastrowid."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer_pool, self._write, sql, params, False)
+
+    async def executemany(self, sql, seq_of_params):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer_pool, self._write, sql, list(seq_of_params), True)
+
+    async def transaction(self, fn, *args):
+        """Run fn(conn, *args) on the writer thread as one transaction. Returns its result."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._writer_pool, self._transaction, fn, args)
+
+    def close(self):
+        self._reader_pool.shutdown(wait=True)
+        self._writer_pool.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                conn.close()
+            self._connections = []
+
+
+async def stream_file(path, chunk_size=CHUNK_SIZE):
+    """Yield a file's contents chunk by chunk without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    f = await loop.run_in_executor(None, open, path, 'rb')
+    try:
+        while True:
+            chunk = await loop.run_in_executor(None, f.read, chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        await loop.run_in_executor(None, f.close)
+
+
+async def save_file(fileobj, path):
+    """Copy an uploaded file object to disk off the event loop"""
+    def copy():
+        fileobj.seek(0)
+        with open(path, 'wb') as out:
+            shutil.copyfileobj(fileobj, out, CHUNK_SIZE)
+
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, copy)
@@ -0,0 +1,309 @@
+# backup.py
+"""Online snapshots of results.db and the file stores, with retention and restore.
+
+take_snapshot() writes backups/<YYYYmmdd-HHMMSS>/ holding:
+
+* results.db - copied with SQLite's online backup API about a thousand pages at a
+  time, so requests keep reading and writing between steps. A write by another
+  connection restarts the copy; after a few restarts it is redone in one step,
+  which holds the read lock for the whole copy (in WAL mode writers carry on).
+* one folder per file store (uploads, archived years). A file unchanged since
+  the previous snapshot is hard-linked to it instead of copied, so each
+  snapshot only costs the files that changed.
+* manifest.json - SHA-256, size and mtime of every file, plus the result of
+  PRAGMA integrity_check on the copied database.
+
+A snapshot is built in <name>.partial and renamed when complete, so a crashed
+run never looks like a usable backup. verify_snapshot() re-checks a snapshot
+against its manifest; restore_snapshot() verifies it, copies the database back
+into the live file through the backup API (one step, so connections never see
+a half-restored database) and puts back missing or changed files.
+"""
+import hashlib
+import itertools
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+log = logging.getLogger(__name__)
+
+DATABASE_FILE = 'results.db'
+MANIFEST_FILE = 'manifest.json'
+SNAPSHOT_FORMAT = '%Y%m%d-%H%M%S'
+
+# Pages copied per backup step, and the pause between steps that lets writers in
+PAGES_PER_STEP = 1024
+STEP_SLEEP = 0.005
+
+# Restarts caused by concurrent writes before the copy is redone in one step.
+# Under steady writes a stepped copy may never finish, and every restart
+# rereads the pages already copied.
+MAX_RESTARTS = 3
+
+
+class BackupError(Exception):
+    pass
+
+
+class _TooManyRestarts(Exception):
+    pass
+
+
+def file_hash(path, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def integrity_check(path):
+    conn = sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True)
+    try:
+        problems = [row[0] for row in conn.execute('PRAGMA integrity_check')]
+    finally:
+        conn.close()
+    return 'ok' if problems == ['ok'] else '; '.join(problems)
+
+
+def copy_database(source_path, target_path, pages=PAGES_PER_STEP, sleep=STEP_SLEEP, max_restarts=MAX_RESTARTS):
+    """Copy a live SQLite database with the online backup API. Returns copy statistics."""
+    stats = {'steps': 0, 'restarts': 0, 'pages': 0}
+    last_remaining = None
+
+    def progress(status, remaining, total):
+        nonlocal last_remaining
+        stats['steps'] += 1
+        stats['pages'] = total
+        # remaining grows again when a write to the source restarted the copy
+        if last_remaining is not None and remaining > last_remaining:
+            stats['restarts'] += 1
+            if stats['restarts'] > max_restarts:
+                raise _TooManyRestarts()
+        last_remaining = remaining
+
+    started = time.perf_counter()
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(target_path)
+    try:
+        try:
+            source.backup(target, pages=pages, progress=progress, sleep=sleep)
+        except _TooManyRestarts:
+            source.backup(target)
+            stats['single_step'] = True
+    finally:
+        target.close()
+        source.close()
+    stats['seconds'] = round(time.perf_counter() - started, 3)
+    stats['bytes'] = os.path.getsize(target_path)
+    return stats
+
+
+def _walk(folder, exclude=()):
+    """Relative paths of the files under folder, skipping the excluded subfolders"""
+    excluded = {os.path.normpath(path) for path in exclude}
+    for root, dirs, files in os.walk(folder):
+        dirs[:] = [d for d in sorted(dirs) if os.path.normpath(os.path.join(root, d)) not in excluded]
+        for name in sorted(files):
+            path = os.path.join(root, name)
+            yield os.path.relpath(path, folder), path
+
+
+def _copy_tree(folder, target, previous_dir, previous_files, exclude=()):
+    """Snapshot one file store, hard-linking files unchanged since the previous snapshot"""
+    files = {}
+    linked = copied = 0
+    for relpath, path in _walk(folder, exclude):
+        stat = os.stat(path)
+        dest = os.path.join(target, relpath)
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        before = previous_files.get(relpath)
+        if before and before['size'] == stat.st_size and before['mtime_ns'] == stat.st_mtime_ns:
+            try:
+                os.link(os.path.join(previous_dir, relpath), dest)
+                files[relpath] = before
+                linked += 1
+                continue
+            except OSError:
+                pass
+        shutil.copy2(path, dest)
+        files[relpath] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_hash(dest)}
+        copied += 1
+    return {'files': files, 'linked': linked, 'copied': copied}
+
+
+def list_snapshots(folder):
+    """Names of the complete snapshots, newest first"""
+    if not os.path.isdir(folder):
+        return []
+    return sorted((name for name in os.listdir(folder)
+                   if os.path.exists(os.path.join(folder, name, MANIFEST_FILE))), reverse=True)
+
+
+def read_manifest(folder, name):
+    path = os.path.join(folder, name, MANIFEST_FILE)
+    if not os.path.exists(path):
+        raise BackupError(f'{name} is not a complete snapshot in {folder}.')
+    with open(path) as f:
+        return json.load(f)
+
+
+def take_snapshot(database_path, folder, trees=None, exclude=()):
+    """Snapshot the database and the file stores in trees ({name: folder}). Returns the manifest."""
+    trees = trees or {}
+    name = taken = datetime.now().strftime(SNAPSHOT_FORMAT)
+    # Two snapshots within a second get a suffix
+    for suffix in itertools.count(2):
+        if not os.path.exists(os.path.join(folder, name)):
+            break
+        name = f'{taken}-{suffix}'
+    partial = os.path.join(folder, name + '.partial')
+    shutil.rmtree(partial, ignore_errors=True)
+    os.makedirs(partial)
+
+    previous = list_snapshots(folder)
+    previous_manifest = read_manifest(folder, previous[0]) if previous else {'trees': {}}
+
+    try:
+        db_copy = os.path.join(partial, DATABASE_FILE)
+        database = copy_database(database_path, db_copy)
+        database['integrity'] = integrity_check(db_copy)
+        if database['integrity'] != 'ok':
+            raise BackupError(f"The copied database failed its integrity check: {database['integrity']}")
+        database['sha256'] = file_hash(db_copy)
+
+        tree_manifests = {}
+        for tree, tree_folder in trees.items():
+            if not os.path.isdir(tree_folder):
+                continue
+            previous_tree = os.path.join(folder, previous[0], tree) if previous else None
+            previous_files = previous_manifest['trees'].get(tree, {}).get('files', {})
+            tree_manifests[tree] = _copy_tree(tree_folder, os.path.join(partial, tree), previous_tree,
+                                              previous_files, exclude)
+
+        manifest = {'name': name, 'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                    'database': database, 'trees': tree_manifests}
+        with open(os.path.join(partial, MANIFEST_FILE), 'w') as f:
+            json.dump(manifest, f, indent=1)
+    except Exception:
+        shutil.rmtree(partial, ignore_errors=True)
+        raise
+    os.rename(partial, os.path.join(folder, name))
+    return manifest
+
+
+def verify_snapshot(folder, name):
+    """Problems found re-checking a snapshot against its manifest; empty when it is intact"""
+    manifest = read_manifest(folder, name)
+    snapshot = os.path.join(folder, name)
+    problems = []
+    db_copy = os.path.join(snapshot, DATABASE_FILE)
+    if not os.path.exists(db_copy):
+        return [f'{DATABASE_FILE} is missing']
+    if file_hash(db_copy) != manifest['database']['sha256']:
+        problems.append(f'{DATABASE_FILE} does not match its checksum')
+    else:
+        integrity = integrity_check(db_copy)
+        if integrity != 'ok':
+            problems.append(f'{DATABASE_FILE}: {integrity}')
+    for tree, tree_manifest in manifest['trees'].items():
+        for relpath, entry in tree_manifest['files'].items():
+            path = os.path.join(snapshot, tree, relpath)
+            if not os.path.exists(path):
+                problems.append(f'{tree}/{relpath} is missing')
+            elif file_hash(path) != entry['sha256']:
+                problems.append(f'{tree}/{relpath} does not match its checksum')
+    return problems
+
+
+def restore_snapshot(folder, name, database_path, trees=None, exclude=()):
+    """Put a verified snapshot back: the database in one backup step, then the file stores.
+
+    Missing or changed files are copied back. Files written after the snapshot
+    are moved to <folder>/displaced-<time>/ rather than deleted.
+    """
+    problems = verify_snapshot(folder, name)
+    if problems:
+        raise BackupError(f'{name} failed verification: ' + '; '.join(problems))
+    manifest = read_manifest(folder, name)
+    snapshot = os.path.join(folder, name)
+
+    started = time.perf_counter()
+    source = sqlite3.connect(f'file:{os.path.abspath(os.path.join(snapshot, DATABASE_FILE))}?mode=ro', uri=True)
+    target = sqlite3.connect(database_path)
+    try:
+        source.backup(target)
+    finally:
+        target.close()
+        source.close()
+
+    restored = displaced = 0
+    displaced_folder = os.path.join(folder, 'displaced-' + datetime.now().strftime(SNAPSHOT_FORMAT))
+    for tree, tree_folder in (trees or {}).items():
+        files = manifest['trees'].get(tree, {}).get('files', {})
+        if os.path.isdir(tree_folder):
+            for relpath, path in list(_walk(tree_folder, exclude)):
+                if relpath not in files:
+                    dest = os.path.join(displaced_folder, tree, relpath)
+                    os.makedirs(os.path.dirname(dest), exist_ok=True)
+                    shutil.move(path, dest)
+                    displaced += 1
+        for relpath, entry in files.items():
+            dest = os.path.join(tree_folder, relpath)
+            if os.path.exists(dest):
+                stat = os.stat(dest)
+                if stat.st_size == entry['size'] and stat.st_mtime_ns == entry['mtime_ns']:
+                    continue
+                # Archived year files are read-only
+                os.chmod(dest, 0o644)
+                os.remove(dest)
+            os.makedirs(os.path.dirname(dest), exist_ok=True)
+            shutil.copy2(os.path.join(snapshot, tree, relpath), dest)
+            restored += 1
+    return {'name': name, 'files_restored': restored, 'files_displaced': displaced,
+            'displaced_folder': displaced_folder if displaced else None,
+            'seconds': round(time.perf_counter() - started, 3)}
+
+
+def prune_snapshots(folder, keep_last=24, keep_daily=7, keep_weekly=4):
+    """Delete snapshots outside the retention policy. Returns the names deleted.
+
+    Keeps the keep_last newest snapshots, plus the newest one of each of the
+    last keep_daily days and keep_weekly ISO weeks that have a snapshot.
+    """
+    names = list_snapshots(folder)
+    keep = set(names[:keep_last])
+    days, weeks = set(), set()
+    for name in names:
+        taken = datetime.strptime(name[:15], SNAPSHOT_FORMAT)
+        day, week = taken.date(), taken.isocalendar()[:2]
+        if day not in days and len(days) < keep_daily:
+            days.add(day)
+            keep.add(name)
+        if week not in weeks and len(weeks) < keep_weekly:
+            weeks.add(week)
+            keep.add(name)
+    deleted = [name for name in names if name not in keep]
+    for name in deleted:
+        shutil.rmtree(os.path.join(folder, name))
+    return deleted
+
+
+def start_scheduler(interval_seconds, job):
+    """Run job() every interval_seconds on a daemon thread"""
+    def loop():
+        while True:
+            time.sleep(interval_seconds)
+            try:
+                job()
+            except Exception:
+                log.exception('Scheduled backup failed')
+
+    thread = threading.Thread(target=loop, name='backup-scheduler', daemon=True)
+    thread.start()
+    return thread
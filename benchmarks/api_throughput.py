@@ -0,0 +1,110 @@
+# benchmarks/api_throughput.py
+"""Student lookups per second: one request per ID vs the batched v1 API.
+
+Seeds a throwaway copy of the database with synthetic students and results,
+then looks every student up through /api/student/<id>, through
+/api/v1/students in batches, and pages/streams their results through
+/api/v1/results.
+
+    python benchmarks/api_throughput.py [--students 5000] [--batch 500]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_api_')
+os.environ['RESULTS_DB'] = os.path.join(WORKDIR, 'results.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import contextlib  # noqa: E402
+import io  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app, get_db_connection, GRADE_TO_POINTS  # noqa: E402
+
+
+def seed(students, results_per_student=8):
+    conn = get_db_connection()
+    ids = [f'B{i:06d}' for i in range(students)]
+    conn.executemany('''
+        INSERT INTO students (student_id, full_name, email, program, year)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(student_id, f'Bench {student_id}', f'{student_id}@example.com', 'Grade 12', 2024) for student_id in ids])
+    grades = list(GRADE_TO_POINTS)
+    conn.executemany('''
+        INSERT INTO results (student_id, course_code, course_name, grade, credits, semester, academic_year)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(student_id, f'C{n}', f'Course {n}', random.choice(grades), 10, 'Term 1', '2024')
+          for student_id in ids for n in range(results_per_student)])
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def client():
+    c = app.test_client()
+    with c.session_transaction() as s:
+        s.update(user_id=1, username='admin', role='admin', full_name='Admin')
+    return c
+
+
+def timed(label, count, fn):
+    start = time.perf_counter()
+    requests = fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:42} {count:>7} rows  {requests:>6} requests  {elapsed:7.2f}s  {count / elapsed:>9.0f} rows/s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--batch', type=int, default=500)
+    args = parser.parse_args()
+
+    ids = seed(args.students)
+    c = client()
+
+    def per_id():
+        for student_id in ids:
+            assert c.get(f'/api/student/{student_id}').get_json()['success']
+        return len(ids)
+
+    def batched(fields=None):
+        def run():
+            requests = 0
+            for start in range(0, len(ids), args.batch):
+                body = {'ids': ids[start:start + args.batch]}
+                if fields:
+                    body['fields'] = fields
+                assert not c.post('/api/v1/students', json=body).get_json()['missing']
+                requests += 1
+            return requests
+        return run
+
+    def paged():
+        requests, cursor = 0, 0
+        while cursor is not None:
+            page = c.get(f'/api/v1/results?academic_year=2024&limit=5000&cursor={cursor}').get_json()
+            cursor = page['next_cursor']
+            requests += 1
+        return requests
+
+    def streamed():
+        lines = c.get('/api/v1/results?academic_year=2024&format=ndjson').get_data().count(b'\n')
+        assert lines >= len(ids) * 8
+        return 1
+
+    print(f'{args.students} students, batches of {args.batch}')
+    timed('GET /api/student/<id>', len(ids), per_id)
+    timed('POST /api/v1/students', len(ids), batched())
+    timed('POST /api/v1/students fields=full_name', len(ids), batched(['full_name']))
+    timed('GET /api/v1/results (cursor pages)', len(ids) * 8, paged)
+    timed('GET /api/v1/results format=ndjson', len(ids) * 8, streamed)
+
+
+if __name__ == '__main__':
+    main()
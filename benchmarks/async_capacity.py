@@ -0,0 +1,140 @@
+# benchmarks/async_capacity.py
+"""Concurrent request capacity per process: sync (threaded WSGI) vs async (ASGI).
+
+Each simulated client downloads the same document at a limited bandwidth, the
+way students on mobile data do. The sync mode gets a fixed pool of worker
+threads, as a threaded WSGI server would; the async mode runs asgi.application
+on one event loop.
+
+    python benchmarks/async_capacity.py [--clients 200] [--threads 16] [--size-kb 512]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_async_')
+os.environ['RESULTS_DB'] = os.path.join(WORKDIR, 'results.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import contextlib  # noqa: E402
+import io  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app, get_db_connection  # noqa: E402
+
+
+def seed_document(size_kb):
+    path = os.path.abspath(os.path.join(app.config['UPLOAD_FOLDER'], 'S1001_bench_report.pdf'))
+    with open(path, 'wb') as f:
+        f.write(os.urandom(size_kb * 1024))
+    conn = get_db_connection()
+    cursor = conn.execute('''
+        INSERT INTO documents (student_id, doc_name, doc_type, doc_path, upload_date)
+        VALUES (?, ?, ?, ?, ?)
+    ''', ('S1001', 'report.pdf', 'Report', path, '2025-01-01 00:00:00'))
+    conn.commit()
+    doc_id = cursor.lastrowid
+    conn.close()
+    return doc_id
+
+
+def session_cookie():
+    serializer = app.session_interface.get_signing_serializer(app)
+    value = serializer.dumps({'user_id': 1, 'username': 'admin', 'role': 'admin', 'full_name': 'Admin'})
+    return f"{app.config['SESSION_COOKIE_NAME']}={value}"
+
+
+def run_sync(doc_id, clients, threads, bandwidth):
+    """Threaded WSGI: a worker thread is busy until the slow client has the whole file"""
+    environ_base = {
+        'REQUEST_METHOD': 'GET', 'PATH_INFO': f'/download/{doc_id}', 'QUERY_STRING': '',
+        'SERVER_NAME': 'localhost', 'SERVER_PORT': '80', 'SERVER_PROTOCOL': 'HTTP/1.1',
+        'HTTP_COOKIE': session_cookie(), 'wsgi.version': (1, 0), 'wsgi.url_scheme': 'http',
+        'wsgi.input': io.BytesIO(), 'wsgi.errors': sys.stderr, 'wsgi.multithread': True,
+        'wsgi.multiprocess': False, 'wsgi.run_once': False,
+    }
+
+    def one_request(_):
+        status = []
+        result = app.wsgi_app(dict(environ_base), lambda s, h, e=None: status.append(s))
+        try:
+            for chunk in result:
+                time.sleep(len(chunk) / bandwidth)
+        finally:
+            result.close()
+        # Latency counts from submission, so time spent queued for a thread is included
+        return time.perf_counter() - start, status[0].startswith('200')
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        outcomes = list(pool.map(one_request, range(clients)))
+    return time.perf_counter() - start, outcomes
+
+
+def run_async(doc_id, clients, bandwidth):
+    """ASGI: the event loop keeps serving while slow clients drain their chunks"""
+    from asgi import application
+
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': f'/download/{doc_id}', 'root_path': '',
+        'query_string': b'', 'http_version': '1.1', 'scheme': 'http', 'server': ('localhost', 80),
+        'headers': [(b'host', b'localhost'), (b'cookie', session_cookie().encode('latin1'))],
+    }
+
+    async def one_request(start):
+        status = []
+
+        async def receive():
+            return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+        async def send(message):
+            if message['type'] == 'http.response.start':
+                status.append(message['status'])
+            elif message.get('body'):
+                await asyncio.sleep(len(message['body']) / bandwidth)
+
+        await application(dict(scope), receive, send)
+        return time.perf_counter() - start, status[0] == 200
+
+    async def main():
+        start = time.perf_counter()
+        outcomes = await asyncio.gather(*(one_request(start) for _ in range(clients)))
+        return time.perf_counter() - start, outcomes
+
+    try:
+        return asyncio.run(main())
+    finally:
+        application.db.close()
+
+
+def report(name, elapsed, outcomes):
+    latencies = sorted(latency for latency, _ in outcomes)
+    ok = sum(1 for _, success in outcomes if success)
+    p50 = latencies[len(latencies) // 2]
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(f'{name:<6} {ok:>4}/{len(outcomes)} ok  {elapsed:7.2f}s wall  '
+          f'{len(outcomes) / elapsed:8.1f} req/s  p50 {p50:6.2f}s  p95 {p95:6.2f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--clients', type=int, default=200, help='concurrent clients')
+    parser.add_argument('--threads', type=int, default=16, help='worker threads in sync mode')
+    parser.add_argument('--size-kb', type=int, default=512, help='document size')
+    parser.add_argument('--bandwidth-kb', type=int, default=1024, help='per-client bandwidth in KB/s')
+    args = parser.parse_args()
+
+    doc_id = seed_document(args.size_kb)
+    bandwidth = args.bandwidth_kb * 1024
+    print(f'{args.clients} clients downloading {args.size_kb} KB at {args.bandwidth_kb} KB/s each')
+    report('sync', *run_sync(doc_id, args.clients, args.threads, bandwidth))
+    report('async', *run_async(doc_id, args.clients, bandwidth))
+
+
+if __name__ == '__main__':
+    main()
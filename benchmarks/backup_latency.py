@@ -0,0 +1,150 @@
+# benchmarks/backup_latency.py
+"""Request latency while a snapshot of results.db is being taken.
+
+Seeds a throwaway copy of the database, then keeps admin result edits (writes)
+and student dashboard loads (reads) running on a few threads and reports their
+latency with no backup running, during a page-stepped online backup (what
+flask backup does) and during a single-step backup, which holds the read lock
+for the whole copy.
+
+    python benchmarks/backup_latency.py [--students 20000] [--threads 4] [--wal]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_backup_')
+os.environ['RESULTS_DB'] = os.path.join(WORKDIR, 'results.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import contextlib  # noqa: E402
+import io  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app, get_db_connection, GRADE_TO_POINTS  # noqa: E402
+    import database as db  # noqa: E402
+import backup  # noqa: E402
+
+
+def seed(students, results_per_student=10):
+    conn = get_db_connection()
+    ids = [f'B{i:06d}' for i in range(students)]
+    conn.executemany('''
+        INSERT INTO students (student_id, full_name, email, program, year)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(student_id, f'Bench {student_id}', f'{student_id}@example.com', 'Grade 12', 2024) for student_id in ids])
+    grades = list(GRADE_TO_POINTS)
+    conn.executemany('''
+        INSERT INTO results (student_id, course_code, course_name, grade, credits, semester, academic_year, remark)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(student_id, f'C{n}', f'Course {n}', random.choice(grades), 10, 'Term 1', '2024', 'x' * 200)
+          for student_id in ids for n in range(results_per_student)])
+    db.backfill_results(conn)
+    conn.commit()
+    result_ids = [row[0] for row in conn.execute('SELECT id FROM results').fetchall()]
+    conn.close()
+    return result_ids
+
+
+def client(role):
+    c = app.test_client()
+    with c.session_transaction() as s:
+        if role == 'admin':
+            s.update(user_id=1, username='admin', role='admin', full_name='Admin')
+        else:
+            s.update(user_id=2, username='S1001', role='student', student_id='S1001', full_name='Student')
+    return c
+
+
+def measure(result_ids, threads, seconds, during=None):
+    """Latencies in ms of writes and reads issued for `seconds`, while during() runs if given"""
+    latencies = {'write': [], 'read': []}
+    errors = []
+    stop = threading.Event()
+
+    def writer():
+        c = client('admin')
+        while not stop.is_set():
+            result_id = random.choice(result_ids)
+            start = time.perf_counter()
+            response = c.post(f'/admin/edit_result/{result_id}', data={
+                'course_code': 'C1', 'course_name': 'Course 1', 'subject_level': '', 'grade': random.choice('ABC'),
+                'credits': '10', 'semester': 'Term 1', 'academic_year': '2024', 'remark': ''})
+            latencies['write'].append((time.perf_counter() - start) * 1000)
+            if response.status_code != 302:
+                errors.append(response.status_code)
+
+    def reader():
+        c = client('student')
+        while not stop.is_set():
+            start = time.perf_counter()
+            c.get('/student/dashboard')
+            latencies['read'].append((time.perf_counter() - start) * 1000)
+
+    workers = [threading.Thread(target=writer if i % 2 == 0 else reader) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    stats = None
+    deadline = time.perf_counter() + seconds
+    if during:
+        # Back up repeatedly so each run gets a comparable number of requests
+        while time.perf_counter() < deadline:
+            stats = during()
+    else:
+        time.sleep(seconds)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    return latencies, errors, stats
+
+
+def report(label, latencies, errors, stats):
+    for kind, values in latencies.items():
+        if not values:
+            continue
+        values.sort()
+        p95 = values[int(len(values) * 0.95) - 1] if len(values) >= 20 else values[-1]
+        print(f'{label:24} {kind:5} n={len(values):>5}  p50 {statistics.median(values):7.1f}ms  '
+              f'p95 {p95:7.1f}ms  max {values[-1]:7.1f}ms')
+    if errors:
+        print(f'{"":24} {len(errors)} failed requests')
+    if stats:
+        print(f'{"":24} backup {stats["seconds"]}s, {stats["steps"]} steps, {stats["restarts"]} restarts'
+              + (', finished in one step' if stats.get('single_step') else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--wal', action='store_true', help='Put the database in WAL mode first')
+    args = parser.parse_args()
+
+    result_ids = seed(args.students)
+    database = app.config['DATABASE']
+    if args.wal:
+        conn = get_db_connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.close()
+    print(f'{len(result_ids)} results, database {os.path.getsize(database) / 1e6:.1f} MB, {args.threads} threads')
+
+    def stepped():
+        return backup.copy_database(database, os.path.join(WORKDIR, 'stepped.db'))
+
+    def single_step():
+        return backup.copy_database(database, os.path.join(WORKDIR, 'single.db'), pages=-1)
+
+    report('no backup', *measure(result_ids, args.threads, args.seconds))
+    report('page-stepped backup', *measure(result_ids, args.threads, args.seconds, stepped))
+    report('single-step backup', *measure(result_ids, args.threads, args.seconds, single_step))
+
+
+if __name__ == '__main__':
+    main()
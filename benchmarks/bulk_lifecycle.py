@@ -0,0 +1,132 @@
+# benchmarks/bulk_lifecycle.py
+"""Year-end rollover and deletion of graduates: one student at a time vs lifecycle.py.
+
+Seeds a throwaway database with --students learners spread over Grades 8-12,
+each with a user account and --results results, then times
+
+* the rollover done student by student (update_student() and a commit per
+  learner, as edit_student does) against rollover(), and
+* deleting the graduates one delete_student() and commit at a time against
+  delete_graduates(), which runs as one chunked transaction.
+
+Every measurement starts from a fresh copy of the seeded database.
+
+    python benchmarks/bulk_lifecycle.py [--students 5000] [--results 8]
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_lifecycle_')
+DATABASE = os.path.join(WORKDIR, 'results.db')
+os.environ['RESULTS_DB'] = DATABASE
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import contextlib  # noqa: E402
+import io  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import get_db_connection, GRADE_TO_POINTS  # noqa: E402
+    import database as db  # noqa: E402
+from lifecycle import FINAL_GRADE, delete_graduates, promotion, rollover  # noqa: E402
+
+YEAR = 2024
+
+
+def seed(students, results_per_student):
+    conn = get_db_connection()
+    ids = [f'B{i:06d}' for i in range(students)]
+    conn.executemany('''
+        INSERT INTO students (student_id, full_name, email, program, year)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(student_id, f'Bench {student_id}', f'{student_id}@example.com', f'Grade {8 + i % 5}', YEAR)
+          for i, student_id in enumerate(ids)])
+    # Any hash will do, nobody logs in
+    conn.executemany('''
+        INSERT INTO users (username, password, role, full_name, email) VALUES (?, 'x', 'student', ?, ?)
+    ''', [(student_id, f'Bench {student_id}', f'{student_id}@example.com') for student_id in ids])
+    grades = list(GRADE_TO_POINTS)
+    conn.executemany('''
+        INSERT INTO results (student_id, course_code, course_name, grade, credits, semester, academic_year)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(student_id, f'C{n}', f'Course {n}', random.choice(grades), 10, 'Term 1', str(YEAR))
+          for student_id in ids for n in range(results_per_student)])
+    db.backfill_results(conn)
+    conn.commit()
+    conn.close()
+
+
+def rollover_one_by_one(conn):
+    students = conn.execute("SELECT * FROM students WHERE status = 'Active' AND year = ?", (YEAR,)).fetchall()
+    for student in students:
+        action, program = promotion(student['program'], FINAL_GRADE)
+        if action == 'promote':
+            db.update_student(conn, student['student_id'], student['full_name'], student['email'], program,
+                              YEAR + 1, student['date_of_birth'], student['phone_number'], student['address'],
+                              changed_by='bench')
+        elif action == 'graduate':
+            conn.execute("UPDATE students SET status = 'Graduated' WHERE student_id = ?", (student['student_id'],))
+        conn.commit()
+    return len(students)
+
+
+def rollover_bulk(conn):
+    summary = rollover(conn, YEAR, changed_by='bench')
+    conn.commit()
+    return summary['promoted'] + summary['graduated'] + summary['skipped']
+
+
+def delete_one_by_one(conn):
+    graduates = [row[0] for row in conn.execute("SELECT student_id FROM students WHERE status = 'Graduated'")]
+    for student_id in graduates:
+        db.delete_student(conn, student_id, changed_by='bench')
+        conn.commit()
+    return len(graduates)
+
+
+def delete_bulk(conn):
+    summary = delete_graduates(conn, changed_by='bench')
+    conn.commit()
+    return summary['students']
+
+
+def measure(label, seeded, fn, prepare=None):
+    shutil.copy(seeded, DATABASE)
+    conn = get_db_connection()
+    if prepare is not None:
+        prepare(conn)
+    start = time.perf_counter()
+    count = fn(conn)
+    elapsed = time.perf_counter() - start
+    conn.close()
+    print(f'{label:36} {count:>7} students  {elapsed:8.2f}s')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--results', type=int, default=8)
+    args = parser.parse_args()
+
+    seed(args.students, args.results)
+    seeded = os.path.join(WORKDIR, 'seeded.db')
+    shutil.copy(DATABASE, seeded)
+    print(f'{args.students} students with {args.results} results each')
+
+    def graduate(conn):
+        conn.execute("UPDATE students SET status = 'Graduated' WHERE program = ?", (f'Grade {FINAL_GRADE}',))
+        conn.commit()
+
+    measure('rollover, one student at a time', seeded, rollover_one_by_one)
+    measure('rollover()', seeded, rollover_bulk)
+    measure('delete graduates one at a time', seeded, delete_one_by_one, graduate)
+    measure('delete_graduates()', seeded, delete_bulk, graduate)
+
+
+if __name__ == '__main__':
+    main()
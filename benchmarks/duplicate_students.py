@@ -0,0 +1,130 @@
+# benchmarks/duplicate_students.py
+"""Duplicate-student detection: lookup latency on insert and the batch report, against all-pairs comparison.
+
+Seeds a throwaway database with --students learners (sharing surnames,
+birthdays and some parents' phone numbers, as a district does), of which
+--duplicates are re-enrolments of an earlier student with a misspelt or
+reordered name, a changed email or a reformatted phone number. Then reports
+
+* find_matches() latency, as add_student runs it before each insert,
+* duplicate_report() time and how many of the planted duplicates it found,
+* the time all-pairs scoring would take, extrapolated from a sample.
+
+    python benchmarks/duplicate_students.py [--students 100000] [--duplicates 500]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_duplicates_')
+os.environ['RESULTS_DB'] = os.path.join(WORKDIR, 'results.db')
+os.environ.pop('DATABASE_URL', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import contextlib  # noqa: E402
+import io  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import get_db_connection  # noqa: E402
+from duplicates import match_keys, find_matches, duplicate_report, score  # noqa: E402
+
+FIRST_NAMES = ['Thabo', 'Lerato', 'Sipho', 'Naledi', 'Kagiso', 'Zanele', 'Themba', 'Ayanda', 'Lindiwe', 'Mpho',
+               'Rendani', 'Emma', 'Michael', 'Tshepo', 'Nomvula', 'Karabo', 'Bongani', 'Palesa', 'Johan', 'Annika',
+               'Pieter', 'Fatima', 'Yusuf', 'Priya', 'Ravi', 'Chloe', 'David', 'Grace', 'Neo', 'Lwazi']
+SURNAMES = ['Nkosi', 'Dlamini', 'Mokoena', 'Mudau', 'Sithole', 'Khumalo', 'Ndlovu', 'Botha', 'Van der Merwe',
+            'Naidoo', 'Pillay', 'Tshwika', 'Mahlangu', 'Molefe', 'Zulu', 'Mthembu', 'Baloyi', 'Maluleke',
+            'Nel', 'Smith', 'Jacobs', 'Adams', 'Petersen', 'Govender', 'Mabaso', 'Radebe', 'Sibiya', 'Ngcobo']
+
+
+def misspell(name):
+    """A plausible re-enrolment spelling: a dropped letter, a doubled one or the names swapped"""
+    words = name.split()
+    choice = random.random()
+    if choice < 0.3:
+        return ' '.join(reversed(words))
+    i = random.randrange(len(words))
+    word = words[i]
+    position = random.randrange(1, len(word))
+    words[i] = word[:position] + word[position + 1:] if choice < 0.65 else word[:position] + word[position - 1:]
+    return ' '.join(words)
+
+
+def seed(students, duplicates):
+    random.seed(7)
+    rows = []
+    parent_phones = [f'08{random.randrange(10 ** 8):08d}' for _ in range(students // 3)]
+    for i in range(students - duplicates):
+        # Most learners have a second given name
+        given = random.sample(FIRST_NAMES, 2 if random.random() < 0.7 else 1)
+        name = f"{' '.join(given)} {random.choice(SURNAMES)}"
+        birth = f'{random.randint(2005, 2012)}-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}'
+        email = f"{name.lower().replace(' ', '.')}{i}@student.example.com"
+        rows.append([f'B{i:06d}', name, email, birth, random.choice(parent_phones)])
+    planted = []
+    for n in range(duplicates):
+        original = random.choice(rows[:students - duplicates])
+        student_id = f'D{n:06d}'
+        # Keep the birthday; change the spelling, and the email or the phone's format
+        email = original[2] if random.random() < 0.3 else f'{student_id.lower()}@mail.example.com'
+        phone = '+27 ' + original[4][1:] if random.random() < 0.5 else original[4]
+        rows.append([student_id, misspell(original[1]), email, original[3], phone])
+        planted.append((original[0], student_id))
+    conn = get_db_connection()
+    conn.executemany('''
+        INSERT INTO students (student_id, full_name, email, program, year, date_of_birth, phone_number,
+                              name_key, email_key, phone_key)
+        VALUES (?, ?, ?, 'Grade 10', 2024, ?, ?, ?, ?, ?)
+    ''', [(student_id, name, email, birth, phone, *match_keys(name, email, phone))
+          for student_id, name, email, birth, phone in rows])
+    conn.commit()
+    conn.close()
+    return rows, planted
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=100000)
+    parser.add_argument('--duplicates', type=int, default=500)
+    parser.add_argument('--lookups', type=int, default=2000)
+    args = parser.parse_args()
+
+    rows, planted = seed(args.students, args.duplicates)
+    conn = get_db_connection()
+
+    latencies = []
+    for _, name, email, birth, phone in random.sample(rows, args.lookups):
+        start = time.perf_counter()
+        find_matches(conn, misspell(name), email.upper(), phone, birth)
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    print(f'find_matches     p50 {statistics.median(latencies):.3f}ms  p99 {latencies[int(len(latencies) * 0.99)]:.3f}ms')
+
+    report = duplicate_report(conn)
+    found = {tuple(sorted(pair[:2])) for group in report['groups'] for pair in group['pairs']}
+    recalled = sum(tuple(sorted(pair)) in found for pair in planted)
+    print(f"duplicate_report {report['seconds']:.2f}s for {report['students']} students, "
+          f"{report['pairs_compared']} pairs scored, {len(report['groups'])} groups, "
+          f'{recalled}/{len(planted)} planted duplicates found')
+
+    students = conn.execute('SELECT * FROM students').fetchall()
+    conn.close()
+    sample = random.sample(students, 300)
+    start = time.perf_counter()
+    compared = 0
+    for i, a in enumerate(sample):
+        for b in sample[i + 1:]:
+            score(a, b)
+            compared += 1
+    per_pair = (time.perf_counter() - start) / compared
+    all_pairs = len(students) * (len(students) - 1) // 2
+    print(f'all pairs        {all_pairs} pairs, about {all_pairs * per_pair / 60:.0f} minutes at '
+          f'{per_pair * 1e6:.1f}us per pair')
+
+
+if __name__ == '__main__':
+    main()
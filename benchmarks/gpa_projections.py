@@ -0,0 +1,126 @@
+# benchmarks/gpa_projections.py
+"""What-if GPA projections for a whole grade, against calculate_gpa() per student.
+
+Seeds a throwaway database with one cohort of --students learners (Grade 12
+of 2024) with --subjects results each, plus other grades around it, then reports
+
+* calculate_gpa() for every student of the cohort, one query each, as a
+  cohort projection would cost without projections.py,
+* load_cohort(), the one GROUP BY query a projection starts from,
+* Cohort.project() for the whole cohort, and project_student() with
+  grade_table() for one student, as /student/what-if runs them,
+* /api/v1/projections and /student/what-if end to end, through the test client,
+  with the cohort in CohortCache after the first request.
+
+    python benchmarks/gpa_projections.py [--students 5000] [--subjects 10]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_projections_')
+os.environ['RESULTS_DB'] = os.path.join(WORKDIR, 'results.db')
+os.environ.pop('DATABASE_URL', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import contextlib  # noqa: E402
+import io  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app, get_db_connection  # noqa: E402
+from archive import results_source  # noqa: E402
+from grading import GRADE_TO_POINTS, calculate_gpa  # noqa: E402
+from projections import load_cohort, totals  # noqa: E402
+
+PROGRAM, YEAR = 'Grade 12', 2024
+COURSES = ['MATH', 'ENGHL', 'AFRFAL', 'LO', 'PHYSCI', 'LIFSCI', 'GEOG', 'HIST', 'ACCT', 'BUSSTU', 'MATHLIT', 'ZULHL']
+HYPOTHETICAL = [{'course_code': 'MATH', 'grade': 'B+', 'credits': 4}]
+
+
+def seed(students, subjects):
+    random.seed(11)
+    grades = list(GRADE_TO_POINTS)
+    conn = get_db_connection()
+    # The cohort, and as many students again in other grades sharing the tables
+    cohorts = [(PROGRAM, YEAR, students), ('Grade 11', YEAR, students // 2), ('Grade 10', YEAR, students // 2)]
+    for program, year, count in cohorts:
+        prefix = program[-2:]
+        conn.executemany('INSERT INTO students (student_id, full_name, email, program, year) VALUES (?, ?, ?, ?, ?)',
+                         [(f'G{prefix}{i:06d}', f'Learner {i}', f'g{prefix}{i}@school.example.com', program, year)
+                          for i in range(count)])
+        rows = []
+        for i in range(count):
+            for course in random.sample(COURSES, min(subjects, len(COURSES))):
+                grade = random.choice(grades)
+                rows.append((f'G{prefix}{i:06d}', course, course, grade, random.randint(3, 6), 'Semester 1',
+                             str(year), GRADE_TO_POINTS[grade]))
+        conn.executemany('''
+            INSERT INTO results (student_id, course_code, course_name, grade, credits, semester, academic_year,
+                                 grade_points)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def timed(function, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        value = function()
+        times.append((time.perf_counter() - start) * 1000)
+    return value, statistics.median(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=5000)
+    parser.add_argument('--subjects', type=int, default=10)
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+
+    seed(args.students, args.subjects)
+    conn = get_db_connection()
+    source = results_source(conn)
+    student_ids = [row[0] for row in conn.execute('SELECT student_id FROM students WHERE program = ? AND year = ?',
+                                                  (PROGRAM, YEAR))]
+
+    def per_student():
+        return [calculate_gpa(conn.execute(f'SELECT * FROM {source} WHERE student_id = ?', (student_id,)).fetchall())
+                for student_id in student_ids]
+
+    gpas, per_student_ms = timed(per_student, max(1, args.repeat // 10))
+    cohort, load_ms = timed(lambda: load_cohort(conn, source, PROGRAM, YEAR), args.repeat)
+    assert cohort.gpas == gpas, 'load_cohort() disagrees with calculate_gpa()'
+    _, project_ms = timed(lambda: cohort.project({}, totals(HYPOTHETICAL)), args.repeat)
+    _, student_ms = timed(lambda: (cohort.project_student(student_ids[0], totals(HYPOTHETICAL)),
+                                   cohort.grade_table(student_ids[0], HYPOTHETICAL)), args.repeat)
+    conn.close()
+    print(f'cohort of {len(cohort)} students, {args.subjects} results each')
+    print(f'calculate_gpa per student     {per_student_ms:8.1f}ms')
+    print(f'load_cohort                    {load_ms:8.1f}ms')
+    print(f'project (whole cohort)         {project_ms:8.1f}ms')
+    print(f'project_student + grade_table  {student_ms:8.3f}ms')
+
+    admin = app.test_client()
+    with admin.session_transaction() as session:
+        session.update(user_id=1, username='admin', role='admin', full_name='Admin')
+    student = app.test_client()
+    with student.session_transaction() as session:
+        session.update(user_id=2, username='G12000000', role='student', student_id='G12000000', full_name='Learner 0',
+                       program=PROGRAM, year=YEAR)
+    body = {'program': PROGRAM, 'year': YEAR, 'grades': HYPOTHETICAL}
+    _, api_ms = timed(lambda: admin.post('/api/v1/projections', json=body).close(), args.repeat)
+    _, what_if_ms = timed(lambda: student.post('/student/what-if', json={'grades': HYPOTHETICAL}).close(),
+                          args.repeat)
+    print(f'POST /api/v1/projections       {api_ms:8.1f}ms')
+    print(f'POST /student/what-if          {what_if_ms:8.1f}ms')
+
+
+if __name__ == '__main__':
+    main()
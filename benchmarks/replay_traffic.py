@@ -0,0 +1,315 @@
+# benchmarks/replay_traffic.py
+"""Replay captured production traffic (traffic.py) against a local server, for before/after comparisons.
+
+Capture on the server with TRAFFIC_CAPTURE=traffic.jsonl.gz, take a snapshot
+of its database (flask backup, or a copy of results.db), then serve the
+snapshot locally with the build under test and replay the capture at it:
+
+    RESULTS_DB=/tmp/snap/results.db gunicorn -w 4 --threads 8 app:app -b 127.0.0.1:8000
+    python benchmarks/replay_traffic.py traffic.jsonl.gz --database /tmp/snap/results.db \\
+        --url http://127.0.0.1:8000 --speed 4 --json before.json
+    ... switch builds, restore the snapshot ...
+    python benchmarks/replay_traffic.py traffic.jsonl.gz --database /tmp/snap/results.db \\
+        --url http://127.0.0.1:8000 --speed 4 --compare before.json
+
+Requests are sent at their captured times divided by --speed (open loop: a
+slow server does not slow the arrivals), from --workers threads with
+keep-alive connections. Pseudonymous students are mapped onto the
+snapshot's students, the same pseudonym always to the same student. Each
+captured actor gets its own session, signed with --secret-key the way the
+app signs them, so no logins are needed beyond the captured ones. Captured
+logins are sent with --student-password or --admin-password, since passwords
+are not captured.
+
+Reported per route: requests, throughput, latency percentiles, client and
+server errors, and the latency the capture recorded in production. Lag is
+how late requests left because every worker was busy; when it grows, add
+workers or lower --speed.
+"""
+import argparse
+import http.client
+import json
+import os
+import re
+import sqlite3
+import statistics
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from http.cookies import SimpleCookie
+from urllib.parse import urlencode, urlsplit, quote
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask  # noqa: E402
+from flask.sessions import SecureCookieSessionInterface  # noqa: E402
+
+from traffic import read_capture  # noqa: E402
+
+RULE_ARGUMENT = re.compile(r'<(?:[^:<>]+:)?([^<>]+)>')
+
+
+class Snapshot:
+    """Students and users of the database the server runs on, to map pseudonyms onto"""
+
+    def __init__(self, path, admin_user):
+        conn = sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True)
+        self.students = conn.execute('''
+            SELECT s.student_id, s.program, s.year, u.id, u.full_name
+            FROM students s JOIN users u ON u.username = s.student_id AND u.role = 'student'
+            ORDER BY s.student_id
+        ''').fetchall()
+        self.admin = conn.execute("SELECT id, username, full_name FROM users WHERE username = ? AND role = 'admin'",
+                                  (admin_user,)).fetchone()
+        conn.close()
+        if not self.students:
+            raise SystemExit(f'{path} has no students with user accounts to replay as')
+        if self.admin is None:
+            raise SystemExit(f'{path} has no admin user {admin_user!r}')
+
+    def student(self, token):
+        return self.students[int(token[1:], 16) % len(self.students)]
+
+    def value(self, value):
+        """A captured value as sent in the replay"""
+        if isinstance(value, list):
+            return [self.value(item) for item in value]
+        if isinstance(value, dict):
+            return {name: self.value(item) for name, item in value.items()}
+        if not isinstance(value, str):
+            return value
+        if value.startswith('@'):
+            return ','.join(self.student(token)[0] for token in value.split(','))
+        if value.startswith('~') and value[1:].isdigit():
+            return 'x' * int(value[1:])
+        return value
+
+
+class Replay:
+    def __init__(self, entries, snapshot, base_url, secret_key, student_password, admin_password):
+        self.entries = entries
+        self.snapshot = snapshot
+        parts = urlsplit(base_url)
+        self.host, self.port = parts.hostname, parts.port or 80
+        self.prefix = parts.path.rstrip('/')
+        self.student_password = student_password
+        self.admin_password = admin_password
+        signer = Flask('replay')
+        signer.secret_key = secret_key
+        self.serializer = SecureCookieSessionInterface().get_signing_serializer(signer)
+        self.cookies = {}
+        self.cookie_lock = threading.Lock()
+        self.local = threading.local()
+
+    def session_cookie(self, entry):
+        """(cookie name, value) of a signed session for the entry's actor, None for anonymous requests"""
+        if not entry.get('actor') or entry.get('role') not in ('admin', 'student'):
+            return None
+        name = 'session' + (f"_{entry['school']}" if entry.get('school') else '')
+        if entry['role'] == 'admin':
+            user_id, username, full_name = self.snapshot.admin
+            data = {'user_id': user_id, 'username': username, 'role': 'admin', 'full_name': full_name}
+        else:
+            student_id, program, year, user_id, full_name = self.snapshot.student(entry['actor'])
+            data = {'user_id': user_id, 'username': student_id, 'role': 'student', 'full_name': full_name,
+                    'student_id': student_id, 'program': program, 'year': year}
+        data['school'] = entry.get('school')
+        return name, self.serializer.dumps(data)
+
+    def build(self, entry):
+        """(method, path, headers, body) of a captured request"""
+        args = {name: self.snapshot.value(value) for name, value in (entry.get('args') or {}).items()}
+        path = RULE_ARGUMENT.sub(lambda m: quote(str(args.get(m.group(1), '')), safe=''), entry['rule'])
+        if entry.get('school'):
+            path = f"/s/{entry['school']}{path}"
+        path = self.prefix + path
+        if entry.get('q'):
+            path += '?' + urlencode(self.snapshot.value(entry['q']), doseq=True)
+        headers = {}
+        body = None
+        if 'json' in entry:
+            body = json.dumps(self.snapshot.value(entry['json'])).encode()
+            headers['Content-Type'] = 'application/json'
+        elif entry.get('files'):
+            body, headers['Content-Type'] = self.multipart(entry)
+        elif entry.get('f'):
+            form = self.snapshot.value(entry['f'])
+            if entry.get('ep') == 'login' and 'password' in form:
+                form['password'] = self.admin_password if form.get('role') == 'admin' else self.student_password
+                if form.get('role') == 'admin':
+                    form['username'] = self.snapshot.admin[1]
+            body = urlencode(form, doseq=True).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        elif entry['m'] not in ('GET', 'HEAD'):
+            body = b''
+        return entry['m'], path, headers, body
+
+    def multipart(self, entry):
+        boundary = uuid.uuid4().hex
+        parts = []
+        for name, value in self.snapshot.value(entry.get('f') or {}).items():
+            for item in value if isinstance(value, list) else [value]:
+                parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{item}\r\n'.encode())
+        for name, (extension, size) in entry['files'].items():
+            filename = f'replay.{extension}' if extension else 'replay'
+            parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                         f'Content-Type: application/octet-stream\r\n\r\n'.encode() + os.urandom(size) + b'\r\n')
+        parts.append(f'--{boundary}--\r\n'.encode())
+        return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+    def connection(self):
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = self.local.conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        return conn
+
+    def send(self, entry):
+        """(status or None, seconds, error) of one request"""
+        method, path, headers, body = self.build(entry)
+        actor = (entry.get('school'), entry.get('role'), entry.get('actor'))
+        with self.cookie_lock:
+            cookie = self.cookies.get(actor)
+            if cookie is None:
+                cookie = self.cookies[actor] = self.session_cookie(entry)
+        if cookie is not None:
+            headers['Cookie'] = f'{cookie[0]}={cookie[1]}'
+        start = time.perf_counter()
+        try:
+            conn = self.connection()
+            conn.request(method, path, body=body, headers=headers)
+            response = conn.getresponse()
+            response.read()
+            elapsed = time.perf_counter() - start
+        except (OSError, http.client.HTTPException) as e:
+            self.local.conn = None
+            return None, time.perf_counter() - start, f'{type(e).__name__}: {e}'
+        if cookie is not None:
+            # Keep the session the server sent back (flashes, read-your-writes), as a browser would
+            for header in response.headers.get_all('Set-Cookie') or []:
+                morsel = SimpleCookie(header).get(cookie[0])
+                if morsel is not None and morsel.value:
+                    with self.cookie_lock:
+                        self.cookies[actor] = (cookie[0], morsel.value)
+        if response.getheader('Connection', '').lower() == 'close':
+            conn.close()
+            self.local.conn = None
+        return response.status, elapsed, None
+
+    def run(self, speed, workers):
+        """Per-route measurements: {route: {'ms': [...], 'status': [...], 'errors': [...], 'captured': [...]}}"""
+        routes = {}
+        lags = []
+        lock = threading.Lock()
+        origin = self.entries[0]['ts']
+
+        def timed(entry, due):
+            lag = max(0.0, time.perf_counter() - due)
+            status, seconds, error = self.send(entry)
+            route = f"{entry['m']} {entry.get('ep') or entry['rule']}"
+            with lock:
+                stats = routes.setdefault(route, {'ms': [], 'status': [], 'errors': [], 'captured': []})
+                stats['ms'].append(seconds * 1000)
+                stats['status'].append(status)
+                stats['captured'].append(entry.get('ms'))
+                if error:
+                    stats['errors'].append(error)
+                lags.append(lag)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            for entry in self.entries:
+                due = start + (entry['ts'] - origin) / speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                pool.submit(timed, entry, due)
+        return routes, lags, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0.0
+
+
+def summarize(routes, lags, seconds):
+    summary = {'seconds': round(seconds, 2), 'lag_p99_ms': round(percentile(lags, 0.99) * 1000, 1), 'routes': {}}
+    everything = {'ms': [], 'status': [], 'errors': [], 'captured': []}
+    for route, stats in list(routes.items()) + [('TOTAL', everything)]:
+        if route != 'TOTAL':
+            for name in everything:
+                everything[name].extend(stats[name])
+        captured = [ms for ms in stats['captured'] if ms is not None]
+        summary['routes'][route] = {
+            'requests': len(stats['ms']),
+            'rps': round(len(stats['ms']) / seconds, 2) if seconds else 0.0,
+            'p50': round(percentile(stats['ms'], 0.5), 1),
+            'p95': round(percentile(stats['ms'], 0.95), 1),
+            'p99': round(percentile(stats['ms'], 0.99), 1),
+            'max': round(max(stats['ms']), 1) if stats['ms'] else 0.0,
+            'client_errors': sum(1 for status in stats['status'] if status is not None and 400 <= status < 500),
+            'server_errors': sum(1 for status in stats['status'] if status is None or status >= 500),
+            'captured_p50': round(statistics.median(captured), 1) if captured else None,
+        }
+    return summary
+
+
+def report(summary, baseline=None):
+    print(f"{summary['seconds']}s, dispatch lag p99 {summary['lag_p99_ms']}ms")
+    header = f"{'route':44} {'reqs':>6} {'rps':>7} {'p50':>8} {'p95':>8} {'p99':>8} {'4xx':>5} {'5xx':>5} {'prod p50':>9}"
+    print(header + ('   p95 vs before' if baseline else ''))
+    for route, row in sorted(summary['routes'].items(), key=lambda item: (item[0] == 'TOTAL', -item[1]['requests'])):
+        line = (f"{route[:44]:44} {row['requests']:>6} {row['rps']:>7.1f} {row['p50']:>8.1f} {row['p95']:>8.1f} "
+                f"{row['p99']:>8.1f} {row['client_errors']:>5} {row['server_errors']:>5} "
+                f"{row['captured_p50'] if row['captured_p50'] is not None else '-':>9}")
+        before = (baseline or {}).get('routes', {}).get(route)
+        if before and before['p95']:
+            line += f"   {(row['p95'] - before['p95']) / before['p95'] * 100:+6.1f}%"
+            if row['server_errors'] != before['server_errors']:
+                line += f" 5xx {before['server_errors']}->{row['server_errors']}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('capture', nargs='+', help='Capture files written with TRAFFIC_CAPTURE')
+    parser.add_argument('--database', required=True, help='The snapshot the server is running on')
+    parser.add_argument('--url', default='http://127.0.0.1:5000')
+    parser.add_argument('--speed', type=float, default=1.0, help='Replay this many times faster than captured')
+    parser.add_argument('--workers', type=int, default=32)
+    parser.add_argument('--routes', help='Only these endpoints, comma-separated')
+    parser.add_argument('--limit', type=int, help='Only the first N requests')
+    parser.add_argument('--secret-key', default='your_secret_key_here', help="The server's app.secret_key")
+    parser.add_argument('--admin-user', default='admin')
+    parser.add_argument('--admin-password', default='admin123')
+    parser.add_argument('--student-password', default='password123')
+    parser.add_argument('--json', help='Write the summary here')
+    parser.add_argument('--compare', help='A summary written by an earlier run, to compare p95 and errors with')
+    args = parser.parse_args()
+
+    entries = read_capture(*args.capture)
+    if args.routes:
+        wanted = set(args.routes.split(','))
+        entries = [entry for entry in entries if entry.get('ep') in wanted]
+    entries = entries[:args.limit] if args.limit else entries
+    if not entries:
+        raise SystemExit('Nothing to replay')
+    captured_seconds = entries[-1]['ts'] - entries[0]['ts']
+    print(f'{len(entries)} requests captured over {captured_seconds:.0f}s, replaying at {args.speed}x')
+
+    replay = Replay(entries, Snapshot(args.database, args.admin_user), args.url, args.secret_key,
+                    args.student_password, args.admin_password)
+    summary = summarize(*replay.run(args.speed, args.workers))
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    report(summary, baseline)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(summary, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+# benchmarks/replica_reads.py
+"""Write latency while analytics and listing pages are being read, with and without a read replica.
+
+Seeds a throwaway database, then keeps admin result edits (writes) running on
+one thread and /admin/analytics and /admin/results loads (long reads) on
+--readers threads, once with every request on the primary and once with a
+local replica (replicas.py) serving the read-only pages. Reports latency of
+both and how far behind the replica was at worst.
+
+    python benchmarks/replica_reads.py [--students 20000] [--readers 3] [--seconds 5] [--wal]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_replica_')
+os.environ['RESULTS_DB'] = os.path.join(WORKDIR, 'results.db')
+os.environ.pop('DATABASE_URL', None)
+os.environ.pop('READ_REPLICAS', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import contextlib  # noqa: E402
+import io  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app, get_db_connection, tenants, GRADE_TO_POINTS  # noqa: E402
+    import database as db  # noqa: E402
+from replicas import create_replicas  # noqa: E402
+
+READ_PAGES = ['/admin/analytics', '/admin/results']
+
+
+def seed(students, results_per_student=10):
+    conn = get_db_connection()
+    ids = [f'B{i:06d}' for i in range(students)]
+    conn.executemany('''
+        INSERT INTO students (student_id, full_name, email, program, year)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(student_id, f'Bench {student_id}', f'{student_id}@example.com', 'Grade 12', 2024) for student_id in ids])
+    grades = list(GRADE_TO_POINTS)
+    conn.executemany('''
+        INSERT INTO results (student_id, course_code, course_name, grade, credits, semester, academic_year)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(student_id, f'C{n}', f'Course {n}', random.choice(grades), 10, 'Term 1', '2024')
+          for student_id in ids for n in range(results_per_student)])
+    db.backfill_results(conn)
+    conn.commit()
+    result_ids = [row[0] for row in conn.execute('SELECT id FROM results').fetchall()]
+    conn.close()
+    return result_ids
+
+
+def client():
+    c = app.test_client()
+    with c.session_transaction() as s:
+        s.update(user_id=1, username='admin', role='admin', full_name='Admin')
+    return c
+
+
+def measure(result_ids, readers, seconds, replicas=None):
+    """Latencies in ms of writes and page reads issued for `seconds`, and the worst replica lag seen"""
+    latencies = {'write': [], 'read': []}
+    errors = []
+    worst_lag = 0.0
+    stop = threading.Event()
+
+    def writer():
+        c = client()
+        while not stop.is_set():
+            result_id = random.choice(result_ids)
+            start = time.perf_counter()
+            response = c.post(f'/admin/edit_result/{result_id}', data={
+                'course_code': 'C1', 'course_name': 'Course 1', 'subject_level': '', 'grade': random.choice('ABC'),
+                'credits': '10', 'semester': 'Term 1', 'academic_year': '2024', 'remark': ''})
+            latencies['write'].append((time.perf_counter() - start) * 1000)
+            if response.status_code != 302:
+                errors.append(response.status_code)
+
+    def reader(page):
+        # A separate session, so the writer's read-your-writes does not send it to the primary
+        c = client()
+        while not stop.is_set():
+            start = time.perf_counter()
+            response = c.get(page)
+            response.get_data()
+            response.close()
+            latencies['read'].append((time.perf_counter() - start) * 1000)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    tenants.default.replicas = replicas
+    workers = [threading.Thread(target=writer)] + [threading.Thread(target=reader, args=(READ_PAGES[i % 2],))
+                                                   for i in range(readers)]
+    for worker in workers:
+        worker.start()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        if replicas is not None:
+            worst_lag = max([worst_lag] + [lag['lag_seconds'] or 0 for lag in replicas.status()['replicas']])
+        time.sleep(0.05)
+    stop.set()
+    for worker in workers:
+        worker.join()
+    tenants.default.replicas = None
+    return latencies, errors, worst_lag
+
+
+def report(label, latencies, errors, worst_lag):
+    for kind, values in latencies.items():
+        if not values:
+            continue
+        values.sort()
+        p95 = values[int(len(values) * 0.95) - 1] if len(values) >= 20 else values[-1]
+        print(f'{label:20} {kind:5} n={len(values):>5}  p50 {statistics.median(values):8.1f}ms  '
+              f'p95 {p95:8.1f}ms  max {values[-1]:8.1f}ms')
+    if errors:
+        print(f'{"":20} {len(errors)} failed requests')
+    if worst_lag:
+        print(f'{"":20} replica at most {worst_lag:.2f}s behind')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=3)
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--wal', action='store_true', help='Put the primary in WAL mode first')
+    args = parser.parse_args()
+
+    result_ids = seed(args.students)
+    if args.wal:
+        conn = get_db_connection()
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.close()
+    print(f'{len(result_ids)} results, {args.readers} readers')
+
+    report('primary only', *measure(result_ids, args.readers, args.seconds))
+    replicas = create_replicas(tenants.default.backend(), copies=1, max_lag=5.0, interval=0.2)
+    while not replicas.replicas[0].caught_up_at:
+        time.sleep(0.05)
+    report('with a replica', *measure(result_ids, args.readers, args.seconds, replicas))
+    replicas.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# benchmarks/row_objects.py
+"""Memory per row and iteration speed: records.Record vs sqlite3.Row.
+
+Fills an in-memory results table shaped like the real one, then for each
+row factory measures fetchall() time and the memory the rows hold (with
+tracemalloc), and how fast the usual passes over them run: reading columns
+by name, reading them as attributes (what templates do), and the GPA
+summary from grading.py.
+
+    python benchmarks/row_objects.py [--rows 200000]
+"""
+import argparse
+import gc
+import os
+import random
+import sqlite3
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from grading import GRADE_TO_POINTS, summarize_results  # noqa: E402
+from records import sqlite_row_factory  # noqa: E402
+
+FACTORIES = {'sqlite3.Row': sqlite3.Row, 'Record': sqlite_row_factory}
+
+
+def create(rows):
+    conn = sqlite3.connect(':memory:')
+    conn.execute('''CREATE TABLE results
+        (id INTEGER PRIMARY KEY, student_id TEXT, course_code TEXT, course_name TEXT, subject_level TEXT,
+        grade TEXT, credits INTEGER, semester TEXT, academic_year TEXT, remark TEXT, created_at TEXT,
+        updated_at TEXT, course_id INTEGER, grade_points REAL)''')
+    grades = list(GRADE_TO_POINTS)
+    conn.executemany('INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', [
+        (i, f'S{i % 5000:05d}', 'MATH', 'Mathematics', 'Level 4', grade, 4, 'Term 1', '2024', None,
+         '2024-01-01 00:00:00', '2024-01-01 00:00:00', 1, GRADE_TO_POINTS[grade])
+        for i, grade in ((i, random.choice(grades)) for i in range(rows))])
+    return conn
+
+
+def timed(fn, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=200000)
+    args = parser.parse_args()
+
+    conn = create(args.rows)
+    print(f'{args.rows} rows of results, times are the best of 3')
+    print(f'{"":12} {"bytes/row":>10} {"fetchall":>10} {"by name":>10} {"attribute":>10} {"summary":>10}')
+    for label, factory in FACTORIES.items():
+        conn.row_factory = factory
+        gc.collect()
+        tracemalloc.start()
+        rows = conn.execute('SELECT * FROM results').fetchall()
+        held = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        # Values are shared by both factories; subtract the list itself
+        per_row = (held - sys.getsizeof(rows)) / len(rows)
+
+        fetch = timed(lambda: conn.execute('SELECT * FROM results').fetchall())
+        by_name = timed(lambda: [(row['grade'], row['credits'], row['student_id']) for row in rows])
+        if factory is sqlite3.Row:
+            # Jinja tries getattr, then falls back to row[name]
+            def attribute():
+                for row in rows:
+                    for name in ('grade', 'credits', 'student_id'):
+                        try:
+                            getattr(row, name)
+                        except AttributeError:
+                            row[name]
+        else:
+            def attribute():
+                for row in rows:
+                    row.grade, row.credits, row.student_id
+        by_attribute = timed(attribute)
+        summary = timed(lambda: summarize_results(rows))
+        print(f'{label:12} {per_row:10.0f} {fetch:8.0f}ms {by_name:8.0f}ms {by_attribute:8.0f}ms {summary:8.0f}ms')
+        del rows
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+# benchmarks/stream_pages.py
+"""Time to first byte and peak memory of the big list pages, streamed vs rendered whole.
+
+Seeds a throwaway database with --rows students, each with one result, then
+loads /admin/results, /admin/students and /admin/analytics, once as streamed
+by stream_page() and once the way those pages used to be built (fetchall()
+into render_template()). Every measurement runs in a fresh process; peak RSS
+is how far the process high-water mark rose while the page was served.
+
+    python benchmarks/stream_pages.py [--rows 100000]
+"""
+import argparse
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+CHILD = os.environ.get('BENCH_STREAM_WORKDIR')
+WORKDIR = CHILD or tempfile.mkdtemp(prefix='bench_stream_')
+os.environ['RESULTS_DB'] = os.path.join(WORKDIR, 'results.db')
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import contextlib  # noqa: E402
+import io  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app as app_module  # noqa: E402
+    from app import app, get_db_connection, GRADE_TO_POINTS  # noqa: E402
+    import database as db  # noqa: E402
+from flask import render_template  # noqa: E402
+
+PAGES = ['/admin/results', '/admin/students', '/admin/analytics']
+
+
+def seed(rows):
+    conn = get_db_connection()
+    ids = [f'B{i:06d}' for i in range(rows)]
+    conn.executemany('''
+        INSERT INTO students (student_id, full_name, email, program, year)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(student_id, f'Bench {student_id}', f'{student_id}@example.com', 'Grade 12', 2024) for student_id in ids])
+    grades = list(GRADE_TO_POINTS)
+    conn.executemany('''
+        INSERT INTO results (student_id, course_code, course_name, grade, credits, semester, academic_year)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(student_id, 'MATH', 'Mathematics', random.choice(grades), 10, 'Term 1', '2024') for student_id in ids])
+    db.backfill_results(conn)
+    conn.commit()
+    conn.close()
+
+
+def render_whole(conn, template_name, **context):
+    """What the list pages did before stream_page: every row in a list, the page in one string"""
+    try:
+        return render_template(template_name, **context)
+    finally:
+        conn.close()
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(path, mode):
+    if mode == 'whole':
+        app_module.LazyRows = list
+        app_module.stream_page = render_whole
+    c = app.test_client()
+    with c.session_transaction() as s:
+        s.update(user_id=1, username='admin', role='admin', full_name='Admin')
+
+    baseline = peak_rss_mb()
+    start = time.perf_counter()
+    response = c.get(path, buffered=False)
+    first_byte = None
+    size = 0
+    for chunk in response.response:
+        if chunk and first_byte is None:
+            first_byte = time.perf_counter() - start
+        size += len(chunk)
+    total = time.perf_counter() - start
+    response.close()
+    return {'status': response.status_code, 'ttfb_ms': first_byte * 1000, 'total_ms': total * 1000,
+            'bytes': size, 'rss_mb': peak_rss_mb() - baseline}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=100000)
+    args = parser.parse_args()
+
+    seed(args.rows)
+    print(f'{args.rows} students and results')
+    env = dict(os.environ, BENCH_STREAM_WORKDIR=WORKDIR)
+    for path in PAGES:
+        for mode in ('whole', 'streamed'):
+            output = subprocess.run([sys.executable, os.path.abspath(__file__), path, mode], env=env,
+                                    capture_output=True, text=True, check=True).stdout
+            stats = json.loads(output.strip().splitlines()[-1])
+            print(f'{path:18} {mode:8} status {stats["status"]}  TTFB {stats["ttfb_ms"]:8.1f}ms  '
+                  f'total {stats["total_ms"]:8.1f}ms  {stats["bytes"] / 1e6:6.1f} MB sent  '
+                  f'peak RSS +{stats["rss_mb"]:6.1f} MB')
+
+
+if __name__ == '__main__':
+    if CHILD:
+        with contextlib.redirect_stdout(io.StringIO()):
+            stats = measure(sys.argv[1], sys.argv[2])
+        print(json.dumps(stats))
+    else:
+        main()
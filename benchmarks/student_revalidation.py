@@ -0,0 +1,118 @@
+# benchmarks/student_revalidation.py
+"""Server work for students reloading their pages, with and without ETag revalidation.
+
+Seeds a throwaway database with --students learners holding --results
+results each, then replays --visits reloads per student of
+/student/dashboard, /student/results and /student/results.json. Between
+visits an admin adds a result for one student in --change-every, so some
+reloads do find something new.
+
+Each visit is replayed twice: once as a browser without the service worker
+(every reload a full render), once sending back the ETag of the copy it
+already holds, as the browser does for the service worker's no-cache
+requests. Reported per page: full responses, 304s, bytes sent and server time.
+
+    python benchmarks/student_revalidation.py [--students 200] [--results 24] [--visits 20] [--change-every 5]
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+WORKDIR = tempfile.mkdtemp(prefix='bench_revalidation_')
+os.environ['RESULTS_DB'] = os.path.join(WORKDIR, 'results.db')
+os.environ.pop('DATABASE_URL', None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.chdir(WORKDIR)
+
+import contextlib  # noqa: E402
+import io  # noqa: E402
+
+with contextlib.redirect_stdout(io.StringIO()):
+    from app import app, get_db_connection, GRADE_TO_POINTS  # noqa: E402
+    import database as db  # noqa: E402
+
+PAGES = ['/student/dashboard', '/student/results', '/student/results.json']
+
+
+def seed(students, results_per_student):
+    conn = get_db_connection()
+    ids = [f'B{i:06d}' for i in range(students)]
+    conn.executemany('''
+        INSERT INTO students (student_id, full_name, email, program, year)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(student_id, f'Bench {student_id}', f'{student_id}@example.com', 'Grade 12', 2024) for student_id in ids])
+    grades = list(GRADE_TO_POINTS)
+    conn.executemany('''
+        INSERT INTO results (student_id, course_code, course_name, grade, credits, semester, academic_year)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(student_id, f'C{n}', f'Course {n}', random.choice(grades), 10, f'Term {1 + n % 4}', str(2023 + n % 2))
+          for student_id in ids for n in range(results_per_student)])
+    db.backfill_results(conn)
+    conn.commit()
+    conn.close()
+    return ids
+
+
+def client(student_id):
+    c = app.test_client()
+    with c.session_transaction() as s:
+        s.update(user_id=2, username=student_id, role='student', student_id=student_id,
+                 full_name=f'Bench {student_id}', program='Grade 12', year=2024)
+    return c
+
+
+def replay(ids, visits, change_every, revalidate):
+    """{page: [full responses, 304s, bytes, seconds]}"""
+    random.seed(1)
+    clients = {student_id: client(student_id) for student_id in ids}
+    held = {}
+    totals = {page: [0, 0, 0, 0.0] for page in PAGES}
+    for visit in range(visits):
+        conn = get_db_connection()
+        for student_id in ids[::change_every]:
+            db.insert_result(conn, student_id, f'V{visit}', f'Visit {visit}', None, random.choice(list(GRADE_TO_POINTS)),
+                             10, 'Term 1', '2024', None, changed_by='bench')
+        conn.commit()
+        conn.close()
+        for student_id, c in clients.items():
+            for page in PAGES:
+                etag = held.get((student_id, page)) if revalidate else None
+                start = time.perf_counter()
+                response = c.get(page, headers={'If-None-Match': etag} if etag else {})
+                body = response.get_data()
+                elapsed = time.perf_counter() - start
+                entry = totals[page]
+                entry[0 if response.status_code == 200 else 1] += 1
+                entry[2] += len(body)
+                entry[3] += elapsed
+                held[(student_id, page)] = response.headers.get('ETag')
+    return totals
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--students', type=int, default=200)
+    parser.add_argument('--results', type=int, default=24)
+    parser.add_argument('--visits', type=int, default=20)
+    parser.add_argument('--change-every', type=int, default=5,
+                        help='Each visit, one student in this many gets a new result')
+    args = parser.parse_args()
+
+    ids = seed(args.students, args.results)
+    print(f'{args.students} students x {args.visits} visits, one in {args.change_every} changed per visit')
+    for label, revalidate in (('full reloads', False), ('ETag revalidation', True)):
+        # Each run starts from the same seeded results
+        with contextlib.closing(get_db_connection()) as conn:
+            conn.execute("DELETE FROM results WHERE course_code LIKE 'V%'")
+            conn.commit()
+        totals = replay(ids, args.visits, args.change_every, revalidate)
+        print(f'\n{label}')
+        for page, (full, not_modified, size, seconds) in totals.items():
+            print(f'  {page:24} {full:>6} full {not_modified:>6} x 304 {size / 1024 / 1024:8.2f} MB {seconds:7.2f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+# changelog.py
+"""Append-only change log for students, results and documents.
+
+Every data-access helper in database.py that modifies one of those tables
+calls record_change() on the same connection before the route commits, so a
+change is logged exactly when it happens. Each entry gets a strictly
+increasing seq number, together with who made the change and the row before
+and after it as JSON.
+
+Archiving an academic year (archive.py) logs a delete of each result moved
+into the year file and an insert into archived_years; restoring it logs the
+reverse. The log therefore always describes the rows of the hot tables.
+
+Downstream consumers (stats tables, search index, exports) read the log
+incrementally with changes_since(), or with consume()/acknowledge() when they
+want their position stored in change_consumers.
+
+On PostgreSQL, identity values are handed out before commit, so concurrent
+transactions could commit their seq numbers out of order and a tailing reader
+could skip one. record_change() therefore takes a transaction-level advisory
+lock, which makes writers that log changes commit one at a time, as SQLite
+writers already do.
+"""
+import json
+import sqlite3
+
+ACTIONS = ('insert', 'update', 'delete')
+
+# Arbitrary key for pg_advisory_xact_lock, shared by every writer of change_log
+CHANGE_LOG_LOCK = 7301
+
+
+def row_dict(row):
+    return dict(zip(row.keys(), row)) if row is not None else None
+
+
+INSERT_CHANGE = '''
+    INSERT INTO change_log (table_name, row_id, action, changed_by, old_data, new_data)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+
+def _entry(table_name, row_id, action, old, new, changed_by):
+    if action not in ACTIONS:
+        raise ValueError(f'Unknown change action: {action}')
+    return (table_name, str(row_id), action, changed_by,
+            json.dumps(row_dict(old), default=str) if old is not None else None,
+            json.dumps(row_dict(new), default=str) if new is not None else None)
+
+
+def _lock(conn):
+    if not isinstance(conn, sqlite3.Connection):
+        conn.execute('SELECT pg_advisory_xact_lock(?)', (CHANGE_LOG_LOCK,))
+
+
+def record_change(conn, table_name, row_id, action, old=None, new=None, changed_by=None):
+    """Append one entry to change_log in the caller's transaction. Returns its seq."""
+    entry = _entry(table_name, row_id, action, old, new, changed_by)
+    _lock(conn)
+    return conn.execute(INSERT_CHANGE + ' RETURNING seq', entry).fetchone()[0]
+
+
+def record_changes(conn, changes, changed_by=None):
+    """Append many (table_name, row_id, action, old, new) entries with one executemany"""
+    entries = [_entry(table_name, row_id, action, old, new, changed_by)
+               for table_name, row_id, action, old, new in changes]
+    if entries:
+        _lock(conn)
+        conn.executemany(INSERT_CHANGE, entries)
+
+
+def latest_seq(conn):
+    return conn.execute('SELECT COALESCE(MAX(seq), 0) FROM change_log').fetchone()[0]
+
+
+def decode(row):
+    """change_log row as a dict with old/new decoded from JSON"""
+    change = row_dict(row)
+    change['old_data'] = json.loads(change['old_data']) if change['old_data'] else None
+    change['new_data'] = json.loads(change['new_data']) if change['new_data'] else None
+    return change
+
+
+def changes_since(conn, after_seq=0, limit=500, table_name=None, row_id=None):
+    """Changes with seq > after_seq, oldest first"""
+    query = 'SELECT * FROM change_log WHERE seq > ?'
+    params = [after_seq]
+    if table_name:
+        query += ' AND table_name = ?'
+        params.append(table_name)
+    if row_id is not None:
+        query += ' AND row_id = ?'
+        params.append(str(row_id))
+    query += ' ORDER BY seq LIMIT ?'
+    params.append(limit)
+    return [decode(row) for row in conn.execute(query, params).fetchall()]
+
+
+def consumer_position(conn, consumer):
+    row = conn.execute('SELECT last_seq FROM change_consumers WHERE consumer = ?', (consumer,)).fetchone()
+    return row[0] if row else 0
+
+
+def consume(conn, consumer, limit=500, table_name=None):
+    """The next batch of changes a named consumer has not acknowledged yet"""
+    return changes_since(conn, consumer_position(conn, consumer), limit, table_name)
+
+
+def acknowledge(conn, consumer, seq):
+    """Store a consumer's position after it has processed every change up to seq"""
+    conn.execute('''
+        INSERT INTO change_consumers (consumer, last_seq, updated_at) VALUES (?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (consumer) DO UPDATE SET last_seq = excluded.last_seq, updated_at = excluded.updated_at
+    ''', (consumer, seq))
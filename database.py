@@ -0,0 +1,833 @@
+# database.py
+"""Database backends and the data-access helpers shared by the routes.
+
+app.py talks to the database through get_db_connection(), which hands out a
+connection from the configured backend:
+
+* SQLiteBackend - results.db, the default.
+* PostgresBackend - used when DATABASE_URL is a postgresql:// URL. Connections
+  come from a psycopg pool, repeated statements are prepared server-side and
+  iterate() reads large listings through a server-side cursor.
+
+Route SQL is written in the SQLite dialect; PostgresConnection translates
+placeholders, LIKE and CURRENT_TIMESTAMP so the same statements run on both.
+"""
+import functools
+import os
+import re
+import sqlite3
+
+from changelog import record_change, record_changes
+from duplicates import match_keys
+from grading import GRADE_TO_POINTS
+from notifications import notify, notify_many
+from records import record_class, sqlite_row_factory
+
+SQLITE_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS users
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       username TEXT UNIQUE NOT NULL,
+       password TEXT NOT NULL,
+       role TEXT NOT NULL,
+       full_name TEXT,
+       email TEXT,
+       created_at TEXT DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE TABLE IF NOT EXISTS students
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       student_id TEXT UNIQUE NOT NULL,
+       full_name TEXT NOT NULL,
+       email TEXT NOT NULL,
+       program TEXT,
+       year INTEGER,
+       date_of_birth TEXT,
+       phone_number TEXT,
+       address TEXT,
+       created_at TEXT DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE TABLE IF NOT EXISTS results
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       student_id TEXT NOT NULL,
+       course_code TEXT NOT NULL,
+       course_name TEXT NOT NULL,
+       subject_level TEXT,
+       grade TEXT NOT NULL,
+       credits INTEGER,
+       semester TEXT NOT NULL,
+       academic_year TEXT NOT NULL,
+       remark TEXT,
+       created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+       updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+       FOREIGN KEY (student_id) REFERENCES students (student_id))''',
+    '''CREATE TABLE IF NOT EXISTS documents
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       student_id TEXT NOT NULL,
+       doc_name TEXT NOT NULL,
+       doc_type TEXT NOT NULL,
+       doc_path TEXT NOT NULL,
+       upload_date TEXT NOT NULL,
+       status TEXT DEFAULT 'Pending',
+       feedback TEXT,
+       reviewed_by TEXT,
+       reviewed_at TEXT,
+       FOREIGN KEY (student_id) REFERENCES students (student_id))''',
+    # Per-student lookups, the results listing's ORDER BY and the newest-documents lists
+    '''CREATE INDEX IF NOT EXISTS idx_results_student ON results (student_id, academic_year, semester)''',
+    '''CREATE INDEX IF NOT EXISTS idx_results_listing ON results (academic_year DESC, semester, student_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_documents_student ON documents (student_id, upload_date)''',
+    '''CREATE INDEX IF NOT EXISTS idx_documents_upload_date ON documents (upload_date)''',
+    # Duplicate-student lookups by birthday (duplicates.py)
+    '''CREATE INDEX IF NOT EXISTS idx_students_birth ON students (date_of_birth)''',
+    # A program and year's students, for what-if projections (projections.py)
+    '''CREATE INDEX IF NOT EXISTS idx_students_cohort ON students (program, year)''',
+    '''CREATE TABLE IF NOT EXISTS archived_years
+       (academic_year TEXT PRIMARY KEY,
+       db_path TEXT NOT NULL,
+       result_count INTEGER NOT NULL,
+       archived_at TEXT NOT NULL)''',
+    # Aggregates of each archived year, copied from its file at archive time (archive.py)
+    '''CREATE TABLE IF NOT EXISTS archived_grade_counts
+       (academic_year TEXT NOT NULL, grade TEXT, count INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS archived_semester_stats
+       (academic_year TEXT NOT NULL, semester TEXT, points_sum REAL, total_results INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS archived_subject_stats
+       (academic_year TEXT NOT NULL, course_name TEXT, course_code TEXT, total_students INTEGER,
+       struggling_students INTEGER, points_sum REAL)''',
+    '''CREATE TABLE IF NOT EXISTS archived_student_stats
+       (academic_year TEXT NOT NULL, student_id TEXT, total_subjects INTEGER, points_sum REAL)''',
+    '''CREATE INDEX IF NOT EXISTS idx_archived_student_stats ON archived_student_stats (student_id, academic_year)''',
+    '''CREATE TABLE IF NOT EXISTS archived_courses
+       (academic_year TEXT NOT NULL, course_code TEXT, course_name TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS change_log
+       (seq INTEGER PRIMARY KEY AUTOINCREMENT,
+       table_name TEXT NOT NULL,
+       row_id TEXT NOT NULL,
+       action TEXT NOT NULL,
+       changed_by TEXT,
+       changed_at TEXT DEFAULT CURRENT_TIMESTAMP,
+       old_data TEXT,
+       new_data TEXT)''',
+    '''CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, row_id)''',
+    '''CREATE TABLE IF NOT EXISTS document_counts
+       (status TEXT PRIMARY KEY,
+       count INTEGER NOT NULL)''',
+    '''CREATE TABLE IF NOT EXISTS document_derivatives
+       (doc_id INTEGER PRIMARY KEY REFERENCES documents (id),
+       content_hash TEXT NOT NULL,
+       thumbnail_path TEXT,
+       preview_path TEXT,
+       size_bytes INTEGER,
+       created_at TEXT DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE INDEX IF NOT EXISTS idx_document_derivatives_hash ON document_derivatives (content_hash)''',
+    '''CREATE TABLE IF NOT EXISTS document_text
+       (doc_id INTEGER PRIMARY KEY REFERENCES documents (id),
+       doc_name TEXT,
+       content TEXT,
+       extractor TEXT,
+       extracted_at TEXT DEFAULT CURRENT_TIMESTAMP)''',
+    # Full-text index over document_text, kept in step by the triggers below
+    '''CREATE VIRTUAL TABLE IF NOT EXISTS document_fts USING fts5
+       (doc_name, content, content='document_text', content_rowid='doc_id',
+       tokenize='unicode61 remove_diacritics 2')''',
+    '''CREATE TRIGGER IF NOT EXISTS document_text_insert AFTER INSERT ON document_text BEGIN
+       INSERT INTO document_fts (rowid, doc_name, content) VALUES (new.doc_id, new.doc_name, new.content);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS document_text_delete AFTER DELETE ON document_text BEGIN
+       INSERT INTO document_fts (document_fts, rowid, doc_name, content)
+       VALUES ('delete', old.doc_id, old.doc_name, old.content);
+       END''',
+    '''CREATE TRIGGER IF NOT EXISTS document_text_update AFTER UPDATE ON document_text BEGIN
+       INSERT INTO document_fts (document_fts, rowid, doc_name, content)
+       VALUES ('delete', old.doc_id, old.doc_name, old.content);
+       INSERT INTO document_fts (rowid, doc_name, content) VALUES (new.doc_id, new.doc_name, new.content);
+       END''',
+    '''CREATE TABLE IF NOT EXISTS courses
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       course_code TEXT UNIQUE NOT NULL,
+       course_name TEXT NOT NULL,
+       category TEXT)''',
+    '''CREATE TABLE IF NOT EXISTS change_consumers
+       (consumer TEXT PRIMARY KEY,
+       last_seq INTEGER NOT NULL,
+       updated_at TEXT DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE TABLE IF NOT EXISTS queries
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       student_id TEXT NOT NULL,
+       query_type TEXT NOT NULL,
+       message TEXT NOT NULL,
+       status TEXT NOT NULL DEFAULT 'Open',
+       response TEXT,
+       responded_by TEXT,
+       responded_at TEXT,
+       created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+       FOREIGN KEY (student_id) REFERENCES students (student_id))''',
+    # The admin inbox (newest first per status) and a student's own queries
+    '''CREATE INDEX IF NOT EXISTS idx_queries_inbox ON queries (status, id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_queries_student ON queries (student_id, id)''',
+    # Outbox written in the same transaction as the change it announces, see notifications.py
+    '''CREATE TABLE IF NOT EXISTS notifications
+       (id INTEGER PRIMARY KEY AUTOINCREMENT,
+       student_id TEXT NOT NULL,
+       email TEXT,
+       kind TEXT NOT NULL,
+       subject TEXT NOT NULL,
+       body TEXT NOT NULL,
+       status TEXT NOT NULL DEFAULT 'pending',
+       attempts INTEGER NOT NULL DEFAULT 0,
+       next_attempt_at TEXT NOT NULL,
+       last_error TEXT,
+       sent_at TEXT,
+       created_at TEXT DEFAULT CURRENT_TIMESTAMP)''',
+    '''CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications (status, next_attempt_at)''',
+]
+
+# Columns added to existing tables after their first release, as
+# (table, column, SQLite definition, PostgreSQL definition). create_tables()
+# adds the missing ones, then creates COLUMN_INDEXES over them.
+ADDED_COLUMNS = [
+    ('results', 'course_id', 'INTEGER REFERENCES courses (id)', 'INTEGER REFERENCES courses (id)'),
+    ('results', 'grade_points', 'REAL', 'DOUBLE PRECISION'),
+    ('students', 'status', "TEXT NOT NULL DEFAULT 'Active'", "TEXT NOT NULL DEFAULT 'Active'"),
+    # Match keys of duplicates.py, set by insert_student() and update_student()
+    ('students', 'name_key', 'TEXT', 'TEXT'),
+    ('students', 'email_key', 'TEXT', 'TEXT'),
+    ('students', 'phone_key', 'TEXT', 'TEXT'),
+    # Highest result id of an archived year, so the newest results are found without opening every year file
+    ('archived_years', 'max_result_id', 'INTEGER', 'BIGINT'),
+]
+
+COLUMN_INDEXES = [
+    '''CREATE INDEX IF NOT EXISTS idx_results_course ON results (course_id, grade_points)''',
+    '''CREATE INDEX IF NOT EXISTS idx_results_grade_points ON results (grade_points)''',
+    '''CREATE INDEX IF NOT EXISTS idx_students_status ON students (status, year, program)''',
+    '''CREATE INDEX IF NOT EXISTS idx_students_email_key ON students (email_key)''',
+    '''CREATE INDEX IF NOT EXISTS idx_students_phone_key ON students (phone_key)''',
+]
+
+# Timestamps are kept as 'YYYY-MM-DD HH:MM:SS' text on both backends
+PG_NOW = "to_char(now() AT TIME ZONE 'UTC', 'YYYY-MM-DD HH24:MI:SS')"
+
+POSTGRES_SCHEMA = [
+    f'''CREATE TABLE IF NOT EXISTS users
+       (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+       username TEXT UNIQUE NOT NULL,
+       password TEXT NOT NULL,
+       role TEXT NOT NULL,
+       full_name TEXT,
+       email TEXT,
+       created_at TEXT DEFAULT {PG_NOW})''',
+    f'''CREATE TABLE IF NOT EXISTS students
+       (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+       student_id TEXT UNIQUE NOT NULL,
+       full_name TEXT NOT NULL,
+       email TEXT NOT NULL,
+       program TEXT,
+       year INTEGER,
+       date_of_birth TEXT,
+       phone_number TEXT,
+       address TEXT,
+       created_at TEXT DEFAULT {PG_NOW})''',
+    f'''CREATE TABLE IF NOT EXISTS results
+       (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+       student_id TEXT NOT NULL REFERENCES students (student_id),
+       course_code TEXT NOT NULL,
+       course_name TEXT NOT NULL,
+       subject_level TEXT,
+       grade TEXT NOT NULL,
+       credits INTEGER,
+       semester TEXT NOT NULL,
+       academic_year TEXT NOT NULL,
+       remark TEXT,
+       created_at TEXT DEFAULT {PG_NOW},
+       updated_at TEXT DEFAULT {PG_NOW})''',
+    '''CREATE TABLE IF NOT EXISTS documents
+       (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+       student_id TEXT NOT NULL REFERENCES students (student_id),
+       doc_name TEXT NOT NULL,
+       doc_type TEXT NOT NULL,
+       doc_path TEXT NOT NULL,
+       upload_date TEXT NOT NULL,
+       status TEXT DEFAULT 'Pending',
+       feedback TEXT,
+       reviewed_by TEXT,
+       reviewed_at TEXT)''',
+    # Per-student lookups, the results listing's ORDER BY and the newest-documents lists
+    '''CREATE INDEX IF NOT EXISTS idx_results_student ON results (student_id, academic_year, semester)''',
+    '''CREATE INDEX IF NOT EXISTS idx_results_listing ON results (academic_year DESC, semester, student_id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_documents_student ON documents (student_id, upload_date)''',
+    '''CREATE INDEX IF NOT EXISTS idx_documents_upload_date ON documents (upload_date)''',
+    # Duplicate-student lookups by birthday (duplicates.py)
+    '''CREATE INDEX IF NOT EXISTS idx_students_birth ON students (date_of_birth)''',
+    # A program and year's students, for what-if projections (projections.py)
+    '''CREATE INDEX IF NOT EXISTS idx_students_cohort ON students (program, year)''',
+    '''CREATE TABLE IF NOT EXISTS archived_years
+       (academic_year TEXT PRIMARY KEY,
+       db_path TEXT NOT NULL,
+       result_count INTEGER NOT NULL,
+       archived_at TEXT NOT NULL)''',
+    # Aggregates of each archived year, copied from its file at archive time (archive.py)
+    '''CREATE TABLE IF NOT EXISTS archived_grade_counts
+       (academic_year TEXT NOT NULL, grade TEXT, count INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS archived_semester_stats
+       (academic_year TEXT NOT NULL, semester TEXT, points_sum DOUBLE PRECISION, total_results INTEGER)''',
+    '''CREATE TABLE IF NOT EXISTS archived_subject_stats
+       (academic_year TEXT NOT NULL, course_name TEXT, course_code TEXT, total_students INTEGER,
+       struggling_students INTEGER, points_sum DOUBLE PRECISION)''',
+    '''CREATE TABLE IF NOT EXISTS archived_student_stats
+       (academic_year TEXT NOT NULL, student_id TEXT, total_subjects INTEGER, points_sum DOUBLE PRECISION)''',
+    '''CREATE INDEX IF NOT EXISTS idx_archived_student_stats ON archived_student_stats (student_id, academic_year)''',
+    '''CREATE TABLE IF NOT EXISTS archived_courses
+       (academic_year TEXT NOT NULL, course_code TEXT, course_name TEXT)''',
+    f'''CREATE TABLE IF NOT EXISTS change_log
+       (seq BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+       table_name TEXT NOT NULL,
+       row_id TEXT NOT NULL,
+       action TEXT NOT NULL,
+       changed_by TEXT,
+       changed_at TEXT DEFAULT {PG_NOW},
+       old_data TEXT,
+       new_data TEXT)''',
+    '''CREATE INDEX IF NOT EXISTS idx_change_log_row ON change_log (table_name, row_id)''',
+    '''CREATE TABLE IF NOT EXISTS document_counts
+       (status TEXT PRIMARY KEY,
+       count INTEGER NOT NULL)''',
+    f'''CREATE TABLE IF NOT EXISTS document_derivatives
+       (doc_id INTEGER PRIMARY KEY REFERENCES documents (id),
+       content_hash TEXT NOT NULL,
+       thumbnail_path TEXT,
+       preview_path TEXT,
+       size_bytes INTEGER,
+       created_at TEXT DEFAULT {PG_NOW})''',
+    '''CREATE INDEX IF NOT EXISTS idx_document_derivatives_hash ON document_derivatives (content_hash)''',
+    f'''CREATE TABLE IF NOT EXISTS document_text
+       (doc_id INTEGER PRIMARY KEY REFERENCES documents (id),
+       doc_name TEXT,
+       content TEXT,
+       extractor TEXT,
+       extracted_at TEXT DEFAULT {PG_NOW},
+       search_vector tsvector GENERATED ALWAYS AS
+           (to_tsvector('simple', coalesce(doc_name, '') || ' ' || coalesce(content, ''))) STORED)''',
+    '''CREATE INDEX IF NOT EXISTS idx_document_text_search ON document_text USING GIN (search_vector)''',
+    '''CREATE TABLE IF NOT EXISTS courses
+       (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+       course_code TEXT UNIQUE NOT NULL,
+       course_name TEXT NOT NULL,
+       category TEXT)''',
+    f'''CREATE TABLE IF NOT EXISTS change_consumers
+       (consumer TEXT PRIMARY KEY,
+       last_seq BIGINT NOT NULL,
+       updated_at TEXT DEFAULT {PG_NOW})''',
+    f'''CREATE TABLE IF NOT EXISTS queries
+       (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+       student_id TEXT NOT NULL REFERENCES students (student_id),
+       query_type TEXT NOT NULL,
+       message TEXT NOT NULL,
+       status TEXT NOT NULL DEFAULT 'Open',
+       response TEXT,
+       responded_by TEXT,
+       responded_at TEXT,
+       created_at TEXT DEFAULT {PG_NOW})''',
+    # The admin inbox (newest first per status) and a student's own queries
+    '''CREATE INDEX IF NOT EXISTS idx_queries_inbox ON queries (status, id)''',
+    '''CREATE INDEX IF NOT EXISTS idx_queries_student ON queries (student_id, id)''',
+    # Outbox written in the same transaction as the change it announces, see notifications.py
+    f'''CREATE TABLE IF NOT EXISTS notifications
+       (id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+       student_id TEXT NOT NULL,
+       email TEXT,
+       kind TEXT NOT NULL,
+       subject TEXT NOT NULL,
+       body TEXT NOT NULL,
+       status TEXT NOT NULL DEFAULT 'pending',
+       attempts INTEGER NOT NULL DEFAULT 0,
+       next_attempt_at TEXT NOT NULL,
+       last_error TEXT,
+       sent_at TEXT,
+       created_at TEXT DEFAULT {PG_NOW})''',
+    '''CREATE INDEX IF NOT EXISTS idx_notifications_due ON notifications (status, next_attempt_at)''',
+]
+
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        # Called with the SQL of every statement a request runs (set by get_db_connection),
+        # see tests/test_query_plans.py
+        self.trace = None
+
+    def connect(self):
+        # uri=True lets archive.attach_year() ATTACH year files read-only
+        conn = sqlite3.connect(self.path, uri=True)
+        conn.row_factory = sqlite_row_factory
+        return conn
+
+    def create_tables(self, conn):
+        # Persistent in the file: readers never block writers, so a streamed page (iterate()) can hold
+        # its cursor open while other requests commit
+        conn.execute('PRAGMA journal_mode=WAL')
+        for ddl in SQLITE_SCHEMA:
+            conn.execute(ddl)
+        for table, column, definition, _ in ADDED_COLUMNS:
+            if column not in {row[1] for row in conn.execute(f'PRAGMA table_info({table})')}:
+                conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+        for ddl in COLUMN_INDEXES:
+            conn.execute(ddl)
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def close(self):
+        pass
+
+
+def _row_factory(cursor):
+    if cursor.description is None:
+        return tuple
+    return record_class(tuple(column.name for column in cursor.description))
+
+
+@functools.lru_cache(maxsize=1)
+def _numeric_loader():
+    """Load numeric values the way SQLite returns them: int for SUM/COUNT of integers, float otherwise"""
+    from psycopg.adapt import Loader
+
+    class NumericLoader(Loader):
+        def load(self, data):
+            text = bytes(data).decode('ascii')
+            return int(text) if text.lstrip('-').isdigit() else float(text)
+
+    return NumericLoader
+
+
+# Quoted strings and identifiers, which translate() leaves as written ('' escapes a quote inside a string)
+QUOTED = re.compile(r"""('(?:[^']|'')*'|"[^"]*")""")
+
+
+@functools.lru_cache(maxsize=1024)
+def translate(sql):
+    """Rewrite a SQLite-dialect statement for psycopg"""
+    parts = QUOTED.split(sql)
+    # Odd parts are quoted. psycopg reads % everywhere, quoted text included, so that is escaped throughout.
+    for i, part in enumerate(parts):
+        if i % 2 == 0:
+            part = part.replace('%', '%%').replace('?', '%s')
+            part = re.sub(r'\bLIKE\b', 'ILIKE', part)
+            part = re.sub(r'\bCURRENT_TIMESTAMP\b', PG_NOW, part)
+        else:
+            part = part.replace('%', '%%')
+        parts[i] = part
+    return ''.join(parts)
+
+
+class PostgresConnection:
+    """Pooled psycopg connection with the sqlite3 connection interface used by the routes"""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def execute(self, sql, params=()):
+        return self._conn.execute(translate(sql), tuple(params))
+
+    def executemany(self, sql, seq_of_params):
+        cursor = self._conn.cursor()
+        cursor.executemany(translate(sql), [tuple(p) for p in seq_of_params])
+        return cursor
+
+    def iterate(self, sql, params=(), size=500):
+        """Stream rows through a server-side cursor instead of loading them all"""
+        with self._conn.cursor(name='iterate', row_factory=_row_factory) as cursor:
+            cursor.itersize = size
+            cursor.execute(translate(sql), tuple(params))
+            yield from cursor
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        if self._conn is not None:
+            # Hand the connection back idle, discarding anything uncommitted
+            self._conn.rollback()
+            self._pool.putconn(self._conn)
+            self._conn = None
+
+
+class PostgresBackend:
+    name = 'postgresql'
+
+    def __init__(self, url, min_size=1, max_size=10, prepare_threshold=1):
+        try:
+            from psycopg_pool import ConnectionPool
+        except ImportError:
+            raise RuntimeError('PostgreSQL support needs psycopg: pip install "psycopg[binary]" psycopg_pool')
+        # prepare_threshold=1 prepares a statement server-side on its second use per connection
+        self.pool = ConnectionPool(url, min_size=min_size, max_size=max_size, open=True,
+                                   configure=self._configure,
+                                   kwargs={'row_factory': _row_factory, 'prepare_threshold': prepare_threshold})
+
+    @staticmethod
+    def _configure(conn):
+        conn.adapters.register_loader('numeric', _numeric_loader())
+
+    def connect(self):
+        return PostgresConnection(self.pool, self.pool.getconn())
+
+    def create_tables(self, conn):
+        for ddl in POSTGRES_SCHEMA:
+            conn.execute(ddl)
+        for table, column, _, definition in ADDED_COLUMNS:
+            conn.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {column} {definition}')
+        for ddl in COLUMN_INDEXES:
+            conn.execute(ddl)
+
+    def reset(self):
+        conn = self.connect()
+        conn.execute('DROP TABLE IF EXISTS notifications, queries, document_text, document_derivatives, document_counts, change_consumers, change_log, archived_years, archived_grade_counts, archived_semester_stats, archived_subject_stats, archived_student_stats, archived_courses, documents, results, courses, students, users CASCADE')
+        conn.commit()
+        conn.close()
+
+    def close(self):
+        self.pool.close()
+
+
+def create_backend(database_url, database_path):
+    if database_url.startswith(('postgresql://', 'postgres://')):
+        return PostgresBackend(
+            database_url,
+            min_size=int(os.environ.get('DATABASE_POOL_MIN', 1)),
+            max_size=int(os.environ.get('DATABASE_POOL_MAX', 10)),
+        )
+    return SQLiteBackend(database_path)
+
+
+def iterate(conn, sql, params=(), size=500):
+    """Iterate a large query lazily: a server-side cursor on Postgres, the plain cursor on SQLite.
+
+    A SQLite database not in WAL mode (one WAL could not be turned on for) gets its rows
+    fetched at once instead: there an open read cursor holds a SHARED lock, and every
+    writer would fail with "database is locked" until the response had been sent.
+    """
+    if isinstance(conn, PostgresConnection):
+        return conn.iterate(sql, params, size)
+    if conn.execute('PRAGMA journal_mode').fetchone()[0] != 'wal':
+        return iter(conn.execute(sql, params).fetchall())
+    cursor = conn.execute(sql, params)
+    cursor.arraysize = size
+    return cursor
+
+
+# Data-access helpers for the core tables
+def get_user(conn, username, role=None):
+    if role is None:
+        return conn.execute('SELECT * FROM users WHERE username = ?', (username,)).fetchone()
+    return conn.execute('SELECT * FROM users WHERE username = ? AND role = ?', (username, role)).fetchone()
+
+
+def get_student(conn, student_id):
+    return conn.execute('SELECT * FROM students WHERE student_id = ?', (student_id,)).fetchone()
+
+
+def get_student_by_email(conn, email):
+    return conn.execute('SELECT * FROM students WHERE email = ?', (email,)).fetchone()
+
+
+def get_document(conn, doc_id):
+    return conn.execute('SELECT * FROM documents WHERE id = ?', (doc_id,)).fetchone()
+
+
+def get_result_with_student(conn, result_id):
+    return conn.execute('''
+        SELECT r.*, s.full_name
+        FROM results r
+        JOIN students s ON r.student_id = s.student_id
+        WHERE r.id = ?
+    ''', (result_id,)).fetchone()
+
+
+def find_result(conn, student_id, course_code, semester, academic_year):
+    return conn.execute('''
+        SELECT * FROM results
+        WHERE student_id = ? AND course_code = ? AND semester = ? AND academic_year = ?
+    ''', (student_id, course_code, semester, academic_year)).fetchone()
+
+
+def insert_user(conn, username, password_hash, role, full_name, email):
+    conn.execute('''
+        INSERT INTO users (username, password, role, full_name, email)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (username, password_hash, role, full_name, email))
+
+
+# Helpers that modify students, results or documents log the change to
+# change_log in the caller's transaction; changed_by is the acting username.
+def insert_student(conn, student_id, full_name, email, program, year, date_of_birth, phone_number, address,
+                   changed_by=None):
+    new = conn.execute('''
+        INSERT INTO students (student_id, full_name, email, program, year, date_of_birth, phone_number, address,
+                              name_key, email_key, phone_key)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING *
+    ''', (student_id, full_name, email, program, year, date_of_birth, phone_number, address,
+          *match_keys(full_name, email, phone_number))).fetchone()
+    record_change(conn, 'students', student_id, 'insert', new=new, changed_by=changed_by)
+
+
+def update_student(conn, student_id, full_name, email, program, year, date_of_birth, phone_number, address,
+                   changed_by=None):
+    old = get_student(conn, student_id)
+    new = conn.execute('''
+        UPDATE students
+        SET full_name = ?, email = ?, program = ?, year = ?, date_of_birth = ?, phone_number = ?, address = ?,
+            name_key = ?, email_key = ?, phone_key = ?
+        WHERE student_id = ?
+        RETURNING *
+    ''', (full_name, email, program, year, date_of_birth, phone_number, address,
+          *match_keys(full_name, email, phone_number), student_id)).fetchone()
+    conn.execute('''
+        UPDATE users
+        SET full_name = ?, email = ?
+        WHERE username = ?
+    ''', (full_name, email, student_id))
+    if new is not None:
+        record_change(conn, 'students', student_id, 'update', old=old, new=new, changed_by=changed_by)
+
+
+def delete_student(conn, student_id, changed_by=None):
+    """Delete a student with their results, documents and user account"""
+    delete_students(conn, [student_id], changed_by)
+
+
+def delete_students(conn, student_ids, changed_by=None, chunk_size=500):
+    """Delete many students with their results, documents, queries and user accounts. Returns the number deleted.
+
+    Runs one DELETE ... WHERE student_id IN (...) per table and chunk of ids
+    in the caller's transaction, like review_documents().
+    """
+    student_ids = list(dict.fromkeys(student_ids))
+    deleted = 0
+    statuses = []
+    for start in range(0, len(student_ids), chunk_size):
+        chunk = student_ids[start:start + chunk_size]
+        placeholders = ', '.join('?' * len(chunk))
+        results = conn.execute(f'DELETE FROM results WHERE student_id IN ({placeholders}) RETURNING *',
+                               chunk).fetchall()
+        conn.execute(f'''
+            DELETE FROM document_derivatives
+            WHERE doc_id IN (SELECT id FROM documents WHERE student_id IN ({placeholders}))
+        ''', chunk)
+        conn.execute(f'''
+            DELETE FROM document_text WHERE doc_id IN (SELECT id FROM documents WHERE student_id IN ({placeholders}))
+        ''', chunk)
+        documents = conn.execute(f'DELETE FROM documents WHERE student_id IN ({placeholders}) RETURNING *',
+                                 chunk).fetchall()
+        conn.execute(f'DELETE FROM queries WHERE student_id IN ({placeholders})', chunk)
+        conn.execute(f"DELETE FROM notifications WHERE student_id IN ({placeholders}) AND status <> 'sent'", chunk)
+        students = conn.execute(f'DELETE FROM students WHERE student_id IN ({placeholders}) RETURNING *',
+                                chunk).fetchall()
+        conn.execute(f'DELETE FROM users WHERE username IN ({placeholders})', chunk)
+        record_changes(conn, [('results', old['id'], 'delete', old, None) for old in results]
+                       + [('documents', old['id'], 'delete', old, None) for old in documents]
+                       + [('students', old['student_id'], 'delete', old, None) for old in students], changed_by)
+        statuses.extend(old['status'] for old in documents)
+        deleted += len(students)
+    _adjust_document_counts(conn, _status_deltas(statuses), -1)
+    return deleted
+
+
+def backfill_match_keys(conn, batch_size=5000):
+    """Set the duplicate-matching keys on students added without them (older rows, the sample data)"""
+    while True:
+        rows = conn.execute('''
+            SELECT student_id, full_name, email, phone_number FROM students WHERE name_key IS NULL LIMIT ?
+        ''', (batch_size,)).fetchall()
+        updates = []
+        for row in rows:
+            name, email, phone = match_keys(row['full_name'], row['email'], row['phone_number'])
+            # Names without letters get an empty key so they are not picked up again
+            updates.append((name or '', email, phone, row['student_id']))
+        if updates:
+            conn.executemany('UPDATE students SET name_key = ?, email_key = ?, phone_key = ? WHERE student_id = ?',
+                             updates)
+        if len(rows) < batch_size:
+            return
+
+
+def insert_result(conn, student_id, course_code, course_name, subject_level, grade, credits, semester,
+                  academic_year, remark, changed_by=None):
+    new = conn.execute('''
+        INSERT INTO results (student_id, course_code, course_name, subject_level, grade, credits, semester, academic_year,
+                             remark, course_id, grade_points)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        RETURNING *
+    ''', (student_id, course_code, course_name, subject_level, grade, credits, semester, academic_year, remark,
+          course_id(conn, course_code, course_name), GRADE_TO_POINTS.get(grade))).fetchone()
+    record_change(conn, 'results', new['id'], 'insert', new=new, changed_by=changed_by)
+    return new['id']
+
+
+def update_result(conn, result_id, course_code, course_name, subject_level, grade, credits, semester,
+                  academic_year, remark, changed_by=None):
+    old = conn.execute('SELECT * FROM results WHERE id = ?', (result_id,)).fetchone()
+    new = conn.execute('''
+        UPDATE results
+        SET course_code = ?, course_name = ?, subject_level = ?, grade = ?, credits = ?,
+            semester = ?, academic_year = ?, remark = ?, course_id = ?, grade_points = ?,
+            updated_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        RETURNING *
+    ''', (course_code, course_name, subject_level, grade, credits, semester, academic_year, remark,
+          course_id(conn, course_code, course_name), GRADE_TO_POINTS.get(grade), result_id)).fetchone()
+    if new is not None:
+        record_change(conn, 'results', result_id, 'update', old=old, new=new, changed_by=changed_by)
+
+
+def delete_result(conn, result_id, changed_by=None):
+    old = conn.execute('DELETE FROM results WHERE id = ? RETURNING *', (result_id,)).fetchone()
+    if old is not None:
+        record_change(conn, 'results', result_id, 'delete', old=old, changed_by=changed_by)
+
+
+# Course catalog. results rows point at their course through course_id and
+# carry grade_points, so aggregates are numeric sums over integer keys.
+def sync_courses(conn, catalog):
+    """Add or rename the catalog's courses, given as (course_code, course_name, category)"""
+    conn.executemany('''
+        INSERT INTO courses (course_code, course_name, category) VALUES (?, ?, ?)
+        ON CONFLICT (course_code) DO UPDATE SET course_name = excluded.course_name, category = excluded.category
+    ''', catalog)
+
+
+def course_id(conn, course_code, course_name):
+    """id of a course, adding codes that are not in the catalog yet"""
+    row = conn.execute('SELECT id FROM courses WHERE course_code = ?', (course_code,)).fetchone()
+    if row is None:
+        # The no-op update makes RETURNING give the id when another request added the code first
+        row = conn.execute('''
+            INSERT INTO courses (course_code, course_name) VALUES (?, ?)
+            ON CONFLICT (course_code) DO UPDATE SET course_code = excluded.course_code
+            RETURNING id
+        ''', (course_code, course_name)).fetchone()
+    return row['id']
+
+
+def backfill_results(conn):
+    """Set course_id and grade_points on results written without them (older rows, restored archives)"""
+    conn.execute('''
+        INSERT INTO courses (course_code, course_name)
+        SELECT course_code, MIN(course_name) FROM results WHERE course_id IS NULL GROUP BY course_code
+        ON CONFLICT (course_code) DO NOTHING
+    ''')
+    conn.execute('''
+        UPDATE results SET course_id = (SELECT c.id FROM courses c WHERE c.course_code = results.course_code)
+        WHERE course_id IS NULL
+    ''')
+    whens = ' '.join('WHEN ? THEN ?' for _ in GRADE_TO_POINTS)
+    params = [value for item in GRADE_TO_POINTS.items() for value in item]
+    conn.execute(f'''
+        UPDATE results SET grade_points = CASE grade {whens} END
+        WHERE grade_points IS NULL AND grade IN ({', '.join('?' * len(GRADE_TO_POINTS))})
+    ''', params + list(GRADE_TO_POINTS))
+
+
+def insert_document(conn, student_id, doc_name, doc_type, doc_path, upload_date, changed_by=None):
+    new = conn.execute('''
+        INSERT INTO documents (student_id, doc_name, doc_type, doc_path, upload_date)
+        VALUES (?, ?, ?, ?, ?)
+        RETURNING *
+    ''', (student_id, doc_name, doc_type, doc_path, upload_date)).fetchone()
+    record_change(conn, 'documents', new['id'], 'insert', new=new, changed_by=changed_by)
+    _adjust_document_counts(conn, {new['status']: 1})
+    return new['id']
+
+
+def update_document_status(conn, doc_id, status, feedback, reviewed_by):
+    return review_documents(conn, [doc_id], status, feedback, reviewed_by)
+
+
+def review_documents(conn, doc_ids, status, feedback, reviewed_by, chunk_size=1000):
+    """Set status and feedback on many documents at once. Returns the number updated.
+
+    Runs one UPDATE ... WHERE id IN (...) per chunk of ids (SQLite limits the
+    number of bound parameters) in the caller's transaction, and adjusts
+    document_counts by the net change rather than recounting. Each student
+    is notified through the outbox in the same transaction.
+    """
+    doc_ids = list(dict.fromkeys(int(doc_id) for doc_id in doc_ids))
+    updated = 0
+    deltas = {}
+    for start in range(0, len(doc_ids), chunk_size):
+        chunk = doc_ids[start:start + chunk_size]
+        placeholders = ', '.join('?' * len(chunk))
+        old = {row['id']: row for row in
+               conn.execute(f'SELECT * FROM documents WHERE id IN ({placeholders})', chunk).fetchall()}
+        new = conn.execute(f'''
+            UPDATE documents
+            SET status = ?, feedback = ?, reviewed_by = ?, reviewed_at = CURRENT_TIMESTAMP
+            WHERE id IN ({placeholders})
+            RETURNING *
+        ''', [status, feedback, reviewed_by] + chunk).fetchall()
+        for row in new:
+            previous = old[row['id']]['status']
+            deltas[previous] = deltas.get(previous, 0) - 1
+            deltas[status] = deltas.get(status, 0) + 1
+        record_changes(conn, [('documents', row['id'], 'update', old[row['id']], row) for row in new], reviewed_by)
+        notify_many(conn, [(row['student_id'], 'document', f"Your document {row['doc_name']} was marked {status}",
+                            f'Feedback: {feedback}' if feedback else f'Reviewed by {reviewed_by}.') for row in new])
+        updated += len(new)
+    _adjust_document_counts(conn, deltas)
+    return updated
+
+
+# Student queries. The admin inbox pages through idx_queries_inbox newest first.
+def insert_query(conn, student_id, query_type, message):
+    return conn.execute('''
+        INSERT INTO queries (student_id, query_type, message) VALUES (?, ?, ?) RETURNING id
+    ''', (student_id, query_type, message)).fetchone()['id']
+
+
+def answer_query(conn, query_id, response, status, responded_by):
+    """Record the response to a query and notify the student. Returns the updated query or None."""
+    row = conn.execute('''
+        UPDATE queries SET response = ?, status = ?, responded_by = ?, responded_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        RETURNING *
+    ''', (response, status, responded_by, query_id)).fetchone()
+    if row is not None:
+        notify(conn, row['student_id'], 'query', f"{row['query_type']}: your query was {status.lower()}", response)
+    return row
+
+
+# document_counts keeps the number of documents per status so the dashboard
+# does not recount the documents table on every request
+def _status_deltas(statuses):
+    deltas = {}
+    for status in statuses:
+        deltas[status] = deltas.get(status, 0) + 1
+    return deltas
+
+
+def _adjust_document_counts(conn, deltas, sign=1):
+    changes = [(status, sign * delta) for status, delta in deltas.items() if delta and status is not None]
+    if changes:
+        conn.executemany('''
+            INSERT INTO document_counts (status, count) VALUES (?, ?)
+            ON CONFLICT (status) DO UPDATE SET count = document_counts.count + excluded.count
+        ''', changes)
+
+
+def refresh_document_counts(conn):
+    """Rebuild document_counts from the documents table"""
+    conn.execute('DELETE FROM document_counts')
+    conn.execute('''
+        INSERT INTO document_counts (status, count)
+        SELECT status, COUNT(*) FROM documents WHERE status IS NOT NULL GROUP BY status
+    ''')
+
+
+def document_counts(conn):
+    """{status: count} for every document status"""
+    return {row['status']: row['count'] for row in conn.execute('SELECT status, count FROM document_counts').fetchall()}
@@ -0,0 +1,238 @@
+# document_index.py
+"""Text extraction and full-text search over uploaded documents.
+
+After an upload is committed, index_in_background() extracts the text of the
+file and stores it in document_text, one row per document. The search index
+is kept up to date by the database itself:
+
+* SQLite - the document_fts FTS5 table indexes document_text through
+  triggers, so every insert, update or delete in document_text is applied to
+  the index in the same transaction.
+* PostgreSQL - document_text.search_vector is a generated tsvector column
+  with a GIN index. Matching is case-insensitive but, unlike SQLite, not
+  accent-insensitive (that would need the unaccent extension).
+
+Extractors exist for txt, docx (read straight from the zip, no extra packages)
+and pdf (needs pypdfium2). OCR is an optional plug-in: set_ocr_engine()
+registers a function that turns a PIL image into text. It is used for
+photographed documents and for scanned PDFs without a text layer. When
+pytesseract is installed and DOCUMENT_OCR=1, Tesseract is registered at
+import time.
+"""
+import logging
+import os
+import re
+import sqlite3
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+from markupsafe import Markup, escape
+
+log = logging.getLogger(__name__)
+
+# Text kept per document; enough for any ID copy or transcript
+MAX_TEXT_CHARS = 200_000
+
+# Pages of a scanned PDF sent to OCR
+MAX_OCR_PAGES = 5
+
+# Markers put around matches by the database, turned into <mark> by highlight()
+MATCH_START, MATCH_END = '\x02', '\x03'
+
+WORD_NAMESPACE = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix='document-index')
+_ocr_engine = None
+
+
+def set_ocr_engine(engine):
+    """Register engine(pil_image) -> str as the OCR step, or None to disable OCR"""
+    global _ocr_engine
+    _ocr_engine = engine
+
+
+def tesseract_ocr(image):
+    import pytesseract
+    return pytesseract.image_to_string(image)
+
+
+def extension(path):
+    return path.rsplit('.', 1)[1].lower() if '.' in os.path.basename(path) else ''
+
+
+def extract_txt(path):
+    with open(path, 'rb') as f:
+        return f.read(MAX_TEXT_CHARS * 4).decode('utf-8', errors='replace')
+
+
+def extract_docx(path):
+    with zipfile.ZipFile(path) as archive:
+        root = ElementTree.fromstring(archive.read('word/document.xml'))
+    paragraphs = []
+    for paragraph in root.iter(f'{WORD_NAMESPACE}p'):
+        paragraphs.append(''.join(node.text or '' for node in paragraph.iter(f'{WORD_NAMESPACE}t')))
+    return '\n'.join(p for p in paragraphs if p)
+
+
+def _pdf_pages(path):
+    import pypdfium2
+    return pypdfium2.PdfDocument(path)
+
+
+def extract_pdf(path):
+    pdf = _pdf_pages(path)
+    try:
+        texts = []
+        for page in pdf:
+            texts.append(page.get_textpage().get_text_range())
+            if sum(len(text) for text in texts) > MAX_TEXT_CHARS:
+                break
+        return '\n'.join(texts)
+    finally:
+        pdf.close()
+
+
+def ocr_pdf(path):
+    pdf = _pdf_pages(path)
+    try:
+        return '\n'.join(_ocr_engine(pdf[i].render(scale=2).to_pil()) for i in range(min(len(pdf), MAX_OCR_PAGES)))
+    finally:
+        pdf.close()
+
+
+def ocr_image(path):
+    from PIL import Image
+    with Image.open(path) as image:
+        return _ocr_engine(image)
+
+
+def extract_text(path):
+    """Text of a document and the extractor used, or (None, None) when nothing can read it"""
+    ext = extension(path)
+    text, extractor = None, None
+    if ext == 'txt':
+        text, extractor = extract_txt(path), 'txt'
+    elif ext == 'docx':
+        text, extractor = extract_docx(path), 'docx'
+    elif ext == 'pdf':
+        try:
+            text, extractor = extract_pdf(path), 'pdf'
+        except ImportError:
+            pass
+        # A PDF without a text layer is a scan
+        if not (text or '').strip() and _ocr_engine is not None:
+            try:
+                text, extractor = ocr_pdf(path), 'pdf-ocr'
+            except ImportError:
+                pass
+    elif ext in ('jpg', 'jpeg', 'png') and _ocr_engine is not None:
+        text, extractor = ocr_image(path), 'image-ocr'
+
+    if text is None:
+        return None, None
+    return re.sub(r'[ \t\r\f\v]+', ' ', text).strip()[:MAX_TEXT_CHARS], extractor
+
+
+def store_text(conn, doc_id, doc_name, text, extractor):
+    conn.execute('''
+        INSERT INTO document_text (doc_id, doc_name, content, extractor, extracted_at)
+        VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+        ON CONFLICT (doc_id) DO UPDATE SET doc_name = excluded.doc_name, content = excluded.content,
+            extractor = excluded.extractor, extracted_at = excluded.extracted_at
+    ''', (doc_id, doc_name, text, extractor))
+
+
+def index_document(connect, doc_id, path, doc_name):
+    """Extract a document's text and store it. connect() opens a database connection. Returns the extractor used."""
+    text, extractor = extract_text(path)
+    if text is None:
+        return None
+    conn = connect()
+    try:
+        store_text(conn, doc_id, doc_name, text, extractor)
+        conn.commit()
+    finally:
+        conn.close()
+    return extractor
+
+
+def _run(connect, doc_id, path, doc_name):
+    try:
+        index_document(connect, doc_id, path, doc_name)
+    except Exception as e:
+        log.warning('Could not extract text from document %s (%s): %s', doc_id, path, e)
+
+
+def index_in_background(connect, doc_id, path, doc_name):
+    """Queue index_document() so the upload response does not wait for it"""
+    _pool.submit(_run, connect, doc_id, path, doc_name)
+
+
+def _terms(query):
+    """(word, is_prefix) for each word of the user's query; a trailing * asks for a prefix match"""
+    terms = []
+    for word in re.findall(r'[\w*]+', query):
+        prefix = word.endswith('*')
+        word = word.strip('*')
+        if word:
+            terms.append((word, prefix))
+    return terms
+
+
+def _within(doc_id, filters):
+    """Correlated check of filters for each match; a primary key lookup per matching document"""
+    if not filters:
+        return ''
+    return f'''
+              AND EXISTS (SELECT 1 FROM documents d JOIN students s ON d.student_id = s.student_id
+                          WHERE d.id = {doc_id}{filters})'''
+
+
+def search_documents(conn, query, limit=200, filters='', filter_params=()):
+    """{doc_id: snippet} of the documents whose name or text matches, best match first
+
+    filters are extra ' AND ...' conditions on the document (d) and its
+    student (s), with ? placeholders for filter_params. They are checked
+    before the limit, so filtered searches are not cut short by matches
+    that the filters would drop.
+    """
+    terms = _terms(query)
+    if not terms:
+        return {}
+    # Every word must appear
+    if isinstance(conn, sqlite3.Connection):
+        fts_query = ' '.join(f'"{word}"' + ('*' if prefix else '') for word, prefix in terms)
+        rows = conn.execute('''
+            SELECT rowid AS doc_id, snippet(document_fts, 1, ?, ?, '…', 16) AS snippet
+            FROM document_fts
+            WHERE document_fts MATCH ?{within}
+            ORDER BY rank
+            LIMIT ?
+        '''.format(within=_within('document_fts.rowid', filters)),
+            (MATCH_START, MATCH_END, fts_query, *filter_params, limit)).fetchall()
+    else:
+        ts_query = ' & '.join(f"'{word}'" + (':*' if prefix else '') for word, prefix in terms)
+        rows = conn.execute('''
+            SELECT doc_id, ts_headline('simple', content, q, ?) AS snippet
+            FROM document_text, to_tsquery('simple', ?) AS q
+            WHERE search_vector @@ q{within}
+            ORDER BY ts_rank(search_vector, q) DESC
+            LIMIT ?
+        '''.format(within=_within('document_text.doc_id', filters)),
+            (f'StartSel={MATCH_START}, StopSel={MATCH_END}, MaxWords=24, MinWords=8', ts_query, *filter_params,
+             limit)).fetchall()
+    return {row['doc_id']: row['snippet'] for row in rows}
+
+
+def highlight(snippet):
+    """Escape a search snippet and turn the match markers into <mark> tags"""
+    return Markup(str(escape(snippet or '')).replace(MATCH_START, '<mark>').replace(MATCH_END, '</mark>'))
+
+
+if os.environ.get('DOCUMENT_OCR') == '1':
+    try:
+        import pytesseract  # noqa: F401
+        set_ocr_engine(tesseract_ocr)
+    except ImportError:
+        log.warning('DOCUMENT_OCR=1 but pytesseract is not installed; OCR is disabled')
@@ -0,0 +1,232 @@
+# duplicates.py
+"""Likely-duplicate students: the same learner enrolled twice under another id.
+
+Comparing every new student with every enrolled one, or every pair in a
+district for a report, does not scale. Instead each student carries match
+keys, stored in columns of students:
+
+* name_key - the Soundex codes of the name's words, sorted, so spelling
+  variants and swapped first and last names share a key
+  (Tshwika / Tswika, "Mudau Rendani").
+* email_key - the address lower-cased, without a +tag, and for Gmail
+  without the dots in the local part.
+* phone_key - the last 9 digits, so +27 82 ..., 082 ... and 82... agree.
+
+score() adds up the evidence for a pair; anything at MATCH_THRESHOLD or
+above is reported. A shared phone number or a common name alone is not
+enough (siblings share a parent's phone), but a name that sounds alike
+with the same birthday or phone number is. Since no name on its own reaches
+the threshold, a likely duplicate always shares an email_key, a phone_key or
+a date of birth with the student. Those are the blocks candidates come from:
+
+* A new student is looked up by email_key, phone_key and date_of_birth,
+  three index lookups, and only those few rows are scored.
+* The batch report groups the whole table by email_key, by phone_key, and by
+  date of birth together with each name word's code, and scores the pairs
+  inside each small block rather than all n² pairs.
+"""
+import functools
+import re
+import time
+import unicodedata
+from difflib import SequenceMatcher
+
+# Scores at or above this are flagged as likely duplicates
+MATCH_THRESHOLD = 0.5
+
+# Evidence weights, added up by score()
+EMAIL_WEIGHT = 0.5
+PHONE_WEIGHT = 0.35
+BIRTH_DATE_WEIGHT = 0.25
+NAME_SOUND_WEIGHT = 0.35
+NAME_SIMILAR_WEIGHT = 0.3
+NAME_PART_WEIGHT = 0.1
+
+# Blocks bigger than this are placeholder values (a school's switchboard number, 'none@school'), not people
+MAX_BLOCK = 50
+
+MATCH_COLUMNS = ('name_key', 'email_key', 'phone_key')
+
+# Every likely duplicate shares one of these with the student
+BLOCK_COLUMNS = ('email_key', 'phone_key', 'date_of_birth')
+
+_SOUNDEX = {letter: str(code) for code, letters in enumerate(('aeiouyhw', 'bfpv', 'cgjkqsxz', 'dt', 'l', 'mn', 'r'))
+            for letter in letters}
+_GMAIL = {'gmail.com', 'googlemail.com'}
+
+
+def name_words(full_name):
+    """Lower-case ASCII words of a name, accents removed"""
+    text = unicodedata.normalize('NFKD', full_name or '').encode('ascii', 'ignore').decode().lower()
+    return re.findall(r'[a-z]+', text)
+
+
+@functools.lru_cache(maxsize=65536)
+def _sorted_words(full_name):
+    """A name's words in alphabetical order, compared letter by letter by score()"""
+    return ' '.join(sorted(name_words(full_name)))
+
+
+def soundex(word):
+    """American Soundex code of a word: first letter and three digits"""
+    codes = [_SOUNDEX[letter] for letter in word]
+    digits = []
+    previous = codes[0]
+    for letter, code in zip(word[1:], codes[1:]):
+        if code != '0' and code != previous:
+            digits.append(code)
+        # h and w do not separate two letters with the same code, vowels do
+        if letter not in 'hw':
+            previous = code
+    return (word[0] + ''.join(digits) + '000')[:4]
+
+
+def name_key(full_name):
+    codes = sorted(soundex(word) for word in name_words(full_name) if len(word) > 1)
+    return ' '.join(codes) or None
+
+
+def email_key(email):
+    email = (email or '').strip().lower()
+    if '@' not in email:
+        return email or None
+    local, domain = email.rsplit('@', 1)
+    local = local.split('+', 1)[0]
+    if domain in _GMAIL:
+        local, domain = local.replace('.', ''), 'gmail.com'
+    return f'{local}@{domain}'
+
+
+def phone_key(phone_number):
+    digits = re.sub(r'\D', '', phone_number or '')
+    return digits[-9:] if len(digits) >= 9 else None
+
+
+def match_keys(full_name, email, phone_number):
+    """(name_key, email_key, phone_key) stored with a student"""
+    return name_key(full_name), email_key(email), phone_key(phone_number)
+
+
+def score(a, b):
+    """(score, reasons) for two students given as mappings with the student columns"""
+    total = 0.0
+    reasons = []
+    if a['email_key'] and a['email_key'] == b['email_key']:
+        total += EMAIL_WEIGHT
+        reasons.append('same email')
+    if a['phone_key'] and a['phone_key'] == b['phone_key']:
+        total += PHONE_WEIGHT
+        reasons.append('same phone number')
+    if a['date_of_birth'] and a['date_of_birth'] == b['date_of_birth']:
+        total += BIRTH_DATE_WEIGHT
+        reasons.append('same date of birth')
+    if total == 0:
+        # The name alone never reaches MATCH_THRESHOLD
+        return total, reasons
+    key_a, key_b = a['name_key'] or '', b['name_key'] or ''
+    if key_a and key_a == key_b:
+        total += NAME_SOUND_WEIGHT
+        reasons.append('names sound alike')
+        return round(total, 2), reasons
+    codes_a, codes_b = set(key_a.split()), set(key_b.split())
+    # A typo changes the sound of one word at most; names further apart are not compared letter by letter
+    if len(codes_a ^ codes_b) <= 2 and _similar(_sorted_words(a['full_name']), _sorted_words(b['full_name'])):
+        total += NAME_SIMILAR_WEIGHT
+        reasons.append('similar names')
+    elif codes_a & codes_b:
+        total += NAME_PART_WEIGHT
+        reasons.append('a name in common')
+    return round(total, 2), reasons
+
+
+def _similar(a, b, cutoff=0.85):
+    matcher = SequenceMatcher(None, a, b)
+    # The cheap upper bounds rule out most pairs, as in difflib.get_close_matches()
+    return matcher.real_quick_ratio() >= cutoff and matcher.quick_ratio() >= cutoff and matcher.ratio() >= cutoff
+
+
+def find_matches(conn, full_name, email, phone_number, date_of_birth, exclude=None, threshold=MATCH_THRESHOLD):
+    """Enrolled students that are likely the same person, best first, as [(student, score, reasons)]"""
+    new = dict(zip(MATCH_COLUMNS, match_keys(full_name, email, phone_number)), full_name=full_name,
+               date_of_birth=date_of_birth or None)
+    lookups = [(column, new[column]) for column in BLOCK_COLUMNS if new[column]]
+    if not lookups:
+        return []
+    # One indexed lookup per key; UNION drops a student found by several
+    candidates = conn.execute(' UNION '.join(f'SELECT * FROM students WHERE {column} = ?' for column, _ in lookups)
+                              + f' LIMIT {MAX_BLOCK * len(lookups)}', [value for _, value in lookups]).fetchall()
+    matches = []
+    for candidate in candidates:
+        if candidate['student_id'] == exclude:
+            continue
+        candidate_score, reasons = score(new, candidate)
+        if candidate_score >= threshold:
+            matches.append((candidate, candidate_score, reasons))
+    matches.sort(key=lambda match: -match[1])
+    return matches
+
+
+def duplicate_report(conn, threshold=MATCH_THRESHOLD):
+    """Groups of likely duplicates among all students.
+
+    Returns {'students': n, 'pairs_compared': n, 'seconds': s, 'groups': [{'students': [...], 'pairs': [...]}]},
+    groups largest first, each pair as (student_id, student_id, score, reasons).
+    """
+    start = time.perf_counter()
+    rows = conn.execute('''
+        SELECT student_id, full_name, email, program, year, date_of_birth, phone_number, status,
+               name_key, email_key, phone_key
+        FROM students
+    ''').fetchall()
+    # Plain dicts: score() reads each row's columns many times
+    students = {row['student_id']: dict(zip(row.keys(), row)) for row in rows}
+    blocks = {}
+    for student_id, row in students.items():
+        for column in ('email_key', 'phone_key'):
+            if row[column]:
+                blocks.setdefault((column, row[column]), []).append(student_id)
+        if row['date_of_birth']:
+            # Birthdays are shared by many; a match also needs a name that sounds alike or is spelt alike,
+            # which in practice shares at least one word's code
+            for code in set((row['name_key'] or '').split()):
+                blocks.setdefault(('birth', row['date_of_birth'], code), []).append(student_id)
+    candidate_pairs = set()
+    for members in blocks.values():
+        if 1 < len(members) <= MAX_BLOCK:
+            members.sort()
+            candidate_pairs.update((a, b) for i, a in enumerate(members) for b in members[i + 1:])
+    pairs = []
+    for a, b in sorted(candidate_pairs):
+        pair_score, reasons = score(students[a], students[b])
+        if pair_score >= threshold:
+            pairs.append((a, b, pair_score, reasons))
+    groups = _connected(pairs)
+    return {
+        'students': len(students),
+        'pairs_compared': len(candidate_pairs),
+        'seconds': round(time.perf_counter() - start, 3),
+        'groups': [{'students': [students[student_id] for student_id in group['students']], 'pairs': group['pairs']}
+                   for group in groups],
+    }
+
+
+def _connected(pairs):
+    """Group matched pairs into sets of students that match each other transitively, biggest first"""
+    parent = {}
+
+    def root(student_id):
+        parent.setdefault(student_id, student_id)
+        while parent[student_id] != student_id:
+            parent[student_id] = parent[parent[student_id]]
+            student_id = parent[student_id]
+        return student_id
+
+    for a, b, _, _ in pairs:
+        parent[root(a)] = root(b)
+    groups = {}
+    for pair in pairs:
+        group = groups.setdefault(root(pair[0]), {'students': set(), 'pairs': []})
+        group['students'].update(pair[:2])
+        group['pairs'].append(pair)
+    return sorted(({'students': sorted(group['students']), 'pairs': group['pairs']} for group in groups.values()),
+                  key=lambda group: (-len(group['students']), group['students']))
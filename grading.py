@@ -0,0 +1,63 @@
+# grading.py
+"""Grade points and the per-student statistics shared by the routes and batch jobs"""
+from collections import Counter
+
+from records import columns, has_column
+
+# Grade to points mapping
+GRADE_TO_POINTS = {
+    'A': 4.0, 'A-': 3.7, 'B+': 3.3, 'B': 3.0, 'B-': 2.7,
+    'C+': 2.3, 'C': 2.0, 'C-': 1.7, 'D+': 1.3, 'D': 1.0, 'F': 0.0
+}
+
+# Grades that do not count as a pass
+FAILING_GRADES = ('F', 'D')
+
+
+def grade_columns(results):
+    """(grades, credits, points) columns of a list of result rows.
+
+    Points are the stored grade_points, looked up from the grade for rows
+    archived before that column existed.
+    """
+    if has_column(results, 'grade_points'):
+        grades, credits, stored = columns(results, 'grade', 'credits', 'grade_points')
+        points = [GRADE_TO_POINTS.get(grade) if p is None else p for grade, p in zip(grades, stored)]
+    else:
+        grades, credits = columns(results, 'grade', 'credits')
+        points = [GRADE_TO_POINTS.get(grade) for grade in grades]
+    return grades, credits, points
+
+
+def gpa_from_totals(weighted_points, total_credits):
+    """GPA from the sum of points times credits and the sum of credits of the graded results"""
+    return round(weighted_points / total_credits, 2) if total_credits > 0 else 0.0
+
+
+def _gpa(credits, points):
+    weighted = [(p, c or 0) for p, c in zip(points, credits) if p is not None]
+    return gpa_from_totals(sum(p * c for p, c in weighted), sum(c for _, c in weighted))
+
+
+# Helper function to calculate GPA
+def calculate_gpa(results):
+    if not results:
+        return 0.0
+    _, credits, points = grade_columns(results)
+    return _gpa(credits, points)
+
+
+def summarize_results(results):
+    """GPA, credits and grade breakdown for one student's results"""
+    grades, credits, points = grade_columns(results)
+    # Highest and lowest by points; the first of equals wins, as max() and min() do
+    ranked = [p or 0 for p in points]
+    return {
+        'gpa': _gpa(credits, points) if results else 0.0,
+        'total_credits': sum(c or 0 for c in credits),
+        'total_subjects': len(results),
+        'passed_subjects': sum(1 for grade in grades if grade not in FAILING_GRADES),
+        'highest_grade': grades[max(range(len(grades)), key=ranked.__getitem__)] if results else 'N/A',
+        'lowest_grade': grades[min(range(len(grades)), key=ranked.__getitem__)] if results else 'N/A',
+        'grade_distribution': dict(Counter(grades)),
+    }
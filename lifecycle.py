@@ -0,0 +1,155 @@
+# lifecycle.py
+"""Bulk student lifecycle: year-end rollover, deactivation and deletion.
+
+Every operation picks its students with one set-based query and writes them
+in chunks of chunk_size ids (SQLite limits the number of bound parameters),
+logging each row to change_log, all in the caller's transaction: the route
+or CLI command commits once at the end or rolls the whole operation back.
+With dry_run=True nothing is written and the returned summary says what
+would happen.
+
+At rollover, students in a program named "Grade N" move to "Grade N+1" and
+the next year; students in the final grade are marked Graduated and keep
+their program and year. Programs without a grade number are left alone.
+"""
+import re
+
+from changelog import record_changes
+from database import delete_students
+
+STUDENT_STATUSES = ['Active', 'Inactive', 'Graduated']
+
+FINAL_GRADE = 12
+
+GRADE_PROGRAM = re.compile(r'Grade (\d+)')
+
+
+class LifecycleError(Exception):
+    pass
+
+
+def student_filter(program=None, year=None, status=None):
+    """WHERE clause and params matching students by program, year and status; empty values match all"""
+    clauses = []
+    params = []
+    for column, value in (('program', program), ('year', year), ('status', status)):
+        if value not in (None, ''):
+            clauses.append(f'{column} = ?')
+            params.append(value)
+    return ' AND '.join(clauses) or '1=1', params
+
+
+def select_students(conn, program=None, year=None, status=None):
+    where, params = student_filter(program, year, status)
+    return [row[0] for row in conn.execute(f'SELECT student_id FROM students WHERE {where} ORDER BY student_id',
+                                           params).fetchall()]
+
+
+def update_students(conn, student_ids, assignments, values, changed_by=None, chunk_size=500):
+    """UPDATE students SET <assignments> for many students, chunk by chunk. Returns the number updated."""
+    updated = 0
+    for start in range(0, len(student_ids), chunk_size):
+        chunk = student_ids[start:start + chunk_size]
+        placeholders = ', '.join('?' * len(chunk))
+        old = {row['student_id']: row for row in
+               conn.execute(f'SELECT * FROM students WHERE student_id IN ({placeholders})', chunk).fetchall()}
+        new = conn.execute(f'''
+            UPDATE students SET {assignments}
+            WHERE student_id IN ({placeholders})
+            RETURNING *
+        ''', list(values) + chunk).fetchall()
+        record_changes(conn, [('students', row['student_id'], 'update', old[row['student_id']], row) for row in new],
+                       changed_by)
+        updated += len(new)
+    return updated
+
+
+def promotion(program, final_grade=FINAL_GRADE):
+    """('promote', next program), ('graduate', program) or ('skip', program) for a program at rollover"""
+    match = GRADE_PROGRAM.fullmatch((program or '').strip())
+    if match is None:
+        return 'skip', program
+    grade = int(match.group(1))
+    if grade >= final_grade:
+        return 'graduate', program
+    return 'promote', f'Grade {grade + 1}'
+
+
+def _grade_order(program):
+    match = GRADE_PROGRAM.fullmatch((program or '').strip())
+    return (0, int(match.group(1)), '') if match else (1, 0, program or '')
+
+
+def rollover_plan(conn, academic_year, final_grade=FINAL_GRADE):
+    """One step per program of the year's active students, lowest grade first"""
+    rows = conn.execute('''
+        SELECT program, COUNT(*) AS students FROM students
+        WHERE status = 'Active' AND year = ?
+        GROUP BY program
+    ''', (academic_year,)).fetchall()
+    steps = []
+    for row in rows:
+        action, to_program = promotion(row['program'], final_grade)
+        steps.append({'program': row['program'], 'students': row['students'], 'action': action,
+                      'to_program': to_program})
+    steps.sort(key=lambda step: _grade_order(step['program']))
+    return steps
+
+
+def rollover(conn, academic_year, changed_by=None, final_grade=FINAL_GRADE, dry_run=False, chunk_size=500):
+    """Close academic_year: promote its active students one grade and graduate the final grade"""
+    academic_year = int(academic_year)
+    steps = rollover_plan(conn, academic_year, final_grade)
+    if not steps:
+        raise LifecycleError(f'No active students in {academic_year}.')
+    if not dry_run:
+        for step in steps:
+            if step['action'] == 'skip':
+                continue
+            student_ids = select_students(conn, step['program'], academic_year, 'Active')
+            if step['action'] == 'promote':
+                update_students(conn, student_ids, 'program = ?, year = ?', (step['to_program'], academic_year + 1),
+                                changed_by, chunk_size)
+            else:
+                update_students(conn, student_ids, 'status = ?', ('Graduated',), changed_by, chunk_size)
+
+    def total(action):
+        return sum(step['students'] for step in steps if step['action'] == action)
+
+    return {'operation': 'rollover', 'academic_year': academic_year, 'next_year': academic_year + 1,
+            'steps': steps, 'promoted': total('promote'), 'graduated': total('graduate'),
+            'skipped': total('skip'), 'dry_run': dry_run}
+
+
+def set_status(conn, status, program=None, year=None, current_status=None, changed_by=None, dry_run=False,
+               chunk_size=500):
+    """Move the matching students to status, e.g. deactivate a whole class"""
+    if status not in STUDENT_STATUSES:
+        raise LifecycleError(f'Unknown student status: {status}')
+    where, params = student_filter(program, year, current_status)
+    student_ids = [row[0] for row in conn.execute(f'''
+        SELECT student_id FROM students WHERE {where} AND status <> ? ORDER BY student_id
+    ''', params + [status]).fetchall()]
+    if not student_ids:
+        raise LifecycleError(f'No matching students that are not {status} already.')
+    if not dry_run:
+        update_students(conn, student_ids, 'status = ?', (status,), changed_by, chunk_size)
+    return {'operation': 'set_status', 'status': status, 'students': len(student_ids), 'sample': student_ids[:20],
+            'dry_run': dry_run}
+
+
+def delete_graduates(conn, program=None, year=None, changed_by=None, dry_run=False, chunk_size=500):
+    """Delete graduated students with their results, documents and user accounts"""
+    where, params = student_filter(program, year, 'Graduated')
+    student_ids = select_students(conn, program, year, 'Graduated')
+    if not student_ids:
+        raise LifecycleError('No graduated students match.')
+    counts = conn.execute(f'''
+        SELECT (SELECT COUNT(*) FROM results WHERE student_id IN (SELECT student_id FROM students WHERE {where})),
+               (SELECT COUNT(*) FROM documents WHERE student_id IN (SELECT student_id FROM students WHERE {where})),
+               (SELECT COUNT(*) FROM users WHERE username IN (SELECT student_id FROM students WHERE {where}))
+    ''', params * 3).fetchone()
+    if not dry_run:
+        delete_students(conn, student_ids, changed_by, chunk_size)
+    return {'operation': 'delete_graduates', 'students': len(student_ids), 'results': counts[0],
+            'documents': counts[1], 'users': counts[2], 'sample': student_ids[:20], 'dry_run': dry_run}
@@ -0,0 +1,190 @@
+# media.py
+"""Post-upload image and PDF pipeline.
+
+After an upload is committed, process_document() runs on a small background
+pool:
+
+* JPEG/PNG photos are rotated upright, stripped of EXIF/GPS metadata and, when
+  larger than MAX_DIMENSION, scaled down and re-encoded in place.
+* A small thumbnail and a larger preview are written to the derivatives
+  folder, from the image itself or from the first page of a PDF.
+
+Derivatives are named after the SHA-256 of the stored file, so identical
+uploads share them and a file is never rendered twice. The document_derivatives
+table maps each document to its hash and files.
+
+Images need Pillow and PDF pages need pypdfium2. When a library is missing,
+that step is skipped and review pages fall back to the plain download.
+"""
+import hashlib
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = {'jpg', 'jpeg', 'png'}
+PDF_EXTENSIONS = {'pdf'}
+
+# Longest side of a stored photo; larger phone photos are scaled down
+MAX_DIMENSION = 2400
+JPEG_QUALITY = 85
+
+# Longest side of each derivative
+DERIVATIVE_SIZES = {'thumbnail': 240, 'preview': 1200}
+
+_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='media')
+
+
+def _pillow():
+    try:
+        from PIL import Image, ImageOps, features
+    except ImportError:
+        return None
+    return Image, ImageOps, features
+
+
+def _pdfium():
+    try:
+        import pypdfium2
+    except ImportError:
+        return None
+    return pypdfium2
+
+
+def extension(path):
+    return path.rsplit('.', 1)[1].lower() if '.' in os.path.basename(path) else ''
+
+
+def supports(path):
+    ext = extension(path)
+    if ext in IMAGE_EXTENSIONS:
+        return _pillow() is not None
+    if ext in PDF_EXTENSIONS:
+        return _pillow() is not None and _pdfium() is not None
+    return False
+
+
+def file_hash(path, chunk_size=64 * 1024):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def derivative_format():
+    """WebP when Pillow was built with it, JPEG otherwise. Returns (Pillow format, file extension)."""
+    _, _, features = _pillow()
+    return ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def optimize_image(path):
+    """Rotate upright, drop EXIF/XMP metadata and downscale oversized photos, rewriting the file in place.
+
+    Returns True when the file was rewritten.
+    """
+    Image, ImageOps, _ = _pillow()
+    with Image.open(path) as original:
+        image_format = original.format
+        icc_profile = original.info.get('icc_profile')
+        has_metadata = bool(original.info.get('exif') or original.getexif() or original.info.get('xmp'))
+        oversized = max(original.size) > MAX_DIMENSION
+        if not (has_metadata or oversized) or image_format not in ('JPEG', 'PNG'):
+            return False
+        image = ImageOps.exif_transpose(original)
+        if oversized:
+            image.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+
+        tmp_path = path + '.tmp'
+        # The colour profile is kept; EXIF (camera, GPS) and XMP are not written back
+        if image_format == 'JPEG':
+            image.convert('RGB').save(tmp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True,
+                                      icc_profile=icc_profile)
+        else:
+            image.save(tmp_path, 'PNG', optimize=True, icc_profile=icc_profile)
+    os.replace(tmp_path, path)
+    return True
+
+
+def _open_source(path):
+    """The image to derive from: the file itself, or the first page of a PDF"""
+    Image, ImageOps, _ = _pillow()
+    if extension(path) in PDF_EXTENSIONS:
+        pdf = _pdfium().PdfDocument(path)
+        try:
+            page = pdf[0]
+            # Render at roughly the preview width rather than full print resolution
+            scale = DERIVATIVE_SIZES['preview'] / max(page.get_width(), page.get_height())
+            return page.render(scale=max(scale, 0.1)).to_pil()
+        finally:
+            pdf.close()
+    image = Image.open(path)
+    image.load()
+    return ImageOps.exif_transpose(image)
+
+
+def build_derivatives(path, folder):
+    """Write the thumbnail and preview of a file, reusing them if they exist. Returns {'content_hash', kind: path}."""
+    content_hash = file_hash(path)
+    pil_format, ext = derivative_format()
+    targets = {kind: os.path.join(folder, f'{content_hash}_{kind}.{ext}') for kind in DERIVATIVE_SIZES}
+    missing = [kind for kind, target in targets.items() if not os.path.exists(target)]
+
+    if missing:
+        os.makedirs(folder, exist_ok=True)
+        source = _open_source(path)
+        try:
+            if source.mode not in ('RGB', 'RGBA'):
+                source = source.convert('RGBA' if 'A' in source.getbands() else 'RGB')
+            if pil_format == 'JPEG' and source.mode == 'RGBA':
+                source = source.convert('RGB')
+            for kind in missing:
+                size = DERIVATIVE_SIZES[kind]
+                image = source.copy()
+                image.thumbnail((size, size))
+                tmp_path = targets[kind] + '.tmp'
+                image.save(tmp_path, pil_format, quality=80)
+                os.replace(tmp_path, targets[kind])
+        finally:
+            source.close()
+
+    return dict(targets, content_hash=content_hash)
+
+
+def process_document(connect, doc_id, path, folder):
+    """Optimize an uploaded file and record its derivatives. connect() opens a database connection."""
+    if not supports(path):
+        return None
+    if extension(path) in IMAGE_EXTENSIONS:
+        optimize_image(path)
+    derivatives = build_derivatives(path, folder)
+
+    conn = connect()
+    try:
+        conn.execute('''
+            INSERT INTO document_derivatives (doc_id, content_hash, thumbnail_path, preview_path, size_bytes)
+            VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT (doc_id) DO UPDATE SET content_hash = excluded.content_hash,
+                thumbnail_path = excluded.thumbnail_path, preview_path = excluded.preview_path,
+                size_bytes = excluded.size_bytes
+        ''', (doc_id, derivatives['content_hash'], derivatives['thumbnail'], derivatives['preview'],
+              os.path.getsize(path)))
+        conn.commit()
+    finally:
+        conn.close()
+    return derivatives
+
+
+def _run(connect, doc_id, path, folder):
+    try:
+        process_document(connect, doc_id, path, folder)
+    except Exception as e:
+        # Usually a file that is not really an image/PDF despite its extension
+        log.warning('Could not build previews for document %s (%s): %s', doc_id, path, e)
+
+
+def process_in_background(connect, doc_id, path, folder):
+    """Queue process_document() so the upload response does not wait for it"""
+    if supports(path):
+        _pool.submit(_run, connect, doc_id, path, folder)
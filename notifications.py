@@ -0,0 +1,221 @@
+# notifications.py
+"""Notification outbox for students, delivered in digests by a background dispatcher.
+
+Routes never talk to a mail server. A change a student should hear about (a
+document reviewed, a query answered) adds a row to notifications with
+notify(), on the same connection and in the same transaction as the change,
+so a notice exists exactly when the change was committed and is never sent
+for one that was rolled back.
+
+A Dispatcher thread per school wakes every `interval` seconds, claims the
+notifications that are due and sends each student one digest of everything
+pending for them through a transport. A delivered batch is marked sent; a
+failed one is retried after a backoff that doubles with each attempt, and
+given up on (status failed) after max_attempts. Claiming moves rows to
+sending with next_attempt_at pushed out by CLAIM_SECONDS, so two dispatchers
+never send the same row, and rows claimed by a process that died are picked
+up again once that time has passed. Several workers can therefore each run a
+dispatcher, or flask send-notifications can run from cron instead.
+
+A transport is anything with send(recipient, subject, body). NOTIFY_TRANSPORT
+picks one:
+
+* file:<path> - append each digest to <path> as a JSON line (the default).
+* smtp://host:port - hand digests to an SMTP server, such as a local stand-in
+  started with python -m aiosmtpd -n -l localhost:1025.
+"""
+import json
+import logging
+import smtplib
+import threading
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+from urllib.parse import urlparse
+
+log = logging.getLogger(__name__)
+
+# Seconds a claimed batch is reserved for the dispatcher that claimed it
+CLAIM_SECONDS = 300
+TIMESTAMP_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def timestamp(delay=0):
+    """UTC 'YYYY-MM-DD HH:MM:SS', the format CURRENT_TIMESTAMP stores, delay seconds from now"""
+    return (datetime.now(timezone.utc) + timedelta(seconds=delay)).strftime(TIMESTAMP_FORMAT)
+
+
+def notify(conn, student_id, kind, subject, body):
+    """Queue a notification in the caller's transaction"""
+    notify_many(conn, [(student_id, kind, subject, body)])
+
+
+def notify_many(conn, notices):
+    """Queue (student_id, kind, subject, body) notifications with one executemany"""
+    due = timestamp()
+    conn.executemany('''
+        INSERT INTO notifications (student_id, email, kind, subject, body, next_attempt_at)
+        SELECT ?, (SELECT email FROM students WHERE student_id = ?), ?, ?, ?, ?
+    ''', [(student_id, student_id, kind, subject, body, due) for student_id, kind, subject, body in notices])
+
+
+def outbox_counts(conn):
+    return {row['status']: row['count'] for row in
+            conn.execute('SELECT status, COUNT(*) AS count FROM notifications GROUP BY status').fetchall()}
+
+
+class FileTransport:
+    """Appends every digest to a file as one JSON line"""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def send(self, recipient, subject, body):
+        line = json.dumps({'to': recipient, 'subject': subject, 'body': body, 'sent_at': timestamp()})
+        with self._lock, open(self.path, 'a') as f:
+            f.write(line + '\n')
+
+
+class SMTPTransport:
+    def __init__(self, host, port=25, sender='results@localhost', timeout=10):
+        self.host = host
+        self.port = port
+        self.sender = sender
+        self.timeout = timeout
+
+    def send(self, recipient, subject, body):
+        message = EmailMessage()
+        message['From'] = self.sender
+        message['To'] = recipient
+        message['Subject'] = subject
+        message.set_content(body)
+        with smtplib.SMTP(self.host, self.port, timeout=self.timeout) as smtp:
+            smtp.send_message(message)
+
+
+def create_transport(url, sender='results@localhost'):
+    if url.startswith('file:'):
+        return FileTransport(url[len('file:'):])
+    parsed = urlparse(url)
+    if parsed.scheme == 'smtp':
+        return SMTPTransport(parsed.hostname or 'localhost', parsed.port or 25, sender)
+    raise ValueError(f'Unknown notification transport {url!r}: use file:<path> or smtp://host:port')
+
+
+def digest(notices):
+    """(subject, body) of one message covering every notice for a student"""
+    if len(notices) == 1:
+        return notices[0]['subject'], notices[0]['body']
+    body = '\n\n'.join(f"{notice['subject']}\n{notice['body']}" for notice in notices)
+    return f'{len(notices)} updates on your student account', body
+
+
+class Dispatcher:
+    """Sends due notifications as one digest per student, with retries and backoff"""
+
+    def __init__(self, connect, transport, interval=30, batch_size=500, max_attempts=5, backoff=60,
+                 max_backoff=3600):
+        self.connect = connect
+        self.transport = transport
+        self.interval = interval
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='notifications', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        # Waiting first lets a pass collect everything changed since the last one into one digest
+        while not self._stop.wait(self.interval):
+            try:
+                self.dispatch()
+            except Exception:
+                log.exception('Sending notifications failed')
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def claim(self, conn):
+        """Reserve up to batch_size due notifications for this dispatcher"""
+        now = timestamp()
+        # Most passes find nothing due; they stay readers and never take SQLite's write lock
+        due = conn.execute('''
+            SELECT 1 FROM notifications WHERE status IN ('pending', 'sending') AND next_attempt_at <= ? LIMIT 1
+        ''', (now,)).fetchone()
+        conn.commit()
+        if due is None:
+            return []
+        rows = conn.execute('''
+            UPDATE notifications SET status = 'sending', next_attempt_at = ?
+            WHERE id IN (
+                SELECT id FROM notifications
+                WHERE status IN ('pending', 'sending') AND next_attempt_at <= ?
+                ORDER BY id
+                LIMIT ?
+            ) AND status IN ('pending', 'sending') AND next_attempt_at <= ?
+            RETURNING *
+        ''', (timestamp(CLAIM_SECONDS), now, self.batch_size, now)).fetchall()
+        conn.commit()
+        return sorted(rows, key=lambda row: row['id'])
+
+    def dispatch(self):
+        """Send everything due. Returns {'sent': n, 'retry': n, 'failed': n} counted in notifications."""
+        totals = {'sent': 0, 'retry': 0, 'failed': 0}
+        conn = self.connect()
+        try:
+            while True:
+                rows = self.claim(conn)
+                if not rows:
+                    return totals
+                by_student = {}
+                for row in rows:
+                    by_student.setdefault(row['student_id'], []).append(row)
+                for notices in by_student.values():
+                    outcome = self._send(conn, notices)
+                    totals[outcome] += len(notices)
+                if len(rows) < self.batch_size:
+                    return totals
+        finally:
+            conn.close()
+
+    def _send(self, conn, notices):
+        ids = [notice['id'] for notice in notices]
+        placeholders = ', '.join('?' * len(ids))
+        email = notices[-1]['email']
+        error = None
+        if not email:
+            error = 'No email address on file'
+        else:
+            try:
+                self.transport.send(email, *digest(notices))
+            except Exception as e:
+                error = f'{type(e).__name__}: {e}'
+        if error is None:
+            conn.execute(f'''
+                UPDATE notifications SET status = 'sent', attempts = attempts + 1, sent_at = ?, last_error = NULL
+                WHERE id IN ({placeholders})
+            ''', [timestamp()] + ids)
+            outcome = 'sent'
+        else:
+            attempts = max(notice['attempts'] for notice in notices) + 1
+            if not email or attempts >= self.max_attempts:
+                status, due, outcome = 'failed', timestamp(), 'failed'
+            else:
+                delay = min(self.backoff * 2 ** (attempts - 1), self.max_backoff)
+                status, due, outcome = 'pending', timestamp(delay), 'retry'
+                log.warning('Notifications %s not delivered (attempt %s), retrying in %ss: %s', ids, attempts,
+                            delay, error)
+            conn.execute(f'''
+                UPDATE notifications SET status = ?, attempts = attempts + 1, next_attempt_at = ?, last_error = ?
+                WHERE id IN ({placeholders})
+            ''', [status, due, error] + ids)
+        conn.commit()
+        return outcome
@@ -0,0 +1,266 @@
+# profiler.py
+"""Sampling profiler for production requests, aggregated per endpoint.
+
+Requests are picked for profiling by endpoint (PROFILE_ROUTES) or at random
+(PROFILE_SAMPLE_RATE, a fraction of all requests). A picked request registers
+its thread; one background thread wakes every `interval` seconds, reads the
+current stack of each registered thread from sys._current_frames() and counts
+it under the request's endpoint. Nothing is traced, so a profiled request
+runs at full speed and requests that are not picked cost one dict lookup.
+
+Stacks are kept as counts of identical stacks, which is all a flame graph
+needs: tree() turns them into nested nodes for the admin page, collapsed()
+into the folded "a;b;c count" lines flamegraph.pl reads, and speedscope()
+into a speedscope.app file.
+
+With tracemalloc on, each profiled request records how far traced memory
+grew, and at most every `snapshot_interval` seconds per endpoint a snapshot
+is taken at the end of a request and its top allocation sites kept. Tracing
+allocations slows the whole process, so it is off unless asked for.
+
+Profiles are per process; with several workers each has its own.
+"""
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+
+# Distinct stacks kept per endpoint; rarer ones beyond this are counted as '[other]'
+MAX_STACKS = 5000
+MAX_DEPTH = 128
+# Allocation sites kept from each snapshot
+SNAPSHOT_TOP = 25
+
+
+def frame_name(code):
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+def stack_of(frame):
+    """Names of the frames of a stack, outermost first"""
+    names = []
+    while frame is not None and len(names) < MAX_DEPTH:
+        names.append(frame_name(frame.f_code))
+        frame = frame.f_back
+    names.reverse()
+    return tuple(names)
+
+
+class EndpointProfile:
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.stacks = Counter()
+        self.samples = 0
+        self.requests = 0
+        self.seconds = 0.0
+        self.memory_growth = 0
+        self.memory_peak = 0
+        self.snapshot = None
+        self.snapshot_at = 0.0
+
+    def add(self, stack):
+        self.samples += 1
+        if stack in self.stacks or len(self.stacks) < MAX_STACKS:
+            self.stacks[stack] += 1
+        else:
+            self.stacks[('[other]',)] += 1
+
+    def summary(self):
+        return {'endpoint': self.endpoint, 'samples': self.samples, 'requests': self.requests,
+                'avg_ms': round(self.seconds * 1000 / self.requests, 1) if self.requests else None,
+                'avg_memory_kb': round(self.memory_growth / 1024 / self.requests, 1) if self.requests else None,
+                'peak_memory_kb': round(self.memory_peak / 1024, 1), 'stacks': len(self.stacks)}
+
+
+class Profiler:
+    def __init__(self, routes=(), sample_rate=0.0, interval=0.005, trace_memory=False, snapshot_interval=60):
+        self.routes = set(routes)
+        self.sample_rate = sample_rate
+        self.interval = interval
+        self.trace_memory = trace_memory
+        self.snapshot_interval = snapshot_interval
+        self.profiles = {}
+        self._active = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    @property
+    def enabled(self):
+        return bool(self.routes) or self.sample_rate > 0
+
+    def configure(self, routes=None, sample_rate=None, interval=None, trace_memory=None):
+        if routes is not None:
+            self.routes = set(routes)
+        if sample_rate is not None:
+            self.sample_rate = min(1.0, max(0.0, sample_rate))
+        if interval is not None:
+            self.interval = max(0.001, interval)
+        if trace_memory is not None:
+            self.trace_memory = trace_memory
+            if not trace_memory and tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def wants(self, endpoint):
+        """Whether to profile a request to endpoint"""
+        if endpoint in self.routes:
+            return True
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def start(self, endpoint):
+        """Profile the current thread until finish(token). Returns the token."""
+        if self.trace_memory and not tracemalloc.is_tracing():
+            tracemalloc.start(MAX_DEPTH // 4)
+        ident = threading.get_ident()
+        memory = tracemalloc.get_traced_memory()[0] if self.trace_memory else None
+        with self._lock:
+            self._active[ident] = endpoint
+            self._ensure_thread()
+        self._wake.set()
+        return ident, endpoint, time.perf_counter(), memory
+
+    def finish(self, token):
+        ident, endpoint, started, memory = token
+        elapsed = time.perf_counter() - started
+        growth = None
+        if memory is not None and tracemalloc.is_tracing():
+            # Process-wide, so concurrent requests add to each other's figure
+            growth = tracemalloc.get_traced_memory()[0] - memory
+        with self._lock:
+            self._active.pop(ident, None)
+            profile = self._profile(endpoint)
+            profile.requests += 1
+            profile.seconds += elapsed
+            if growth is not None:
+                profile.memory_growth += max(growth, 0)
+                profile.memory_peak = max(profile.memory_peak, growth)
+            take_snapshot = (growth is not None and
+                             time.monotonic() - profile.snapshot_at >= self.snapshot_interval)
+            if take_snapshot:
+                profile.snapshot_at = time.monotonic()
+        if take_snapshot:
+            self._snapshot(profile)
+
+    def _profile(self, endpoint):
+        profile = self.profiles.get(endpoint)
+        if profile is None:
+            profile = self.profiles[endpoint] = EndpointProfile(endpoint)
+        return profile
+
+    def _snapshot(self, profile):
+        snapshot = tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+        ])
+        top = [{'site': f'{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}',
+                'file': stat.traceback[0].filename, 'kb': round(stat.size / 1024, 1), 'count': stat.count}
+               for stat in snapshot.statistics('lineno')[:SNAPSHOT_TOP]]
+        with self._lock:
+            profile.snapshot = {'taken_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'top': top}
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                idle = not self._active
+            if idle:
+                # Sleep until a profiled request starts
+                self._wake.wait()
+                self._wake.clear()
+                continue
+            time.sleep(self.interval)
+            self.sample()
+
+    def sample(self):
+        """Record the current stack of every profiled thread"""
+        with self._lock:
+            active = dict(self._active)
+        if not active:
+            return
+        frames = sys._current_frames()
+        stacks = [(endpoint, stack_of(frames[ident])) for ident, endpoint in active.items() if ident in frames]
+        with self._lock:
+            for endpoint, stack in stacks:
+                self._profile(endpoint).add(stack)
+
+    def reset(self, endpoint=None):
+        with self._lock:
+            if endpoint is None:
+                self.profiles.clear()
+            else:
+                self.profiles.pop(endpoint, None)
+
+    def summaries(self):
+        with self._lock:
+            return sorted((profile.summary() for profile in self.profiles.values()),
+                          key=lambda summary: summary['samples'], reverse=True)
+
+    def stacks(self, endpoint):
+        with self._lock:
+            profile = self.profiles.get(endpoint)
+            return Counter(profile.stacks) if profile else Counter()
+
+    def snapshot(self, endpoint):
+        with self._lock:
+            profile = self.profiles.get(endpoint)
+            return profile.snapshot if profile else None
+
+
+def tree(stacks, min_fraction=0.005):
+    """Flame graph nodes {'name', 'value', 'children'} from stack counts, dropping nodes under min_fraction"""
+    root = {'name': 'all', 'value': 0, 'children': {}}
+    for stack, count in stacks.items():
+        root['value'] += count
+        node = root
+        for name in stack:
+            child = node['children'].get(name)
+            if child is None:
+                child = node['children'][name] = {'name': name, 'value': 0, 'children': {}}
+            child['value'] += count
+            node = child
+    cutoff = root['value'] * min_fraction
+
+    def prune(node):
+        children = sorted((child for child in node['children'].values() if child['value'] >= cutoff),
+                          key=lambda child: child['value'], reverse=True)
+        return {'name': node['name'], 'value': node['value'], 'children': [prune(child) for child in children]}
+
+    return prune(root)
+
+
+def collapsed(stacks):
+    """Folded stacks, one 'outer;...;inner count' line each, as read by flamegraph.pl and speedscope"""
+    return ''.join(f"{';'.join(name.replace(';', ':') for name in stack)} {count}\n"
+                   for stack, count in sorted(stacks.items()))
+
+
+def speedscope(stacks, name, interval):
+    """A speedscope.app file (sampled profile, weights in milliseconds)"""
+    frames = []
+    index = {}
+    samples = []
+    weights = []
+    for stack, count in stacks.items():
+        sample = []
+        for frame in stack:
+            if frame not in index:
+                index[frame] = len(frames)
+                frames.append({'name': frame})
+            sample.append(index[frame])
+        samples.append(sample)
+        weights.append(round(count * interval * 1000, 3))
+    return {
+        '$schema': 'https://www.speedscope.app/file-format-schema.json',
+        'name': name,
+        'exporter': 'profiler.py',
+        'shared': {'frames': frames},
+        'profiles': [{'type': 'sampled', 'name': name, 'unit': 'milliseconds', 'startValue': 0,
+                      'endValue': round(sum(weights), 3), 'samples': samples, 'weights': weights}],
+    }
@@ -0,0 +1,186 @@
+# projections.py
+"""What-if GPAs: the GPA and class rank a student would have with hypothetical results.
+
+calculate_gpa() reads every result of one student. A projection for a whole
+cohort (a program and year, e.g. Grade 12 of 2024) would repeat that for
+each student, so instead one GROUP BY query reduces the cohort to two
+numbers per student, the sum of points times credits and the sum of credits
+of the graded results. A GPA is their ratio, and hypothetical results only
+add to both sums. The cohort is kept as parallel columns and each projection
+is one pass over them:
+
+* For one student, a hypothetical GPA and its rank among the others, whose
+  GPAs stay put: a binary search in the cohort's sorted GPAs. grade_table()
+  does this for every grade in GRADE_TO_POINTS at once.
+* For a cohort, every student's projected GPA, then all ranks again by one
+  sort, and each student's rank shift.
+
+Loading a grade of thousands still reads every one of their results, so
+CohortCache keeps recent cohorts and reuses one until change_log moves on:
+every write to students and results logs there in its own transaction.
+
+Hypothetical results count as additional results, as next term's would.
+Ranks are competition ranks, 1 for the highest GPA, equal GPAs sharing a rank.
+"""
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+
+from grading import GRADE_TO_POINTS, gpa_from_totals
+
+# Hypothetical results per projection, beyond which a request is not a what-if
+MAX_HYPOTHETICAL = 20
+
+# Cohorts kept by CohortCache, each a few lists as long as the cohort
+CACHED_COHORTS = 32
+
+
+def hypothetical_results(items):
+    """Validated hypothetical results from [{'course_code', 'grade', 'credits'}]; raises ValueError"""
+    if not isinstance(items, list):
+        raise ValueError('grades must be a list of {course_code, grade, credits}')
+    if len(items) > MAX_HYPOTHETICAL:
+        raise ValueError(f'At most {MAX_HYPOTHETICAL} hypothetical grades per projection')
+    results = []
+    for item in items:
+        if not isinstance(item, dict):
+            raise ValueError('grades must be a list of {course_code, grade, credits}')
+        grade = item.get('grade')
+        if grade not in GRADE_TO_POINTS:
+            raise ValueError(f"grade must be one of {', '.join(GRADE_TO_POINTS)}")
+        try:
+            credits = int(item.get('credits'))
+        except (TypeError, ValueError):
+            credits = 0
+        if credits <= 0:
+            raise ValueError('credits must be a positive whole number')
+        results.append({'course_code': str(item.get('course_code') or ''), 'grade': grade, 'credits': credits})
+    return results
+
+
+def totals(results):
+    """(sum of points times credits, sum of credits) of hypothetical results"""
+    return (sum(GRADE_TO_POINTS[result['grade']] * result['credits'] for result in results),
+            sum(result['credits'] for result in results))
+
+
+def ranks(gpas):
+    """Competition rank of each GPA among gpas, 1 for the highest"""
+    ordered = sorted(gpas)
+    return [1 + len(ordered) - bisect_right(ordered, gpa) for gpa in gpas]
+
+
+class Cohort:
+    """Weighted points and credits of every student in a program and year, as parallel columns"""
+
+    def __init__(self, program, year, student_ids, weighted, credits):
+        self.program = program
+        self.year = year
+        self.student_ids = student_ids
+        self.weighted = weighted
+        self.credits = credits
+        self.position = {student_id: i for i, student_id in enumerate(student_ids)}
+        self.gpas = [gpa_from_totals(w, c) for w, c in zip(weighted, credits)]
+        self.ranks = ranks(self.gpas)
+        self._sorted = sorted(self.gpas)
+
+    def __len__(self):
+        return len(self.student_ids)
+
+    def __contains__(self, student_id):
+        return student_id in self.position
+
+    def _rank_among_others(self, i, gpa):
+        # Students above gpa, not counting the student's own current GPA
+        above = len(self._sorted) - bisect_right(self._sorted, gpa) - (self.gpas[i] > gpa)
+        return 1 + above
+
+    def project_student(self, student_id, extra):
+        """The student's GPA and rank with extra (weighted points, credits) added, the others unchanged"""
+        i = self.position[student_id]
+        gpa = gpa_from_totals(self.weighted[i] + extra[0], self.credits[i] + extra[1])
+        rank = self._rank_among_others(i, gpa)
+        return {'student_id': student_id, 'gpa': self.gpas[i], 'rank': self.ranks[i],
+                'projected_gpa': gpa, 'projected_rank': rank, 'rank_shift': self.ranks[i] - rank}
+
+    def grade_table(self, student_id, results, index=0):
+        """[{'grade', 'projected_gpa', 'projected_rank', 'rank_shift'}] for results[index] at every grade"""
+        i = self.position[student_id]
+        others = results[:index] + results[index + 1:]
+        weighted, credits = totals(others)
+        weighted += self.weighted[i]
+        credits += self.credits[i] + results[index]['credits']
+        varied = results[index]['credits']
+        table = []
+        for grade, points in GRADE_TO_POINTS.items():
+            gpa = gpa_from_totals(weighted + points * varied, credits)
+            rank = self._rank_among_others(i, gpa)
+            table.append({'grade': grade, 'projected_gpa': gpa, 'projected_rank': rank,
+                          'rank_shift': self.ranks[i] - rank})
+        return table
+
+    def project(self, extras, default=(0, 0)):
+        """Every student's projected GPA and rank, best first.
+
+        extras maps student ids to the (weighted points, credits) their hypothetical results add;
+        students not in it get default.
+        """
+        added = [extras.get(student_id, default) for student_id in self.student_ids]
+        gpas = [gpa_from_totals(w + extra[0], c + extra[1]) for w, c, extra in zip(self.weighted, self.credits, added)]
+        projected_ranks = ranks(gpas)
+        # student_ids are in order, and the sort is stable: equal ranks stay by student id
+        order = sorted(range(len(gpas)), key=projected_ranks.__getitem__)
+        return [{'student_id': self.student_ids[i], 'gpa': self.gpas[i], 'rank': self.ranks[i],
+                 'projected_gpa': gpas[i], 'projected_rank': projected_ranks[i],
+                 'rank_shift': self.ranks[i] - projected_ranks[i]} for i in order]
+
+
+def load_cohort(conn, source, program, year):
+    """The Cohort of students in program and year, their results read from source (see results_source)"""
+    # Points as calculate_gpa() takes them: the stored grade_points, else looked up from the grade
+    whens = ' '.join('WHEN ? THEN ?' for _ in GRADE_TO_POINTS)
+    params = [value for item in GRADE_TO_POINTS.items() for value in item]
+    rows = conn.execute(f'''
+        SELECT s.student_id,
+               COALESCE(SUM(r.points * COALESCE(r.credits, 0)), 0) AS weighted,
+               COALESCE(SUM(COALESCE(r.credits, 0)), 0) AS credits
+        FROM students s
+        LEFT JOIN (SELECT student_id, credits, COALESCE(grade_points, CASE grade {whens} END) AS points
+                   FROM {source}) r ON r.student_id = s.student_id AND r.points IS NOT NULL
+        WHERE s.program = ? AND s.year = ?
+        GROUP BY s.student_id
+        ORDER BY s.student_id
+    ''', params + [program, year]).fetchall()
+    return Cohort(program, year, [row[0] for row in rows], [float(row[1]) for row in rows], [row[2] for row in rows])
+
+
+class CohortCache:
+    """Recently loaded cohorts, reused while the database is at the same change_log seq"""
+
+    def __init__(self, size=CACHED_COHORTS):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._cohorts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, conn, source, program, year, scope=None):
+        """The Cohort of program and year; scope tells apart the databases sharing the cache (schools)"""
+        # Read on the same connection as the cohort, so a replica's cohort goes with the replica's seq
+        version = conn.execute('SELECT MAX(seq) FROM change_log').fetchone()[0]
+        key = (scope, program, year)
+        with self._lock:
+            cached = self._cohorts.get(key)
+            if cached is not None and cached[0] == version:
+                self._cohorts.move_to_end(key)
+                self.hits += 1
+                return cached[1]
+        # Loaded after reading the version: a write in between makes the next request reload, never serve stale
+        cohort = load_cohort(conn, source, program, year)
+        with self._lock:
+            self.misses += 1
+            self._cohorts[key] = (version, cohort)
+            self._cohorts.move_to_end(key)
+            while len(self._cohorts) > self.size:
+                self._cohorts.popitem(last=False)
+        return cohort
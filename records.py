@@ -0,0 +1,126 @@
+# records.py
+"""Compact row objects for both backends.
+
+Every query row is a Record: a tuple subclass whose class knows the column
+names, so a row costs one tuple and nothing more (sqlite3.Row wraps a
+separate tuple in its own object). Columns read like sqlite3.Row, by
+position or name, and also as attributes through namedtuple-style
+properties. Templates reading ``row.full_name`` get the attribute at
+once; with sqlite3.Row Jinja first has to fail a getattr.
+
+There is one class per column list, created on first use and cached. When a
+query's columns start with a table's full column list (``SELECT *`` or
+``SELECT r.*, s.full_name``) the class derives from that table's typed
+record, so a results row is a Result and a students row is a Student.
+
+columns() pulls whole columns out of a list of rows by position, for the
+aggregations in grading.py and the routes.
+"""
+import functools
+import itertools
+
+try:
+    from _collections import _tuplegetter
+except ImportError:
+    import operator
+
+    def _tuplegetter(index, doc):
+        return property(operator.itemgetter(index), doc=doc)
+
+STUDENT_FIELDS = ('id', 'student_id', 'full_name', 'email', 'program', 'year', 'date_of_birth', 'phone_number',
+                  'address', 'created_at')
+RESULT_FIELDS = ('id', 'student_id', 'course_code', 'course_name', 'subject_level', 'grade', 'credits', 'semester',
+                 'academic_year', 'remark', 'created_at', 'updated_at')
+DOCUMENT_FIELDS = ('id', 'student_id', 'doc_name', 'doc_type', 'doc_path', 'upload_date', 'status', 'feedback',
+                   'reviewed_by', 'reviewed_at')
+
+
+class Record(tuple):
+    """Row readable by index, by column name and as attributes, like sqlite3.Row"""
+    __slots__ = ()
+    _fields = ()
+    _index = {}
+    _lower_index = {}
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            key = self._position(key)
+        return tuple.__getitem__(self, key)
+
+    @classmethod
+    def _position(cls, name):
+        index = cls._index.get(name)
+        # sqlite3.Row matches names case-insensitively
+        return cls._lower_index[name.lower()] if index is None else index
+
+    def keys(self):
+        return list(self._fields)
+
+    def __repr__(self):
+        return f'{type(self).__name__}({dict(zip(self._fields, self))!r})'
+
+
+def _record_type(name, base, fields, doc=None):
+    """A Record class for fields, adding properties for the columns base does not already have"""
+    namespace = {'__slots__': (), '_fields': fields, '__doc__': doc or base.__doc__}
+    namespace['_index'] = index = {}
+    namespace['_lower_index'] = lower_index = {}
+    for i, field in enumerate(fields):
+        # The first of two columns with the same name wins, as with sqlite3.Row
+        index.setdefault(field, i)
+        lower_index.setdefault(field.lower(), i)
+        if i < len(base._fields) or field in namespace or field.startswith('_') or field == 'keys':
+            continue
+        # Overrides tuple.count and tuple.index, so row.count is the column
+        namespace[field] = _tuplegetter(i, f'Column {i}: {field}')
+    return type(name, (base,), namespace)
+
+
+Student = _record_type('Student', Record, STUDENT_FIELDS, 'A row of students')
+Result = _record_type('Result', Record, RESULT_FIELDS, 'A row of results, or of an archived year')
+Document = _record_type('Document', Record, DOCUMENT_FIELDS, 'A row of documents')
+
+TYPED_RECORDS = (Student, Result, Document)
+
+
+@functools.lru_cache(maxsize=512)
+def record_class(fields):
+    """Record class of a query with these column names"""
+    for base in TYPED_RECORDS:
+        if fields[:len(base._fields)] == base._fields:
+            if len(fields) == len(base._fields):
+                return base
+            return _record_type(base.__name__, base, fields)
+    return _record_type('Record', Record, fields)
+
+
+# Class of the last cursor seen. A cursor keeps the same description object for
+# every row of a statement, so the class is looked up once per statement.
+_last = (None, None)
+
+
+def sqlite_row_factory(cursor, row):
+    global _last
+    description, cls = _last
+    if cursor.description is not description:
+        description = cursor.description
+        cls = record_class(tuple(column[0] for column in description))
+        _last = (description, cls)
+    return cls(row)
+
+
+def columns(rows, *names):
+    """Lists of the named columns' values, one list per name.
+
+    Rows of a single Record class are read by position straight from the
+    tuples; anything else row by row through row[name].
+    """
+    rows = rows if isinstance(rows, list) else list(rows)
+    if rows and isinstance(rows[0], Record) and len({row.__class__ for row in rows}) == 1:
+        positions = [rows[0]._position(name) for name in names]
+        return tuple(list(map(tuple.__getitem__, rows, itertools.repeat(i, len(rows)))) for i in positions)
+    return tuple([row[name] for row in rows] for name in names)
+
+
+def has_column(rows, name):
+    return bool(rows) and name in rows[0].keys()
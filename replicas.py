@@ -0,0 +1,284 @@
+# replicas.py
+"""Read replicas for the analytics, listing and export routes.
+
+The routes in app.py's REPLICA_ENDPOINTS read through a replica when one is
+fresh enough, so their long GROUP BY queries and table walks never hold a
+read lock on the database that add_result, edit_result and upload_document
+write to. Everything else, writes included, stays on the primary.
+
+SQLite: READ_REPLICAS local copies sit next to the database
+(results.db.replica1.<pid>, ...). Each starts as an online-backup copy of the
+primary (backup.copy_database) and is then kept current by replaying
+change_log: every change to students, results and documents is logged with
+the whole row, so applying the entries in seq order reproduces the primary's
+rows. courses and document_counts, which are not logged, are brought along
+with each batch, and so are the catalog entry and frozen aggregates of a
+year the log shows archived or restored. Replicas are in WAL mode, so replay
+never waits for a long read on the replica either. A copy is made again when
+the primary changed in a way the log does not describe: the database reset or
+restored from a backup (its log then ends before the replica's).
+
+Replicas are per process; with several workers each has its own copies,
+named after its pid so no two processes rebuild or replay into the same
+file. A worker deletes its copies when it shuts down.
+
+PostgreSQL: replication is the server's job (streaming hot standbys), and
+DATABASE_REPLICA_URLS lists the standbys. They are only tracked here: a
+standby has caught up once it shows the change_log seq the primary had.
+
+Staleness is bounded. caught_up_at is the wall-clock time at which a replica
+last held every change the primary had committed. pick() only hands out a
+replica caught up within max_lag seconds and no earlier than the caller's
+not_before, the time of the session's last write, so people always read
+their own writes.
+"""
+import itertools
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+from archive import FROZEN_TABLES
+from backup import copy_database
+from changelog import changes_since, latest_seq
+from database import PostgresBackend, refresh_document_counts
+from records import sqlite_row_factory
+
+log = logging.getLogger(__name__)
+
+# Tables change_log describes row by row
+REPLAYED_TABLES = ('students', 'results', 'documents')
+
+# Changes read from the primary per query
+BATCH_SIZE = 1000
+
+# The replica keeps the primary's change_log too, which is where its position is read from
+REPLAY_CHANGE = '''
+    INSERT INTO change_log (seq, table_name, row_id, action, changed_by, changed_at, old_data, new_data)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+
+class SQLiteReplica:
+    """Local read-only copy of a SQLite primary, kept current by replaying change_log"""
+
+    def __init__(self, primary, path):
+        self.primary = primary
+        self.path = path
+        self.name = os.path.basename(path)
+        self.applied_seq = 0
+        self.caught_up_at = 0.0
+        self.rebuilds = 0
+        self.error = None
+        self._writer = None
+        self._columns = {}
+
+    def connect(self):
+        conn = sqlite3.connect(f'file:{os.path.abspath(self.path)}?mode=ro', uri=True)
+        conn.row_factory = sqlite_row_factory
+        return conn
+
+    def rebuild(self):
+        """Copy the primary afresh, a few pages at a time so its writers keep going"""
+        partial = self.path + '.partial'
+        if os.path.exists(partial):
+            os.remove(partial)
+        copy_database(self.primary.path, partial)
+        if self._writer is None:
+            self._writer = sqlite3.connect(self.path, check_same_thread=False)
+            self._writer.execute('PRAGMA journal_mode=WAL')
+        source = sqlite3.connect(partial)
+        try:
+            # One step into the live replica: its readers see the old copy or the new one
+            source.backup(self._writer)
+        finally:
+            source.close()
+            os.remove(partial)
+        self._writer.execute('PRAGMA journal_mode=WAL')
+        self._columns = {table: [row[1] for row in self._writer.execute(f'PRAGMA table_info({table})')]
+                         for table in REPLAYED_TABLES}
+        self.applied_seq = latest_seq(self._writer)
+        self.rebuilds += 1
+
+    def catch_up(self):
+        """Apply the primary's new changes. Returns how many were applied."""
+        primary = self.primary.connect()
+        try:
+            if self._writer is None or latest_seq(primary) < self.applied_seq:
+                self.rebuild()
+            applied = 0
+            while True:
+                # Everything committed before this moment is in the batch or an earlier one
+                checked = time.time()
+                changes = changes_since(primary, self.applied_seq, BATCH_SIZE)
+                if changes:
+                    self._apply(primary, changes)
+                    applied += len(changes)
+                if len(changes) < BATCH_SIZE:
+                    self.caught_up_at = checked
+                    self.error = None
+                    return applied
+        finally:
+            primary.close()
+
+    def _apply(self, primary, changes):
+        conn = self._writer
+        documents_changed = False
+        archives_changed = set()
+        with conn:
+            for change in changes:
+                table = change['table_name']
+                if table == 'archived_years':
+                    archives_changed.add(change['row_id'])
+                elif change['action'] == 'delete':
+                    conn.execute(f'DELETE FROM {table} WHERE id = ?', (change['old_data']['id'],))
+                else:
+                    row = change['new_data']
+                    names = [name for name in self._columns[table] if name in row]
+                    conn.execute(f'INSERT OR REPLACE INTO {table} ({", ".join(names)}) '
+                                 f'VALUES ({", ".join("?" * len(names))})', [row[name] for name in names])
+                documents_changed = documents_changed or table == 'documents'
+                conn.execute(REPLAY_CHANGE, (change['seq'], table, change['row_id'], change['action'],
+                                             change['changed_by'], change['changed_at'],
+                                             json.dumps(change['old_data']) if change['old_data'] is not None else None,
+                                             json.dumps(change['new_data']) if change['new_data'] is not None else None))
+            # New course codes are added by course_id() outside the log
+            last_course = conn.execute('SELECT COALESCE(MAX(id), 0) FROM courses').fetchone()[0]
+            conn.executemany('INSERT OR REPLACE INTO courses (id, course_code, course_name, category) VALUES (?, ?, ?, ?)',
+                             primary.execute('SELECT id, course_code, course_name, category FROM courses WHERE id > ?',
+                                             (last_course,)).fetchall())
+            if documents_changed:
+                refresh_document_counts(conn)
+            # An archived or restored year: its catalog row and frozen aggregates as the primary has them now
+            for academic_year in archives_changed:
+                for table in ['archived_years'] + [f'archived_{name}' for name in FROZEN_TABLES]:
+                    conn.execute(f'DELETE FROM {table} WHERE academic_year = ?', (academic_year,))
+                    rows = primary.execute(f'SELECT * FROM {table} WHERE academic_year = ?', (academic_year,))
+                    names = [column[0] for column in rows.description]
+                    conn.executemany(f'INSERT INTO {table} ({", ".join(names)}) VALUES ({", ".join("?" * len(names))})',
+                                     [tuple(row) for row in rows.fetchall()])
+        self.applied_seq = changes[-1]['seq']
+
+    def close(self):
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        # The copy belongs to this process alone, so nobody else reads it
+        for path in (self.path, self.path + '-wal', self.path + '-shm'):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class PostgresReplica:
+    """A PostgreSQL hot standby, replicated by the server; only its position is tracked here"""
+
+    def __init__(self, primary, url, max_size=4):
+        self.primary = primary
+        self.backend = PostgresBackend(url, min_size=1, max_size=max_size)
+        self.name = url.rsplit('@', 1)[-1]
+        self.applied_seq = 0
+        self.caught_up_at = 0.0
+        self.rebuilds = 0
+        self.error = None
+
+    def connect(self):
+        return self.backend.connect()
+
+    def catch_up(self):
+        checked = time.time()
+        primary = self.primary.connect()
+        try:
+            head = latest_seq(primary)
+        finally:
+            primary.close()
+        replica = self.backend.connect()
+        try:
+            self.applied_seq = latest_seq(replica)
+        finally:
+            replica.close()
+        if self.applied_seq >= head:
+            self.caught_up_at = checked
+            self.error = None
+        return 0
+
+    def close(self):
+        self.backend.close()
+
+
+class ReplicaSet:
+    """Replicas of one database, caught up on a background thread and handed out while fresh"""
+
+    def __init__(self, replicas, max_lag=5.0, interval=0.5):
+        self.replicas = replicas
+        self.max_lag = max_lag
+        self.interval = interval
+        self.routed = 0
+        self.on_primary = 0
+        self._turn = itertools.count()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='replicas', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.is_set():
+            self.catch_up()
+            self._stop.wait(self.interval)
+
+    def catch_up(self):
+        for replica in self.replicas:
+            try:
+                replica.catch_up()
+            except Exception as e:
+                replica.error = f'{type(e).__name__}: {e}'
+                log.exception('Catching up replica %s failed', replica.name)
+
+    def pick(self, not_before=0.0):
+        """A replica holding every change up to not_before and at most max_lag seconds behind, or None"""
+        now = time.time()
+        fresh = [replica for replica in self.replicas
+                 if replica.caught_up_at >= not_before and now - replica.caught_up_at <= self.max_lag]
+        if not fresh:
+            self.on_primary += 1
+            return None
+        self.routed += 1
+        return fresh[next(self._turn) % len(fresh)]
+
+    def connect(self, not_before=0.0):
+        """A connection to a fresh replica, or None when the caller should read the primary"""
+        replica = self.pick(not_before)
+        return replica.connect() if replica is not None else None
+
+    def status(self):
+        now = time.time()
+        return {
+            'max_lag_seconds': self.max_lag,
+            'routed': self.routed,
+            'on_primary': self.on_primary,
+            'replicas': [{'name': replica.name, 'applied_seq': replica.applied_seq,
+                          'lag_seconds': round(now - replica.caught_up_at, 3) if replica.caught_up_at else None,
+                          'rebuilds': replica.rebuilds, 'error': replica.error} for replica in self.replicas],
+        }
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        for replica in self.replicas:
+            replica.close()
+
+
+def create_replicas(backend, copies=0, urls=(), max_lag=5.0, interval=0.5):
+    """A started ReplicaSet for a backend, or None when it has no replicas configured"""
+    if backend.name == 'sqlite':
+        replicas = [SQLiteReplica(backend, f'{backend.path}.replica{n}.{os.getpid()}') for n in range(1, copies + 1)]
+    else:
+        replicas = [PostgresReplica(backend, url) for url in urls]
+    if not replicas:
+        return None
+    return ReplicaSet(replicas, max_lag, interval).start()
@@ -0,0 +1,182 @@
+# report_cards.py
+"""Batch report-card generation.
+
+Splits the students of a program into chunks and renders one report card per
+learner on a multiprocessing pool. Every worker opens its own database
+connection and renders with templates/report_card.html. Cards are
+written to <output>/<date>/<program>/<student_id>.html (or .pdf), each through
+a temporary file, so a re-run after a failure skips the cards already written.
+
+    flask report-cards --program "Grade 12" --year 2023 --format pdf
+"""
+import os
+import re
+import time
+from datetime import datetime
+from multiprocessing import Pool
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+
+from archive import results_source
+from database import create_backend, iterate
+from grading import summarize_results
+
+# Per-process state set up by _init_worker
+_worker = {}
+
+
+def period_label(academic_year=None, semester=None):
+    if academic_year and semester:
+        return f'{semester}, Academic Year {academic_year}'
+    if academic_year:
+        return f'Academic Year {academic_year}'
+    if semester:
+        return f'{semester}, all academic years'
+    return 'Full academic transcript'
+
+
+def report_card_context(student, results, academic_year=None, semester=None):
+    return {
+        'student': student,
+        'results': results,
+        'summary': summarize_results(results),
+        'period': period_label(academic_year, semester),
+        'generated_at': datetime.now().strftime('%Y-%m-%d %H:%M'),
+    }
+
+
+def results_query(conn, student_ids, academic_year=None, semester=None):
+    """Results of several students in one statement, grouped by student"""
+    student_ids = list(student_ids)
+    source = results_source(conn, academic_year, student_ids)
+    query = f'SELECT * FROM {source} WHERE student_id IN ({", ".join("?" * len(student_ids))})'
+    params = list(student_ids)
+    if academic_year:
+        query += ' AND academic_year = ?'
+        params.append(academic_year)
+    if semester:
+        query += ' AND semester = ?'
+        params.append(semester)
+    query += ' ORDER BY student_id, academic_year DESC, semester DESC, course_code'
+    return query, params
+
+
+def _init_worker(database_url, database_path, template_folder, output_dir, fmt, academic_year, semester):
+    backend = create_backend(database_url, database_path)
+    env = Environment(loader=FileSystemLoader(template_folder), autoescape=select_autoescape(['html']))
+    _worker.update(
+        backend=backend,
+        conn=backend.connect(),
+        template=env.get_template('report_card.html'),
+        output_dir=output_dir,
+        fmt=fmt,
+        academic_year=academic_year,
+        semester=semester,
+    )
+
+
+def _write(path, html, fmt):
+    tmp_path = path + '.tmp'
+    if fmt == 'pdf':
+        from weasyprint import HTML
+        HTML(string=html).write_pdf(tmp_path)
+    else:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(html)
+    os.replace(tmp_path, path)
+
+
+def _render_chunk(student_ids):
+    """Render the cards for one chunk of students. Returns (written, [(student_id, error), ...])."""
+    conn = _worker['conn']
+    academic_year, semester = _worker['academic_year'], _worker['semester']
+
+    placeholders = ', '.join('?' * len(student_ids))
+    students = conn.execute(f'SELECT * FROM students WHERE student_id IN ({placeholders})', student_ids).fetchall()
+    query, params = results_query(conn, student_ids, academic_year, semester)
+    results_by_student = {}
+    for row in conn.execute(query, params).fetchall():
+        results_by_student.setdefault(row['student_id'], []).append(row)
+
+    written = 0
+    failures = []
+    for student in students:
+        try:
+            context = report_card_context(student, results_by_student.get(student['student_id'], []),
+                                          academic_year, semester)
+            html = _worker['template'].render(**context)
+            path = os.path.join(_worker['output_dir'], f"{student['student_id']}.{_worker['fmt']}")
+            _write(path, html, _worker['fmt'])
+            written += 1
+        except Exception as e:
+            failures.append((student['student_id'], f'{type(e).__name__}: {e}'))
+    return written, failures
+
+
+def _slug(value):
+    return re.sub(r'[^0-9A-Za-z]+', '_', value).strip('_') or 'all'
+
+
+def generate_report_cards(database_url, database_path, template_folder, output_root, program=None,
+                          academic_year=None, semester=None, fmt='html', workers=None, chunk_size=200,
+                          progress=print):
+    """Render report cards for every student in a program (or the whole school)"""
+    if fmt not in ('html', 'pdf'):
+        raise ValueError(f'Unknown report card format: {fmt}')
+    if fmt == 'pdf':
+        try:
+            import weasyprint  # noqa: F401
+        except ImportError:
+            raise RuntimeError('PDF report cards need WeasyPrint: pip install weasyprint')
+
+    output_dir = os.path.join(output_root, datetime.now().strftime('%Y-%m-%d'), _slug(program or 'all'))
+    os.makedirs(output_dir, exist_ok=True)
+    already_done = {name.rsplit('.', 1)[0] for name in os.listdir(output_dir) if name.endswith('.' + fmt)}
+
+    # Only the ids are read up front: Pool feeds tasks from a helper thread, which
+    # cannot share this process's SQLite connection
+    backend = create_backend(database_url, database_path)
+    conn = backend.connect()
+    where, params = ('WHERE program = ?', [program]) if program else ('', [])
+    try:
+        student_ids = [row['student_id'] for row in
+                       iterate(conn, f'SELECT student_id FROM students {where} ORDER BY student_id', params)]
+    finally:
+        conn.close()
+        backend.close()
+    total = len(student_ids)
+    pending = [student_id for student_id in student_ids if student_id not in already_done]
+    chunks = (pending[i:i + chunk_size] for i in range(0, len(pending), chunk_size))
+
+    skipped = total - len(pending)
+    done = skipped
+    failures = []
+    started = time.perf_counter()
+    if skipped:
+        progress(f'Resuming: {skipped} of {total} report cards already in {output_dir}')
+
+    initargs = (database_url, database_path, template_folder, output_dir, fmt, academic_year, semester)
+    with Pool(processes=workers, initializer=_init_worker, initargs=initargs) as pool:
+        for written, chunk_failures in pool.imap_unordered(_render_chunk, chunks):
+            done += written
+            failures.extend(chunk_failures)
+            elapsed = time.perf_counter() - started
+            rate = (done - skipped) / elapsed if elapsed else 0
+            progress(f'{done}/{total} report cards ({rate:.0f}/s, {len(failures)} failed)')
+
+    failure_log = os.path.join(output_dir, 'failures.log')
+    if failures:
+        with open(failure_log, 'w', encoding='utf-8') as f:
+            for student_id, error in failures:
+                f.write(f'{student_id}\t{error}\n')
+    elif os.path.exists(failure_log):
+        os.remove(failure_log)
+
+    return {
+        'output_dir': output_dir,
+        'total': total,
+        'written': done - skipped,
+        'skipped': skipped,
+        'failed': failures,
+        'seconds': round(time.perf_counter() - started, 2),
+    }
@@ -0,0 +1,46 @@
+// static/js/live.js
+// Live updates for the admin pages from the /admin/events Server-Sent Events stream.
+// Every event carries the current counters; elements marked data-live-count="<name>" are kept in sync.
+const Live = {
+    connect(url, handlers) {
+        if (!window.EventSource) {
+            return null;
+        }
+        const source = new EventSource(url);
+        ['documents', 'results', 'students'].forEach(event => {
+            source.addEventListener(event, message => {
+                const data = JSON.parse(message.data);
+                Live.setCounts(data.counts);
+                if (handlers[event]) {
+                    handlers[event](data);
+                }
+            });
+        });
+        return source;
+    },
+
+    setCounts(counts) {
+        Object.entries(counts || {}).forEach(([name, value]) => {
+            document.querySelectorAll(`[data-live-count="${name}"]`).forEach(element => {
+                element.textContent = value;
+            });
+        });
+    },
+
+    escape(value) {
+        const span = document.createElement('span');
+        span.textContent = value == null ? '' : value;
+        return span.innerHTML;
+    },
+
+    // Insert html at the top of container, keeping at most limit children
+    prepend(container, html, limit) {
+        if (!container) {
+            return;
+        }
+        container.insertAdjacentHTML('afterbegin', html);
+        while (limit && container.children.length > limit) {
+            container.lastElementChild.remove();
+        }
+    }
+};
@@ -0,0 +1,80 @@
+// static/js/service-worker.js
+// Offline support for the student pages. Served by /student/service-worker.js, which prepends
+// self.OFFLINE = {version, assets, pages, static}, so the worker's scope is /student/.
+//
+// Static files and the CDN assets are cached once per version and answered from the cache.
+// Pages and results.json always go to the network: the browser revalidates them with their
+// ETag, so a reload with nothing new costs the server a 304. The last good copy is kept and
+// served when the network is down.
+const CACHE = `student-${self.OFFLINE.version}`;
+
+self.addEventListener('install', event => {
+    event.waitUntil(
+        caches.open(CACHE)
+            .then(cache => Promise.all([
+                cache.addAll(self.OFFLINE.assets),
+                // Best effort: the student may be offline or signed out while installing
+                ...self.OFFLINE.pages.map(page => cache.add(page).catch(() => null)),
+            ]))
+            .then(() => self.skipWaiting())
+    );
+});
+
+self.addEventListener('activate', event => {
+    event.waitUntil(
+        caches.keys()
+            .then(names => Promise.all(
+                names.filter(name => name.startsWith('student-') && name !== CACHE).map(name => caches.delete(name))
+            ))
+            .then(() => self.clients.claim())
+    );
+});
+
+function isAsset(url) {
+    return self.OFFLINE.assets.includes(url.href) ||
+        (url.origin === self.location.origin && url.pathname.startsWith(self.OFFLINE.static));
+}
+
+async function cacheFirst(request) {
+    const cached = await caches.match(request);
+    if (cached) {
+        return cached;
+    }
+    const response = await fetch(request);
+    if (response.ok) {
+        const cache = await caches.open(CACHE);
+        cache.put(request, response.clone());
+    }
+    return response;
+}
+
+async function networkFirst(request) {
+    try {
+        const response = await fetch(request);
+        // Redirects (to the login page) and errors are not worth keeping
+        if (response.ok && !response.redirected) {
+            const cache = await caches.open(CACHE);
+            cache.put(request, response.clone());
+        }
+        return response;
+    } catch (error) {
+        const cached = await caches.match(request);
+        if (cached) {
+            return cached;
+        }
+        throw error;
+    }
+}
+
+self.addEventListener('fetch', event => {
+    const request = event.request;
+    if (request.method !== 'GET') {
+        return;
+    }
+    const url = new URL(request.url);
+    if (isAsset(url)) {
+        event.respondWith(cacheFirst(request));
+    } else if (url.origin === self.location.origin && url.pathname.startsWith(new URL(self.registration.scope).pathname)) {
+        event.respondWith(networkFirst(request));
+    }
+});
@@ -0,0 +1,203 @@
+# tenancy.py
+"""Multi-school tenancy: one database shard and one file store per school.
+
+A district runs one deployment for many schools. Each school gets its own
+SQLite file (or PostgreSQL database) and its own upload, archive and backup
+folders, so one school's writes never wait behind another's. Schools are
+listed in the JSON file named by TENANTS_FILE:
+
+    {"north-high": {"name": "North High", "hosts": ["north.example.org"]},
+     "south-high": {"name": "South High", "database_url": "postgresql://db/south"}}
+
+Any setting in TENANT_SETTINGS can be given in lower case; the rest default
+to paths under TENANTS_ROOT/<slug>/.
+
+A request belongs to the school whose host it was sent to, or to the school
+named by a /s/<slug>/ path prefix. Anything else goes to the district tenant,
+which uses the app's own configuration, so without a TENANTS_FILE the app is
+a single school as before. Command-line jobs run against the district unless
+SCHOOL=<slug> is set.
+
+Each tenant has its own backend (with its own connection pool on PostgreSQL),
+created and initialized on first use, and its own live-event bus. A school's
+database starts with empty tables and no accounts; its first admin is made
+with SCHOOL=<slug> flask create-admin <username>. fan_out()
+runs a function against every school's database in parallel for district
+reports.
+"""
+import contextlib
+import contextvars
+import json
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from database import create_backend
+from events import EventBus
+
+# Settings each school has its own value for
+TENANT_SETTINGS = ('DATABASE', 'DATABASE_URL', 'DATABASE_REPLICA_URLS', 'UPLOAD_FOLDER', 'DERIVATIVES_FOLDER',
+                   'ARCHIVE_FOLDER', 'REPORTS_FOLDER', 'BACKUP_FOLDER')
+
+PATH_PREFIX = re.compile(r'/s/([a-z0-9][a-z0-9-]*)(?=/|$)')
+ENVIRON_KEY = 'school.slug'
+
+_current = contextvars.ContextVar('tenant', default=None)
+
+
+class Tenant:
+    def __init__(self, slug, name, settings, hosts=(), bus=None):
+        self.slug = slug
+        self.name = name
+        self.settings = settings
+        self.hosts = {host.lower() for host in hosts}
+        self.bus = bus or EventBus()
+        self.setup = None
+        # ReplicaSet of the tenant's database, if it has replicas (see replicas.py)
+        self.replicas = None
+        # Dispatcher sending the tenant's notification outbox (see notifications.py)
+        self.notifications = None
+        self._backend = None
+        self._ready = False
+        self._lock = threading.RLock()
+
+    def backend(self):
+        """The tenant's database backend, created and set up on first use"""
+        if not self._ready:
+            with self._lock:
+                # setup() itself connects; on this thread it gets the backend being set up
+                if self._backend is None:
+                    self._backend = create_backend(self.settings['DATABASE_URL'], self.settings['DATABASE'])
+                    try:
+                        if self.setup is not None:
+                            self.setup(self)
+                    except Exception:
+                        self._backend.close()
+                        self._backend = None
+                        raise
+                    self._ready = True
+        return self._backend
+
+    def connect(self):
+        return self.backend().connect()
+
+    def __repr__(self):
+        return f'Tenant({self.slug!r})'
+
+
+class Tenants:
+    def __init__(self, district, schools=()):
+        self.district = district
+        self.schools = {school.slug: school for school in schools}
+        self._hosts = {host: school for school in schools for host in school.hosts}
+        self.default = district
+
+    @classmethod
+    def load(cls, path, base_settings, root='schools', district_bus=None):
+        """The district (using base_settings itself) plus the schools listed in the JSON file at path"""
+        district = Tenant(None, 'District', base_settings, bus=district_bus)
+        if not path:
+            return cls(district)
+        with open(path) as f:
+            entries = json.load(f)
+        schools = []
+        for slug, entry in entries.items():
+            if not PATH_PREFIX.fullmatch(f'/s/{slug}'):
+                raise ValueError(f'Invalid school slug {slug!r}: use lower-case letters, digits and dashes.')
+            folder = os.path.join(root, slug)
+            settings = {
+                'DATABASE': os.path.join(folder, 'results.db'),
+                'DATABASE_URL': '',
+                'DATABASE_REPLICA_URLS': '',
+                'UPLOAD_FOLDER': os.path.join(folder, 'uploads'),
+                'DERIVATIVES_FOLDER': os.path.join(folder, 'uploads', 'derived'),
+                'ARCHIVE_FOLDER': os.path.join(folder, 'archive'),
+                'REPORTS_FOLDER': os.path.join(folder, 'reports'),
+                'BACKUP_FOLDER': os.path.join(folder, 'backups'),
+            }
+            settings.update({key: entry[key.lower()] for key in TENANT_SETTINGS if key.lower() in entry})
+            schools.append(Tenant(slug, entry.get('name', slug), settings, entry.get('hosts', ())))
+        return cls(district, schools)
+
+    @property
+    def enabled(self):
+        return bool(self.schools)
+
+    def all(self):
+        return [self.district] + list(self.schools.values())
+
+    def get(self, slug):
+        return self.district if slug is None else self.schools.get(slug)
+
+    def resolve(self, environ):
+        """Tenant of a request: path prefix first, then host, then the district"""
+        slug = environ.get(ENVIRON_KEY)
+        if slug in self.schools:
+            return self.schools[slug]
+        host = environ.get('HTTP_HOST', '').split(':', 1)[0].lower()
+        return self._hosts.get(host, self.district)
+
+    def current(self):
+        return _current.get() or self.default
+
+    def activate(self, tenant):
+        """Make tenant current until deactivate(token)"""
+        return _current.set(tenant)
+
+    def deactivate(self, token):
+        _current.reset(token)
+
+    @contextlib.contextmanager
+    def using(self, tenant):
+        token = self.activate(tenant)
+        try:
+            yield tenant
+        finally:
+            self.deactivate(token)
+
+    def fan_out(self, fn, tenants=None, workers=8):
+        """Run fn(tenant, conn) against every school in parallel.
+
+        Returns [(tenant, result, error)] in school order; a school whose
+        database fails gives its exception as error instead of failing the rest.
+        """
+        tenants = list(self.schools.values()) if tenants is None else tenants
+
+        def run(tenant):
+            with self.using(tenant):
+                conn = tenant.connect()
+                try:
+                    return fn(tenant, conn)
+                finally:
+                    conn.close()
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(tenants)))) as pool:
+            futures = [(tenant, pool.submit(run, tenant)) for tenant in tenants]
+            results = []
+            for tenant, future in futures:
+                try:
+                    results.append((tenant, future.result(), None))
+                except Exception as e:
+                    results.append((tenant, None, e))
+        return results
+
+
+class PathPrefixMiddleware:
+    """Serve /s/<slug>/... as school <slug>.
+
+    The prefix moves from PATH_INFO to SCRIPT_NAME, so routes match as usual
+    and url_for() builds links that keep the prefix.
+    """
+
+    def __init__(self, wsgi_app, tenants):
+        self.wsgi_app = wsgi_app
+        self.tenants = tenants
+
+    def __call__(self, environ, start_response):
+        match = PATH_PREFIX.match(environ.get('PATH_INFO', ''))
+        if match and match.group(1) in self.tenants.schools:
+            environ[ENVIRON_KEY] = match.group(1)
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + match.group(0)
+            environ['PATH_INFO'] = environ['PATH_INFO'][match.end():] or '/'
+        return self.wsgi_app(environ, start_response)
@@ -0,0 +1,16 @@
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Modules that import app get a throwaway SQLite database and working directory
+WORKDIR = tempfile.mkdtemp(prefix='tests_')
+os.environ['RESULTS_DB'] = os.path.join(WORKDIR, 'results.db')
+os.environ.pop('DATABASE_URL', None)
+os.chdir(WORKDIR)
+
+
+def pytest_addoption(parser):
+    parser.addoption('--update-baseline', action='store_true',
+                     help='Accept the current query plans and counts into tests/query_plans_baseline.json')
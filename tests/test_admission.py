@@ -0,0 +1,34 @@
+# tests/test_admission.py
+"""Priority classes of Flask requests come from the signed session only."""
+import contextlib
+import io
+
+import pytest
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app as flask_app
+from admission import AdmissionControl
+
+
+@pytest.fixture
+def gates(monkeypatch):
+    control = AdmissionControl()
+    monkeypatch.setattr(flask_app, 'admission_control', control)
+    monkeypatch.setitem(flask_app.app.config, 'ADMISSION_CONTROL', True)
+    return control
+
+
+def test_login_form_role_does_not_raise_priority(gates):
+    client = flask_app.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'wrong', 'role': 'admin'})
+    admitted = gates.metrics()['login']['admitted']
+    assert (admitted['admin'], admitted['student']) == (0, 1)
+
+
+def test_signed_in_admin_gets_admin_priority(gates):
+    client = flask_app.app.test_client()
+    with client.session_transaction() as session:
+        session.update(user_id=1, username='admin', role='admin', full_name='Admin')
+    client.get('/admin/dashboard')
+    admitted = gates.metrics()['all']['admitted']
+    assert (admitted['admin'], admitted['student']) == (1, 0)
@@ -0,0 +1,62 @@
+# tests/test_archive.py
+"""Reading archived years from their per-year SQLite files."""
+import os
+import sqlite3
+
+import pytest
+
+import database as db
+from archive import archive_year, restore_year, results_source
+from changelog import changes_since, latest_seq
+
+
+@pytest.fixture
+def conn(tmp_path):
+    backend = db.SQLiteBackend(str(tmp_path / 'results.db'))
+    conn = backend.connect()
+    backend.create_tables(conn)
+    db.insert_student(conn, 'S1001', 'Thandi Mokoena', 's1001@school.example.com', 'Grade 12', 2024,
+                      '2007-03-14', '082 555 0101', '12 Main Road')
+    db.insert_result(conn, 'S1001', 'MATH', 'Mathematics', 'HL', 'B', 4, 'Semester 1', '2023', None)
+    db.insert_result(conn, 'S1001', 'ENG', 'English', 'HL', 'A', 4, 'Semester 1', '2024', None)
+    conn.commit()
+    yield conn
+    conn.close()
+    backend.close()
+
+
+@pytest.fixture
+def old_archive(conn, tmp_path):
+    """2023 archived to a file without grade_points, as years archived before that column existed are"""
+    path = archive_year(conn, '2023', str(tmp_path / 'archive'))['db_path']
+    os.chmod(path, 0o644)
+    year_file = sqlite3.connect(path)
+    year_file.execute('ALTER TABLE results DROP COLUMN grade_points')
+    year_file.close()
+    return path
+
+
+@pytest.mark.parametrize('academic_year', ['2023', ''])
+def test_old_year_file_reads_missing_columns_as_null(conn, old_archive, academic_year):
+    rows = conn.execute(f'''
+        SELECT course_code, grade, grade_points FROM {results_source(conn, academic_year)} r
+        WHERE academic_year = '2023'
+    ''').fetchall()
+    assert [tuple(row) for row in rows] == [('MATH', 'B', None)]
+
+
+def test_archive_and_restore_are_logged(conn, tmp_path):
+    after = latest_seq(conn)
+    archive_year(conn, '2023', str(tmp_path / 'archive'), changed_by='cli')
+    archived = changes_since(conn, after)
+    assert [(c['table_name'], c['row_id'], c['action']) for c in archived] == [
+        ('results', '1', 'delete'), ('archived_years', '2023', 'insert')]
+    assert archived[0]['old_data']['course_code'] == 'MATH' and archived[0]['changed_by'] == 'cli'
+    assert archived[1]['new_data']['result_count'] == 1
+
+    after = latest_seq(conn)
+    restore_year(conn, '2023', changed_by='cli')
+    restored = changes_since(conn, after)
+    assert [(c['table_name'], c['row_id'], c['action']) for c in restored] == [
+        ('results', '1', 'insert'), ('archived_years', '2023', 'delete')]
+    assert restored[0]['new_data']['grade_points'] == 3.0
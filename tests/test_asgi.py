@@ -0,0 +1,157 @@
+# tests/test_asgi.py
+"""The native routes of asgi.py pass the gates of Flask's before_request hooks.
+
+Downloads and uploads served on the event loop are queued by admission
+control and written to the traffic capture like every Flask route. The
+event stream is exempt from both, and native routes are never profiled.
+"""
+import asyncio
+import contextlib
+import io
+import json
+
+import pytest
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app as flask_app  # noqa: E402
+    import asgi  # noqa: E402
+import database as db  # noqa: E402
+from admission import AdmissionControl  # noqa: E402
+from traffic import Recorder  # noqa: E402
+
+STUDENT = {'user_id': 2, 'username': 'S1001', 'role': 'student', 'student_id': 'S1001', 'full_name': 'Rendani Mudau',
+           'program': 'Grade 12', 'year': 2023}
+
+
+@pytest.fixture(scope='module')
+def application():
+    application = asgi.AsyncApplication(flask_app.app, readers=1, threads=4)
+    yield application
+    application.db.close()
+
+
+@pytest.fixture
+def document(tmp_path):
+    path = tmp_path / 'transcript.txt'
+    path.write_text('Mathematics: A\n')
+    conn = flask_app.get_db_connection()
+    doc_id = db.insert_document(conn, 'S1001', 'transcript.txt', 'Transcript', str(path), '2024-06-01 10:00:00')
+    conn.commit()
+    conn.close()
+    return doc_id
+
+
+@pytest.fixture
+def gates(monkeypatch):
+    control = AdmissionControl()
+    monkeypatch.setattr(asgi, 'admission_control', control)
+    monkeypatch.setitem(flask_app.app.config, 'ADMISSION_CONTROL', True)
+    return control
+
+
+@pytest.fixture
+def capture(monkeypatch, tmp_path):
+    recorder = Recorder(str(tmp_path / 'capture.jsonl'), 'test key')
+    monkeypatch.setattr(asgi, 'recorder', recorder)
+
+    def entries():
+        recorder.flush()
+        with open(recorder.path) as f:
+            return [json.loads(line) for line in f]
+    return entries
+
+
+def call(application, method, path, session=None, body=b'', content_type=None):
+    """Send one request through the ASGI app. Returns (status, headers, body)."""
+    headers = [(b'host', b'localhost')]
+    if session is not None:
+        headers.append((b'cookie', application.session_cookie(session).split(';', 1)[0].encode('latin1')))
+    if content_type:
+        headers += [(b'content-type', content_type.encode('latin1')), (b'content-length', str(len(body)).encode())]
+    scope = {'type': 'http', 'method': method, 'path': path, 'root_path': '', 'query_string': b'',
+             'headers': headers, 'scheme': 'http', 'server': ('localhost', 80), 'http_version': '1.1'}
+    messages = []
+    received = []
+
+    async def receive():
+        if not received:
+            received.append(True)
+            return {'type': 'http.request', 'body': body, 'more_body': False}
+        return {'type': 'http.disconnect'}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(application(scope, receive, send))
+    start = messages[0]
+    return (start['status'], dict(start['headers']),
+            b''.join(message.get('body', b'') for message in messages[1:]))
+
+
+def multipart(fields, filename, content):
+    boundary = 'test-boundary'
+    parts = [f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+             for name, value in fields.items()]
+    parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="document"; filename="{filename}"\r\n'
+                 f'Content-Type: text/plain\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def test_download_is_admitted_and_releases_its_slot(application, document, gates):
+    status, _, body = call(application, 'GET', f'/download/{document}', STUDENT)
+    assert (status, body) == (200, b'Mathematics: A\n')
+    metrics = gates.metrics()
+    assert metrics['all']['admitted']['student'] == 1
+    assert metrics['all']['active'] == 0
+
+
+def test_download_rejected_when_the_gate_is_full(application, document, monkeypatch):
+    monkeypatch.setattr(asgi, 'admission_control', AdmissionControl(gates={'all': (0, 0, 1)}))
+    monkeypatch.setitem(flask_app.app.config, 'ADMISSION_CONTROL', True)
+    status, headers, body = call(application, 'GET', f'/download/{document}', STUDENT)
+    assert status == 503
+    assert int(headers[b'retry-after']) >= 1
+    assert body.decode() == flask_app.BUSY_MESSAGE
+
+
+def test_upload_goes_through_the_uploads_gate(application, gates, monkeypatch, tmp_path):
+    monkeypatch.setitem(flask_app.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    body, content_type = multipart({'doc_type': 'Transcript'}, 'report.txt', b'Term 1 report')
+    status, headers, _ = call(application, 'POST', '/student/upload', STUDENT, body, content_type)
+    assert status == 302
+    metrics = gates.metrics()
+    assert metrics['uploads']['admitted']['upload'] == 1
+    assert metrics['uploads']['active'] == metrics['all']['active'] == 0
+
+
+def test_native_routes_are_captured(application, document, capture, monkeypatch, tmp_path):
+    monkeypatch.setitem(flask_app.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    call(application, 'GET', f'/download/{document}', STUDENT)
+    body, content_type = multipart({'doc_type': 'Transcript'}, 'report.txt', b'Term 1 report')
+    call(application, 'POST', '/student/upload', STUDENT, body, content_type)
+
+    download, upload = capture()
+    assert download['ep'] == 'download_document'
+    assert download['rule'] == '/download/<int:doc_id>'
+    assert download['args'] == {'doc_id': document}
+    assert download['st'] == 200 and download['role'] == 'student'
+    assert download['actor'].startswith('@') and 'S1001' not in json.dumps(download)
+    assert upload['ep'] == 'upload_document' and upload['st'] == 302
+    assert upload['f'] == {'doc_type': 'Transcript'}
+    assert upload['files'] == {'document': ['txt', len(b'Term 1 report')]}
+
+
+def test_native_routes_are_not_profiled(application, document, monkeypatch):
+    started = []
+    monkeypatch.setattr(flask_app.profiler, 'start', lambda endpoint: started.append(endpoint))
+    monkeypatch.setattr(flask_app.profiler, 'routes', {'download_document'})
+    status, _, _ = call(application, 'GET', f'/download/{document}', STUDENT)
+    assert status == 200
+    assert started == []
+
+
+def test_event_stream_is_exempt():
+    assert 'admin_events' in flask_app.ADMISSION_EXEMPT
+    assert 'admin_events' in flask_app.CAPTURE_EXEMPT
+    assert 'admin_events' in flask_app.PROFILER_EXEMPT
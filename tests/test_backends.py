@@ -0,0 +1,216 @@
+# tests/test_backends.py
+"""The data-access helpers against both backends.
+
+Every test runs once on SQLiteBackend, with a file in a temporary directory,
+and once on PostgresBackend. PostgreSQL is TEST_DATABASE_URL when set (the
+tables in it are dropped), otherwise a throwaway server started with
+pgserver; without either the postgresql runs are skipped.
+
+    python -m pytest tests
+"""
+import os
+import tempfile
+
+import pytest
+
+import database as db
+from changelog import changes_since, latest_seq
+from document_index import search_documents, store_text
+
+
+@pytest.fixture(scope='session')
+def postgres_url():
+    url = os.environ.get('TEST_DATABASE_URL')
+    if url:
+        yield url
+        return
+    pgserver = pytest.importorskip('pgserver')
+    pytest.importorskip('psycopg_pool')
+    server = pgserver.get_server(tempfile.mkdtemp(prefix='test_pg_'), cleanup_mode='stop')
+    yield server.get_uri()
+    server.cleanup()
+
+
+@pytest.fixture(params=['sqlite', 'postgresql'])
+def backend(request, tmp_path):
+    if request.param == 'sqlite':
+        backend = db.SQLiteBackend(str(tmp_path / 'results.db'))
+    else:
+        backend = db.PostgresBackend(request.getfixturevalue('postgres_url'), max_size=2)
+    backend.reset()
+    conn = backend.connect()
+    backend.create_tables(conn)
+    conn.commit()
+    conn.close()
+    yield backend
+    backend.reset()
+    backend.close()
+
+
+@pytest.fixture
+def conn(backend):
+    conn = backend.connect()
+    yield conn
+    conn.close()
+
+
+def add_student(conn, student_id='S1001', full_name='Thandi Mokoena'):
+    db.insert_student(conn, student_id, full_name, f'{student_id.lower()}@school.example.com', 'Grade 12', 2024,
+                      '2007-03-14', '082 555 0101', '12 Main Road', changed_by='admin')
+
+
+def test_student_insert_update_delete(conn):
+    add_student(conn)
+    conn.commit()
+    student = db.get_student(conn, 'S1001')
+    assert student['full_name'] == 'Thandi Mokoena'
+    assert student['year'] == 2024
+
+    db.update_student(conn, 'S1001', 'Thandi Dlamini', 's1001@school.example.com', 'Grade 12', 2024,
+                      '2007-03-14', '082 555 0101', '12 Main Road', changed_by='admin')
+    conn.commit()
+    assert db.get_student(conn, 'S1001')['full_name'] == 'Thandi Dlamini'
+
+    db.delete_student(conn, 'S1001', changed_by='admin')
+    conn.commit()
+    assert db.get_student(conn, 'S1001') is None
+
+
+def test_result_insert_update_delete(conn):
+    add_student(conn)
+    result_id = db.insert_result(conn, 'S1001', 'MATH', 'Mathematics', 'HL', 'B', 4, 'Semester 1', '2024', None,
+                                 changed_by='admin')
+    conn.commit()
+    result = db.find_result(conn, 'S1001', 'MATH', 'Semester 1', '2024')
+    assert result['id'] == result_id
+    assert result['grade_points'] == 3.0
+    assert result['course_id'] is not None
+
+    db.update_result(conn, result_id, 'MATH', 'Mathematics', 'HL', 'A', 4, 'Semester 1', '2024', "Top of the class",
+                     changed_by='admin')
+    conn.commit()
+    result = db.get_result_with_student(conn, result_id)
+    assert (result['grade'], result['grade_points'], result['remark']) == ('A', 4.0, 'Top of the class')
+    assert result['full_name'] == 'Thandi Mokoena'
+
+    db.delete_result(conn, result_id, changed_by='admin')
+    conn.commit()
+    assert db.find_result(conn, 'S1001', 'MATH', 'Semester 1', '2024') is None
+
+
+def test_delete_students_removes_their_rows(conn):
+    add_student(conn, 'S1001')
+    add_student(conn, 'S1002', 'Sipho Ndlovu')
+    db.insert_result(conn, 'S1001', 'MATH', 'Mathematics', 'HL', 'B', 4, 'Semester 1', '2024', None)
+    db.insert_document(conn, 'S1001', 'report.pdf', 'Report', 'uploads/report.pdf', '2024-06-01')
+    conn.commit()
+
+    assert db.delete_students(conn, ['S1001', 'S1002', 'S9999']) == 2
+    conn.commit()
+    assert conn.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 0
+    assert conn.execute('SELECT COUNT(*) FROM documents').fetchone()[0] == 0
+    assert db.document_counts(conn) == {'Pending': 0}
+
+
+def test_review_documents(conn):
+    add_student(conn)
+    doc_ids = [db.insert_document(conn, 'S1001', f'doc{i}.pdf', 'Report', f'uploads/doc{i}.pdf', '2024-06-01')
+               for i in range(5)]
+    conn.commit()
+    assert db.document_counts(conn) == {'Pending': 5}
+
+    # chunk_size=2 runs the UPDATE in three chunks; unknown and repeated ids are ignored
+    updated = db.review_documents(conn, doc_ids[:3] + [doc_ids[0], 99999], 'Approved', 'Looks good', 'admin',
+                                  chunk_size=2)
+    conn.commit()
+    assert updated == 3
+    assert db.document_counts(conn) == {'Pending': 2, 'Approved': 3}
+    document = db.get_document(conn, doc_ids[0])
+    assert (document['status'], document['feedback'], document['reviewed_by']) == ('Approved', 'Looks good', 'admin')
+    assert document['reviewed_at'] is not None
+    notices = conn.execute("SELECT COUNT(*) FROM notifications WHERE student_id = 'S1001'").fetchone()[0]
+    assert notices == 3
+
+    db.refresh_document_counts(conn)
+    assert db.document_counts(conn) == {'Pending': 2, 'Approved': 3}
+
+
+def test_search_documents(conn):
+    add_student(conn)
+    first = db.insert_document(conn, 'S1001', 'transcript.pdf', 'Transcript', 'uploads/transcript.pdf', '2024-06-01')
+    second = db.insert_document(conn, 'S1001', 'letter.pdf', 'Letter', 'uploads/letter.pdf', '2024-06-01')
+    store_text(conn, first, 'transcript.pdf', 'Mathematics distinction awarded to Thandi', 'pdf')
+    store_text(conn, second, 'letter.pdf', 'Recommendation letter for university admission', 'pdf')
+    conn.commit()
+
+    assert set(search_documents(conn, 'mathematics')) == {first}
+    assert set(search_documents(conn, 'univ*')) == {second}
+    assert search_documents(conn, 'mathematics university') == {}
+    assert search_documents(conn, '***') == {}
+
+    store_text(conn, first, 'transcript.pdf', 'Physical sciences distinction', 'pdf')
+    conn.commit()
+    assert search_documents(conn, 'mathematics') == {}
+    assert set(search_documents(conn, 'distinction')) == {first}
+
+
+def test_search_documents_within_filter(conn):
+    add_student(conn)
+    doc_ids = [db.insert_document(conn, 'S1001', f'report{i}.pdf', 'Report', f'uploads/report{i}.pdf', '2024-06-01')
+               for i in range(3)]
+    for doc_id in doc_ids:
+        store_text(conn, doc_id, f'report{doc_id}.pdf', 'Term report with mathematics results', 'pdf')
+    db.update_document_status(conn, doc_ids[2], 'Approved', '', 'admin')
+    conn.commit()
+
+    # The filter is applied before the limit, so the one approved match is found
+    approved = search_documents(conn, 'mathematics', limit=1,
+                                filters=' AND d.status = ?', filter_params=['Approved'])
+    assert set(approved) == {doc_ids[2]}
+    assert len(search_documents(conn, 'mathematics', limit=2)) == 2
+
+
+def test_change_log(conn):
+    assert latest_seq(conn) == 0
+    add_student(conn)
+    result_id = db.insert_result(conn, 'S1001', 'MATH', 'Mathematics', 'HL', 'B', 4, 'Semester 1', '2024', None,
+                                 changed_by='admin')
+    conn.commit()
+    after_insert = latest_seq(conn)
+
+    db.update_result(conn, result_id, 'MATH', 'Mathematics', 'HL', 'C', 4, 'Semester 1', '2024', None,
+                     changed_by='teacher')
+    db.delete_result(conn, result_id, changed_by='teacher')
+    conn.commit()
+
+    changes = changes_since(conn)
+    assert [(c['table_name'], c['action']) for c in changes] == [
+        ('students', 'insert'), ('results', 'insert'), ('results', 'update'), ('results', 'delete')]
+    assert [c['seq'] for c in changes] == sorted(c['seq'] for c in changes)
+    assert changes[0]['new_data']['full_name'] == 'Thandi Mokoena'
+
+    update, delete = changes_since(conn, after_insert)
+    assert (update['row_id'], update['changed_by']) == (str(result_id), 'teacher')
+    assert (update['old_data']['grade'], update['new_data']['grade']) == ('B', 'C')
+    assert delete['old_data']['grade'] == 'C' and delete['new_data'] is None
+    assert changes_since(conn, table_name='students', row_id='S1001')[0]['action'] == 'insert'
+    assert changes_since(conn, limit=1) == changes[:1]
+
+
+def test_question_marks_and_percents_in_literals(conn):
+    add_student(conn)
+    conn.commit()
+    # Quoted text is passed through as written: no placeholder inside it, % kept as one character
+    row = conn.execute("SELECT 'Why? 100%' AS note, full_name FROM students WHERE student_id = ?",
+                       ('S1001',)).fetchone()
+    assert tuple(row) == ('Why? 100%', 'Thandi Mokoena')
+    assert conn.execute("SELECT COUNT(*) FROM students WHERE full_name LIKE ? AND 'it''s?' <> ?",
+                        ('thandi%', 'x')).fetchone()[0] == 1
+
+
+def test_translate():
+    assert db.translate("SELECT * FROM t WHERE a = ? AND b = 'why?'") == "SELECT * FROM t WHERE a = %s AND b = 'why?'"
+    assert db.translate("SELECT 'it''s ?', ? FROM t") == "SELECT 'it''s ?', %s FROM t"
+    assert db.translate("SELECT '50%' WHERE a LIKE ?") == "SELECT '50%%' WHERE a ILIKE %s"
+    assert db.translate("SELECT 'LIKE CURRENT_TIMESTAMP'") == "SELECT 'LIKE CURRENT_TIMESTAMP'"
+    assert db.translate('SELECT CURRENT_TIMESTAMP') == f'SELECT {db.PG_NOW}'
@@ -0,0 +1,295 @@
+# tests/test_query_plans.py
+"""Query-plan regression check: fails when a route starts scanning a big table.
+
+Seeds a throwaway SQLite database with STUDENTS learners, their results and
+documents, then requests every GET route through the Flask test client, the
+list pages once per combination of their filters. Every statement a request
+runs is captured (SQLiteBackend.trace) and explained with EXPLAIN QUERY PLAN.
+A statement is a problem when, on a table holding more than the baseline's
+threshold of rows, it
+
+* scans the table without an index (SCAN results),
+* builds an automatic index over it, or
+* sorts or groups with a temp B-tree while reading the whole table.
+
+The number of statements each request runs is compared with the baseline
+too, so a route that starts issuing a query per row fails as well.
+
+Problems already known are listed in query_plans_baseline.json next to this
+module, with the query count of every route; the tests fail only on new
+problems and on routes that run more queries than their baseline. After a
+deliberate change, rewrite the baseline and commit it:
+
+    python -m pytest tests/test_query_plans.py --update-baseline
+"""
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import re
+import sqlite3
+from urllib.parse import urlencode
+
+import pytest
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app as flask_app
+import database as db
+from grading import GRADE_TO_POINTS
+from tenancy import TENANT_SETTINGS, Tenant
+
+app = flask_app.app
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_plans_baseline.json')
+
+# Enough rows that students, results and documents are all above the threshold
+STUDENTS = 2000
+RESULTS_PER_STUDENT = 4
+
+# Routes that change data, never finish (the event stream) or dump whole tables on purpose
+SKIP_ENDPOINTS = {'static', 'logout', 'delete_student', 'delete_result', 'reset_db', 'admin_events', 'debug_users',
+                  'debug_students'}
+
+STUDENT_ID = 'B000000'
+
+# Arguments for routes with URL parameters
+ROUTE_ARGUMENTS = {'student_id': STUDENT_ID, 'result_id': 1, 'doc_id': 1, 'subject_category': 'Mathematics',
+                   'kind': 'thumbnail', 'view': 'analytics', 'fmt': 'txt'}
+
+# Every combination of these filters is requested on its page
+FILTERS = {
+    '/admin/results': {'course': 'math', 'grade': 'A', 'semester': 'Term 1', 'year': '2024', 'subject': 'Math',
+                       'student': 'B0001'},
+    '/admin/students': {'search': 'B0001', 'program': 'Grade 11', 'year': '2024'},
+    '/admin/documents': {'status': 'Pending', 'doc_type': 'ID', 'student': 'B0001', 'q': 'report'},
+    '/student/results': {'year': '2024', 'semester': 'Term 1'},
+    '/api/v1/results': {'academic_year': '2024', 'semester': 'Term 1', 'format': 'ndjson'},
+    '/api/changes': {'table': 'results', 'row_id': '1'},
+    '/admin/queries': {'status': 'All', 'before': '100'},
+    '/api/v1/projections': {'course_code': 'MATH', 'grade': 'B+'},
+    '/student/what-if': {'course_code': 'MATH', 'grade': 'B+'},
+    '/student/dashboard': {'course_code': 'MATH', 'grade': 'B+'},
+}
+
+# Parameters sent with every request to a page, whichever filters are combined with them
+REQUIRED_PARAMETERS = {
+    '/api/v1/projections': {'program': 'Grade 11', 'year': '2024', 'credits': '4'},
+    '/student/what-if': {'credits': '4'},
+    '/student/dashboard': {'credits': '4'},
+}
+
+DOC_TYPES = ['ID', 'Report', 'Transcript', 'Certificate']
+
+# Statements worth explaining; BEGIN, COMMIT, PRAGMA and DDL are not
+EXPLAINABLE = re.compile(r'\s*(SELECT|WITH|INSERT|UPDATE|DELETE)\b', re.IGNORECASE)
+TABLE_REFERENCE = re.compile(r'\b(?:FROM|JOIN|UPDATE|INTO)\s+([A-Za-z_][\w.]*)(?:\s+(?:AS\s+)?(?!ON\b|WHERE\b|JOIN\b|'
+                             r'LEFT\b|INNER\b|GROUP\b|ORDER\b|LIMIT\b|SET\b|USING\b|VALUES\b)([A-Za-z_]\w*))?',
+                             re.IGNORECASE)
+PLAN_SCAN = re.compile(r'SCAN (\S+)')
+PLAN_SEARCH = re.compile(r'SEARCH (\S+)')
+
+
+def seed(students, results_per_student):
+    conn = flask_app.get_db_connection()
+    ids = [f'B{i:06d}' for i in range(students)]
+    conn.executemany('''
+        INSERT INTO students (student_id, full_name, email, program, year)
+        VALUES (?, ?, ?, ?, ?)
+    ''', [(student_id, f'Bench {student_id}', f'{student_id}@example.com', f'Grade {8 + i % 5}', 2023 + i % 2)
+          for i, student_id in enumerate(ids)])
+    grades = list(GRADE_TO_POINTS)
+    conn.executemany('''
+        INSERT INTO results (student_id, course_code, course_name, grade, credits, semester, academic_year)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    ''', [(student_id, f'C{n}', f'Course {n}', random.choice(grades), 10, f'Term {1 + n % 4}', str(2023 + n % 2))
+          for student_id in ids for n in range(results_per_student)])
+    conn.executemany('''
+        INSERT INTO documents (student_id, doc_name, doc_type, doc_path, upload_date, status)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [(student_id, f'{student_id}.pdf', random.choice(DOC_TYPES), f'uploads/{student_id}.pdf',
+           '2024-01-01 00:00:00', random.choice(flask_app.DOCUMENT_STATUSES)) for student_id in ids])
+    db.backfill_results(conn)
+    db.refresh_document_counts(conn)
+    conn.commit()
+    conn.close()
+
+
+def requests():
+    """(role, path) of every GET route, the filtered pages once per filter combination"""
+    for rule in sorted(app.url_map.iter_rules(), key=lambda rule: rule.rule):
+        if 'GET' not in rule.methods or rule.endpoint in SKIP_ENDPOINTS:
+            continue
+        path = rule.build({name: ROUTE_ARGUMENTS[name] for name in rule.arguments}, append_unknown=False)[1]
+        role = 'student' if path.startswith('/student/') else 'admin'
+        filters = FILTERS.get(path, {})
+        for size in range(len(filters) + 1):
+            for names in itertools.combinations(filters, size):
+                query = urlencode({**REQUIRED_PARAMETERS.get(path, {}), **{name: filters[name] for name in names}})
+                yield role, f'{path}?{query}' if query else path
+
+
+def client(role):
+    c = app.test_client()
+    with c.session_transaction() as s:
+        if role == 'admin':
+            s.update(user_id=1, username='admin', role='admin', full_name='Admin')
+        else:
+            s.update(user_id=2, username=STUDENT_ID, role='student', student_id=STUDENT_ID,
+                     full_name=f'Bench {STUDENT_ID}', program='Grade 8', year=2023)
+    return c
+
+
+def fingerprint(sql):
+    """Statement with its literals replaced, so the same query with other values matches"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(\.\d+)?\b', '?', sql)
+    sql = re.sub(r'\?(\s*,\s*\?)+', '?...', sql)
+    return ' '.join(sql.split())
+
+
+def table_names(sql):
+    """{name or alias used in the plan: table}"""
+    names = {}
+    for table, alias in TABLE_REFERENCE.findall(sql):
+        table = table.split('.')[-1]
+        names[table] = table
+        if alias:
+            names[alias] = table
+    return names
+
+
+def problems(conn, sql, sizes, threshold):
+    """Descriptions of what is wrong with the plan of one statement"""
+    try:
+        plan = [row[3] for row in conn.execute('EXPLAIN QUERY PLAN ' + sql)]
+    except sqlite3.Error:
+        return []
+    names = table_names(sql)
+    found = []
+    whole_table = False
+    for detail in plan:
+        scan = PLAN_SCAN.match(detail)
+        search = PLAN_SEARCH.match(detail)
+        table = names.get((scan or search).group(1)) if scan or search else None
+        big = table is not None and sizes.get(table, 0) > threshold
+        if scan and big:
+            whole_table = True
+            if 'INDEX' not in detail:
+                found.append(f'full scan of {table}: {detail}')
+        if big and 'AUTOMATIC' in detail:
+            found.append(f'automatic index on {table}: {detail}')
+    if whole_table:
+        found.extend(f'sort of a whole table: {detail}' for detail in plan if 'TEMP B-TREE' in detail)
+    return found
+
+
+def table_sizes(database):
+    explain = sqlite3.connect(database)
+    try:
+        return {name: explain.execute(f'SELECT COUNT(*) FROM "{name}"').fetchone()[0]
+                for name, in explain.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    finally:
+        explain.close()
+
+
+def check(tenant, threshold):
+    """{request: {'queries': n, 'problems': {fingerprint: [problem]}}}"""
+    backend = tenant.backend()
+    sizes = table_sizes(tenant.settings['DATABASE'])
+    explain = sqlite3.connect(tenant.settings['DATABASE'])
+    clients = {'admin': client('admin'), 'student': client('student')}
+    report = {}
+    for role, path in requests():
+        statements = []
+        backend.trace = statements.append
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                response = clients[role].get(path)
+                response.get_data()
+                response.close()
+            status = response.status_code
+        except Exception as e:
+            # The error pages themselves may fail; the plans of what ran are still checked
+            status = f'{type(e).__name__}: {e}'.splitlines()[0]
+        finally:
+            backend.trace = None
+        executed = [sql for sql in statements if EXPLAINABLE.match(sql)]
+        found = {}
+        for sql in dict.fromkeys(executed):
+            issues = problems(explain, sql, sizes, threshold)
+            if issues:
+                found.setdefault(fingerprint(sql), []).extend(issues)
+        report[f'GET {path}'] = {'status': status, 'queries': len(executed),
+                                 'problems': {key: sorted(set(value)) for key, value in found.items()}}
+    explain.close()
+    return report
+
+
+def write_baseline(report, threshold):
+    known = {}
+    for entry in report.values():
+        for key, issues in entry['problems'].items():
+            known[key] = sorted(set(known.get(key, [])) | set(issues))
+    with open(BASELINE, 'w') as f:
+        json.dump({'threshold': threshold,
+                   'queries': {request: entry['queries'] for request, entry in report.items()},
+                   'known_problems': dict(sorted(known.items()))}, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+
+@pytest.fixture(scope='module')
+def baseline():
+    with open(BASELINE) as f:
+        return json.load(f)
+
+
+@pytest.fixture(scope='module')
+def district(tmp_path_factory):
+    """A district tenant of its own, so the seeded rows stay out of the other tests' database"""
+    folder = tmp_path_factory.mktemp('query_plans')
+    settings = dict(flask_app.tenants.district.settings,
+                    **{key: str(folder / key.lower()) for key in TENANT_SETTINGS if key.endswith('_FOLDER')},
+                    DATABASE=str(folder / 'results.db'), DATABASE_URL='', DATABASE_REPLICA_URLS='')
+    tenant = Tenant(None, 'District', settings)
+    tenant.setup = flask_app.setup_tenant
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setattr(flask_app.tenants, 'district', tenant)
+        monkeypatch.setattr(flask_app.tenants, 'default', tenant)
+        # Failing routes are reported once, without their tracebacks
+        monkeypatch.setattr(app.logger, 'disabled', True)
+        with contextlib.redirect_stdout(io.StringIO()):
+            tenant.backend()
+        seed(STUDENTS, RESULTS_PER_STUDENT)
+        yield tenant
+    tenant.notifications.close()
+    tenant.backend().close()
+
+
+@pytest.fixture(scope='module')
+def report(request, district, baseline):
+    report = check(district, baseline['threshold'])
+    if request.config.getoption('--update-baseline'):
+        write_baseline(report, baseline['threshold'])
+    return report
+
+
+def test_seeded_tables_are_big(district, baseline):
+    sizes = table_sizes(district.settings['DATABASE'])
+    assert all(sizes[table] > baseline['threshold'] for table in ('students', 'results', 'documents'))
+
+
+def test_no_new_plan_problems(report, baseline):
+    known = set(baseline['known_problems'])
+    failures = [f'{request}\n    {key}\n    ' + '\n    '.join(issues)
+                for request, entry in report.items()
+                for key, issues in entry['problems'].items() if key not in known]
+    assert not failures, 'New table scans:\n' + '\n'.join(failures)
+
+
+def test_no_route_runs_more_queries(report, baseline):
+    failures = [f"{request}: {entry['queries']} queries, baseline {baseline['queries'][request]}"
+                for request, entry in report.items()
+                if request in baseline['queries'] and entry['queries'] > baseline['queries'][request]]
+    assert not failures, 'Query counts above the baseline:\n' + '\n'.join(failures)
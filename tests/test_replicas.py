@@ -0,0 +1,62 @@
+# tests/test_replicas.py
+"""SQLite read replicas: one set per process, kept current from change_log."""
+import os
+import time
+
+import database as db
+from archive import archive_year, restore_year
+from replicas import SQLiteReplica, create_replicas
+
+
+def test_replicas_are_per_process_and_removed_on_close(tmp_path):
+    backend = db.SQLiteBackend(str(tmp_path / 'results.db'))
+    conn = backend.connect()
+    backend.create_tables(conn)
+    conn.commit()
+    conn.close()
+
+    replicas = create_replicas(backend, copies=2, interval=60)
+    try:
+        paths = [replica.path for replica in replicas.replicas]
+        assert paths == [f'{backend.path}.replica{n}.{os.getpid()}' for n in (1, 2)]
+        # Caught up by the replicas thread
+        while not all(replica.caught_up_at for replica in replicas.replicas):
+            time.sleep(0.01)
+        assert all(os.path.exists(path) for path in paths)
+    finally:
+        replicas.close()
+        backend.close()
+    assert not any(name.startswith('results.db.replica') for name in os.listdir(tmp_path))
+
+
+def test_replica_replays_archived_and_restored_years(tmp_path):
+    backend = db.SQLiteBackend(str(tmp_path / 'results.db'))
+    conn = backend.connect()
+    backend.create_tables(conn)
+    db.insert_student(conn, 'S1001', 'Thandi Mokoena', 's1001@school.example.com', 'Grade 12', 2024,
+                      '2007-03-14', '082 555 0101', '12 Main Road')
+    db.insert_result(conn, 'S1001', 'MATH', 'Mathematics', 'HL', 'B', 4, 'Semester 1', '2023', None)
+    conn.commit()
+
+    replica = SQLiteReplica(backend, str(tmp_path / 'results.db.replica1'))
+    try:
+        replica.catch_up()
+        archive_year(conn, '2023', str(tmp_path / 'archive'))
+        replica.catch_up()
+        copy = replica.connect()
+        assert copy.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 0
+        assert [row[0] for row in copy.execute('SELECT academic_year FROM archived_years')] == ['2023']
+        assert copy.execute('SELECT count FROM archived_grade_counts').fetchall() == [(1,)]
+
+        restore_year(conn, '2023')
+        replica.catch_up()
+        assert copy.execute('SELECT COUNT(*) FROM results').fetchone()[0] == 1
+        assert copy.execute('SELECT COUNT(*) FROM archived_years').fetchone()[0] == 0
+        assert copy.execute('SELECT COUNT(*) FROM archived_grade_counts').fetchone()[0] == 0
+        copy.close()
+        # Replayed from the log, never copied again
+        assert replica.rebuilds == 1
+    finally:
+        replica.close()
+        conn.close()
+        backend.close()
@@ -0,0 +1,56 @@
+# tests/test_tenancy.py
+"""A school's shard is created without sample data; its admin is provisioned from the CLI."""
+import contextlib
+import io
+
+import pytest
+
+with contextlib.redirect_stdout(io.StringIO()):
+    import app as flask_app
+from tenancy import Tenant
+
+
+@pytest.fixture
+def school(tmp_path, monkeypatch):
+    folder = tmp_path / 'north-high'
+    settings = {key: str(folder / value) for key, value in {
+        'DATABASE': 'results.db', 'UPLOAD_FOLDER': 'uploads', 'DERIVATIVES_FOLDER': 'uploads/derived',
+        'ARCHIVE_FOLDER': 'archive', 'REPORTS_FOLDER': 'reports', 'BACKUP_FOLDER': 'backups'}.items()}
+    settings.update(DATABASE_URL='', DATABASE_REPLICA_URLS='')
+    tenant = Tenant('north-high', 'North High', settings)
+    tenant.setup = flask_app.setup_tenant
+    # What SCHOOL=north-high does for command-line jobs
+    monkeypatch.setattr(flask_app.tenants, 'default', tenant)
+    yield tenant
+    tenant.notifications.close()
+    tenant.backend().close()
+
+
+def count(tenant, table):
+    conn = tenant.connect()
+    try:
+        return conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_school_starts_without_sample_data(school):
+    assert [count(school, table) for table in ('users', 'students', 'results')] == [0, 0, 0]
+    assert count(school, 'courses') > 0
+
+
+def test_create_admin(school):
+    runner = flask_app.app.test_cli_runner()
+    result = runner.invoke(args=['create-admin', 'principal', '--email', 'principal@north.example.org',
+                                 '--password', 'a long passphrase'])
+    assert result.exit_code == 0, result.output
+    assert 'North High' in result.output
+
+    conn = school.connect()
+    user = conn.execute("SELECT * FROM users WHERE username = 'principal'").fetchone()
+    conn.close()
+    assert user['role'] == 'admin'
+    assert flask_app.check_password_hash(user['password'], 'a long passphrase')
+
+    again = runner.invoke(args=['create-admin', 'principal', '--password', 'x'])
+    assert again.exit_code != 0 and 'already exists' in again.output
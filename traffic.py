@@ -0,0 +1,192 @@
+# traffic.py
+"""Production traffic capture, replayed by benchmarks/replay_traffic.py for capacity planning.
+
+With TRAFFIC_CAPTURE set to a file, a sample of requests (TRAFFIC_CAPTURE_RATE)
+is written there, one JSON object per line. Each line holds the request's
+shape rather than its contents:
+
+    {"ts": 1760000000.123, "m": "GET", "rule": "/admin/student/<student_id>",
+     "ep": "view_student", "role": "admin", "actor": "@9c1f2e0a4b7d",
+     "args": {"student_id": "@51b0e3aa0c19"}, "q": {"year": "2024"}, "st": 200, "ms": 41.7}
+
+* Filter values with few possible values (year, semester, status, grade,
+  course codes, row ids) are kept, so replayed pages select the same rows.
+* Student ids and usernames become pseudonyms: a keyed HMAC
+  (TRAFFIC_CAPTURE_KEY, else the app's secret key), the same for the same
+  student throughout the file, so one student's visits stay one student's.
+  The replay maps each pseudonym to a student of the snapshot it runs on.
+* Everything else (names, emails, passwords, messages, search text) is
+  reduced to its length, "~12". Uploads are kept as extension and size.
+
+The session's user becomes the line's actor, a pseudonym as well, so the
+replay can send each actor's requests with one session of that role. ms is
+the time from the request arriving to its last byte being sent, streamed
+pages included.
+
+Lines are buffered and appended every FLUSH_LINES requests or FLUSH_SECONDS,
+in one write each, so several worker processes can share the file. A path
+ending in .gz is gzipped, each flush one gzip member (concatenated members
+are a valid gzip file).
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import random
+import threading
+import time
+
+FLUSH_LINES = 200
+FLUSH_SECONDS = 1.0
+
+# Values kept as they are: filters with few distinct values, flags and catalog codes
+KEPT_PARAMS = {'year', 'academic_year', 'semester', 'status', 'program', 'grade', 'course', 'subject', 'subject_level',
+               'subject_category', 'course_code', 'course_name', 'credits', 'doc_type', 'query_type', 'format', 'fields',
+               'limit', 'view', 'fmt', 'kind', 'role', 'table', 'operation', 'action', 'current_status', 'apply',
+               'confirm_duplicate', 'redirect_to_student', 'trace_memory', 'routes', 'sample_percent', 'interval_ms'}
+
+# Row numbers, kept when they are numbers (row_id of a students change is a student id)
+ROW_PARAMS = {'result_id', 'doc_id', 'query_id', 'row_id', 'doc_ids', 'cursor', 'before', 'after'}
+
+# Student ids and usernames, replaced by pseudonyms; ids may be comma-separated lists
+STUDENT_PARAMS = {'student_id', 'student', 'username', 'ids', 'student_ids'}
+
+
+def pseudonym(value, key):
+    return '@' + hmac.new(key, str(value).encode(), hashlib.sha256).hexdigest()[:12]
+
+
+def anonymize(name, value, key):
+    """The recorded form of one parameter value"""
+    if isinstance(value, (list, tuple)):
+        return [anonymize(name, item, key) for item in value]
+    if isinstance(value, dict):
+        return {item: anonymize(item, item_value, key) for item, item_value in value.items()}
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    value = str(value)
+    if name in KEPT_PARAMS:
+        return value
+    if name in ROW_PARAMS and value.isdigit():
+        return value
+    if name in STUDENT_PARAMS or name in ROW_PARAMS:
+        return ','.join(pseudonym(part.strip(), key) for part in value.split(',') if part.strip())
+    return f'~{len(value)}'
+
+
+def _params(multidict, key):
+    params = {}
+    for name in multidict:
+        values = multidict.getlist(name)
+        params[name] = anonymize(name, values if len(values) > 1 else values[0], key)
+    return params
+
+
+def _file_shape(storage):
+    extension = storage.filename.rsplit('.', 1)[1].lower() if '.' in (storage.filename or '') else ''
+    try:
+        stream = storage.stream
+        position = stream.tell()
+        size = stream.seek(0, os.SEEK_END)
+        stream.seek(position)
+    except (AttributeError, OSError, ValueError):
+        size = 0
+    return [extension, size]
+
+
+def request_shape(method, rule, endpoint, view_args, args, session, key, school=None):
+    """The anonymized shape of a request line and its session, without its outcome or body"""
+    role = session.get('role')
+    identity = session.get('student_id') if role == 'student' else session.get('username')
+    entry = {'ts': round(time.time(), 3), 'm': method, 'rule': rule, 'ep': endpoint, 'role': role,
+             'actor': pseudonym(identity, key) if identity else None}
+    if school:
+        entry['school'] = school
+    if view_args:
+        entry['args'] = {name: anonymize(name, value, key) for name, value in view_args.items()}
+    if args:
+        entry['q'] = _params(args, key)
+    return entry
+
+
+def add_form(entry, form, files, key):
+    """Add the shape of a form body to an entry"""
+    if form:
+        entry['f'] = _params(form, key)
+    if files:
+        entry['files'] = {name: _file_shape(storage) for name, storage in files.items()}
+
+
+def describe(request, session, key, school=None):
+    """The anonymized shape of a Flask request, without its outcome"""
+    entry = request_shape(request.method, request.url_rule.rule if request.url_rule is not None else request.path,
+                          request.endpoint, request.view_args, request.args, session, key, school)
+    if request.method not in ('GET', 'HEAD'):
+        if request.is_json:
+            data = request.get_json(silent=True)
+            if data is not None:
+                entry['json'] = anonymize(None, data, key)
+        else:
+            add_form(entry, request.form, request.files, key)
+    return entry
+
+
+class Recorder:
+    """Appends sampled request shapes to a capture file"""
+
+    def __init__(self, path, key, sample_rate=1.0):
+        self.path = path
+        self.key = key.encode() if isinstance(key, str) else key
+        self.sample_rate = sample_rate
+        self.recorded = 0
+        self._lines = []
+        self._flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wants(self):
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def record(self, entry, status, seconds):
+        entry['st'] = status
+        entry['ms'] = round(seconds * 1000, 2)
+        line = json.dumps(entry, separators=(',', ':'))
+        with self._lock:
+            self._lines.append(line)
+            self.recorded += 1
+            if len(self._lines) < FLUSH_LINES and time.monotonic() - self._flushed_at < FLUSH_SECONDS:
+                return
+            lines, self._lines = self._lines, []
+            self._flushed_at = time.monotonic()
+        self._write(lines)
+
+    def flush(self):
+        with self._lock:
+            lines, self._lines = self._lines, []
+            self._flushed_at = time.monotonic()
+        self._write(lines)
+
+    def _write(self, lines):
+        if not lines:
+            return
+        data = ('\n'.join(lines) + '\n').encode()
+        if self.path.endswith('.gz'):
+            data = gzip.compress(data)
+        # One O_APPEND write per batch: batches from several processes never interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+
+def read_capture(*paths):
+    """Entries of one or more capture files, oldest first"""
+    entries = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            gzipped = f.read(2) == b'\x1f\x8b'
+        with (gzip.open(path, 'rt') if gzipped else open(path)) as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    entries.sort(key=lambda entry: entry['ts'])
+    return entries